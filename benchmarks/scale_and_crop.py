@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Compares ``filer.thumbnail_processors.scale_and_crop_with_subject_location``
+with the way it used to work, resizing the whole image before cropping it,
+for sources of several aspect ratios ::
+
+    python benchmarks/scale_and_crop.py
+    python benchmarks/scale_and_crop.py --repeat=10
+
+The time is the best of ``--repeat`` runs, the difference is the mean
+absolute difference of the pixels of both results (0-255).
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa
+
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                           'NAME': ':memory:'}},
+    INSTALLED_APPS=['easy_thumbnails', 'filer'],
+)
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat  # noqa
+
+from filer.thumbnail_processors import (get_subject_crop_box,  # noqa
+                                        resize_and_crop,
+                                        scale_and_crop_with_subject_location)
+
+# source size, thumbnail size, subject location
+CASES = [
+    ((1600, 1200), (200, 200), (800, 600)),
+    ((4000, 3000), (300, 100), (2000, 2500)),
+    ((8000, 1000), (200, 200), (7000, 500)),
+    ((12000, 1500), (300, 300), (1000, 700)),
+    ((1000, 8000), (200, 300), (500, 7500)),
+]
+
+
+def create_image(size):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    step = max(size) // 40
+    for i in range(0, max(size), step):
+        draw.line((i, 0, 0, i), fill=(i % 256, 80, 160), width=step // 3)
+        draw.rectangle((i, i // 2, i + step // 2, i // 2 + step), fill='red')
+    return image
+
+
+def former(im, size, subject_location):
+    """ The former processor: the whole image is resized, then cropped """
+    source_x, source_y = [float(v) for v in im.size]
+    scale = max(size[0] / source_x, size[1] / source_y)
+    scaled_size = (int(source_x * scale), int(source_y * scale))
+    crop_box = get_subject_crop_box(
+        scaled_size, size, (scaled_size[0] * subject_location[0] / source_x,
+                            scaled_size[1] * subject_location[1] / source_y))
+    return resize_and_crop(im, scaled_size, crop_box)
+
+
+def current(im, size, subject_location):
+    return scale_and_crop_with_subject_location(
+        im, size, subject_location='%d,%d' % subject_location, crop=True)
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def difference(a, b):
+    return max(ImageStat.Stat(ImageChops.difference(a, b)).mean)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    row = '{0:<14} {1:<10} {2:>6} {3:>10} {4:>10} {5:>8} {6:>6}'
+    print(row.format('source', 'thumbnail', 'input', 'former ms',
+                     'current ms', 'speedup', 'diff'))
+    for source_size, size, subject_location in CASES:
+        source = create_image(source_size)
+        data = BytesIO()
+        source.save(data, 'JPEG', quality=90)
+        data = data.getvalue()
+        inputs = [
+            ('pixels', lambda: source),
+            # the processors get decoded images, the new one can still decode
+            # JPEGs reduced if they were not decoded yet
+            ('jpeg', lambda: Image.open(BytesIO(data))),
+        ]
+        for label, get_input in inputs:
+            def run_former():
+                im = get_input()
+                im.load()
+                return former(im, size, subject_location)
+
+            def run_current():
+                return current(get_input(), size, subject_location)
+            former_ms = best_time(run_former, args.repeat)
+            current_ms = best_time(run_current, args.repeat)
+            print(row.format(
+                '%dx%d' % source_size, '%dx%d' % size, label,
+                '%.1f' % former_ms, '%.1f' % current_ms,
+                '%.1fx' % (former_ms / current_ms),
+                '%.2f' % difference(run_former(), run_current())))
+
+
+if __name__ == '__main__':
+    main()
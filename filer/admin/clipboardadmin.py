@@ -10,9 +10,11 @@ from filer import settings as filer_settings
 from filer.models import Folder, Clipboard, ClipboardItem, Image
 from filer.utils.compatibility import LTE_DJANGO_1_4
 from filer.utils.files import (
-    handle_upload, handle_request_files_upload, UploadException,
+    add_sha1_upload_handler, handle_upload, handle_request_files_upload,
+    UploadException,
 )
 from filer.utils.loader import load_object
+from filer.utils.thumbnails import CLIPBOARD_PREVIEW_THUMBNAIL_OPTIONS
 
 
 NO_FOLDER_ERROR = "Can't find folder to upload. Please refresh and try again"
@@ -93,6 +95,8 @@ def ajax_upload(request, folder_id=None):
         return HttpResponse(
             json.dumps({'error': NO_PERMISSIONS_FOR_FOLDER}),
             **response_params)
+    # Compute the checksum while the upload is received
+    add_sha1_upload_handler(request)
     try:
         if len(request.FILES) == 1:
             # dont check if request is ajax or not, just grab the file
@@ -162,13 +166,8 @@ def ajax_upload(request, folder_id=None):
             }
             # prepare preview thumbnail
             if type(file_obj) == Image:
-                thumbnail_180_options = {
-                    'size': (180, 180),
-                    'crop': True,
-                    'upscale': True,
-                }
                 thumbnail_180 = file_obj.file.get_thumbnail(
-                    thumbnail_180_options)
+                    dict(CLIPBOARD_PREVIEW_THUMBNAIL_OPTIONS))
                 json_response['thumbnail_180'] = thumbnail_180.url
                 json_response['original_image'] = file_obj.url
             return HttpResponse(json.dumps(json_response),
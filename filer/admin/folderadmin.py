@@ -3,6 +3,7 @@
 from __future__ import unicode_literals
 
 import itertools
+import json
 import os
 import re
 
@@ -14,7 +15,7 @@ from django.core.exceptions import PermissionDenied
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
-from django.db import router, models
+from django.db import connections, router, models
 from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import render, get_object_or_404
 
@@ -26,23 +27,26 @@ from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext, ugettext_lazy
 
 from filer import settings
+from filer.admin import jobs
 from filer.admin.forms import (CopyFilesAndFoldersForm, ResizeImagesForm,
                                RenameFilesForm)
 from filer.admin.permissions import PrimitivePermissionAwareModelAdmin
 from filer.admin.patched.admin_utils import get_deleted_objects
-from filer.admin.tools import (userperms_for_request,
+from filer.admin.tools import (DirectoryListingContext,
                                check_folder_edit_permissions,
                                check_files_edit_permissions,
                                check_files_read_permissions,
                                check_folder_read_permissions,
                                admin_each_context)
 from filer.models import (Folder, FolderRoot, UnfiledImages, File, tools,
-                          ImagesWithMissingData, FolderPermission, Image)
+                          ImagesWithMissingData, FolderPermission, Image,
+                          FilerJob)
 from filer.settings import FILER_PAGINATE_BY
 from filer.thumbnail_processors import normalize_subject_location
 from filer.utils.compatibility import (
     get_delete_permission, quote, unquote, capfirst)
 from filer.utils.filer_easy_thumbnails import FilerActionThumbnailer
+from filer.utils.jobs import get_executor
 from filer.views import (popup_status, popup_param, selectfolder_status,
                          selectfolder_param)
 
@@ -55,6 +59,78 @@ class AddFolderPopupForm(forms.ModelForm):
         fields = ('name',)
 
 
+def order_by_label(file_qs):
+    """
+    Orders files by their label (see ``File.label``) in the database, the
+    same order as sorting them in python.
+    """
+    qn = connections[file_qs.db].ops.quote_name
+    table = qn(File._meta.db_table)
+    label = "LOWER(COALESCE(NULLIF(%s.%s, ''), %s.%s, 'unnamed file'))" % (
+        table, qn('name'), table, qn('original_filename'))
+    return file_qs.extra(select={'filer_label': label},
+                         order_by=['filer_label', 'pk'])
+
+
+def with_item_counts(folder_qs):
+    """
+    Selects the number of files and subfolders of every folder along with
+    the folders, so that ``Folder.file_count`` and ``Folder.children_count``
+    don't need a query per folder.
+    """
+    qn = connections[folder_qs.db].ops.quote_name
+    folder_table = qn(Folder._meta.db_table)
+    count = "SELECT COUNT(*) FROM %s WHERE %s.%s = %s.%s"
+    return folder_qs.extra(select={
+        '_file_count_cache': count % (
+            qn(File._meta.db_table), qn(File._meta.db_table),
+            qn(File._meta.get_field('folder').column),
+            folder_table, qn('id')),
+        '_children_count_cache': count % (
+            # alias the inner table, it is the same as the outer one
+            '%s AS %s' % (folder_table, qn('filer_child')), qn('filer_child'),
+            qn(Folder._meta.get_field('parent').column),
+            folder_table, qn('id')),
+    })
+
+
+class DirectoryListingItems(object):
+    """
+    The items of a directory listing, as a sequence for ``Paginator``: the
+    concatenation of ``sequences`` (lists or querysets). Only the items of
+    the requested slice are fetched and ``item_permissions`` is only called
+    for them. Items are ``(item, item_permissions)`` tuples.
+    """
+    def __init__(self, sequences, item_permissions):
+        self.sequences = sequences
+        self.item_permissions = item_permissions
+        self._counts = None
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = [len(seq) if isinstance(seq, list) else seq.count()
+                            for seq in self.sequences]
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, step = key.indices(self.count())
+        items = []
+        offset = 0
+        for seq, count in zip(self.sequences, self.counts()):
+            if start < offset + count and stop > offset:
+                items.extend(seq[max(start - offset, 0):stop - offset])
+            offset += count
+        return [(item, self.item_permissions(item)) for item in items]
+
+
 class FolderAdmin(PrimitivePermissionAwareModelAdmin):
     list_display = ('name',)
     exclude = ('parent',)
@@ -223,26 +299,33 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                 self.admin_site.admin_view(self.directory_listing),
                 {'viewtype': 'unfiled_images'},
                 name='filer-directory_listing-unfiled_images'),
+
+            url(r'^jobs/(?P<job_id>\d+)/$',
+                self.admin_site.admin_view(self.job_progress),
+                name='filer-job_progress'),
+            url(r'^jobs/(?P<job_id>\d+)/status/$',
+                self.admin_site.admin_view(self.job_status),
+                name='filer-job_status'),
         )
         url_patterns.extend(urls)
         return url_patterns
 
     # custom views
     def directory_listing(self, request, folder_id=None, viewtype=None):
-        clipboard = tools.get_user_clipboard(request.user)
+        listing = DirectoryListingContext(request)
+        # make sure the user has a clipboard to show
+        listing.clipboard
         if viewtype == 'images_with_missing_data':
             folder = ImagesWithMissingData()
         elif viewtype == 'unfiled_images':
             folder = UnfiledImages()
         elif viewtype == 'last':
             last_folder_id = request.session.get('filer_last_folder_id')
-            try:
-                Folder.objects.get(id=last_folder_id)
-            except Folder.DoesNotExist:
-                url = reverse('admin:filer-directory_listing-root')
+            if listing.folder_exists(last_folder_id):
+                url = reverse('admin:filer-directory_listing', kwargs={'folder_id': last_folder_id})
                 url = "%s%s%s" % (url, popup_param(request), selectfolder_param(request, "&"))
             else:
-                url = reverse('admin:filer-directory_listing', kwargs={'folder_id': last_folder_id})
+                url = reverse('admin:filer-directory_listing-root')
                 url = "%s%s%s" % (url, popup_param(request), selectfolder_param(request, "&"))
             return HttpResponseRedirect(url)
         elif folder_id is None:
@@ -302,49 +385,55 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             if len(order_by) > 0:
                 file_qs = file_qs.order_by(*order_by)
 
-        folder_children = []
-        folder_files = []
+        virtual_folders = []
         if folder.is_root:
-            folder_children += folder.virtual_folders
-
-        perms = FolderPermission.objects.get_read_id_list(request.user)
-        root_exclude_kw = {'parent__isnull': False, 'parent__id__in': perms}
-        if perms != 'All':
-            file_qs = file_qs.filter(models.Q(folder__id__in=perms) | models.Q(owner=request.user))
-            folder_qs = folder_qs.filter(models.Q(id__in=perms) | models.Q(owner=request.user))
-        else:
-            root_exclude_kw.pop('parent__id__in')
+            virtual_folders += folder.virtual_folders
+
+        # filter with the intervals of the permission index instead of
+        # expanding it to the ids of all readable folders
+        index = FolderPermission.objects.get_permission_index(request.user, 'read')
+        root_exclude = models.Q(parent__isnull=False)
+        if not index.unrestricted:
+            file_qs = file_qs.filter(index.as_q(prefix='folder__') | models.Q(owner=request.user))
+            folder_qs = folder_qs.filter(index.as_q() | models.Q(owner=request.user))
+            root_exclude &= index.as_q(prefix='parent__')
         if folder.is_root:
-            folder_qs = folder_qs.exclude(**root_exclude_kw)
-
-        folder_children += folder_qs
-        folder_files += file_qs
+            folder_qs = folder_qs.exclude(root_exclude)
 
         try:
+            folder_perms = listing.folder_permissions(folder)
             permissions = {
-                'has_edit_permission': folder.has_edit_permission(request),
-                'has_read_permission': folder.has_read_permission(request),
-                'has_add_children_permission':
-                    folder.has_add_children_permission(request),
+                'has_edit_permission': 'edit' in folder_perms,
+                'has_read_permission': 'read' in folder_perms,
+                'has_add_children_permission': 'add_children' in folder_perms,
             }
         except:
+            folder_perms = []
             permissions = {}
 
         if order_by is None or len(order_by) == 0:
-            folder_files.sort()
+            file_qs = order_by_label(file_qs)
 
-        items = folder_children + folder_files
-        items_permissions = [(item, {'change': self.has_change_permission(request, item)}) for item in items]
-        paginator = Paginator(items_permissions, FILER_PAGINATE_BY)
+        # fetch everything the rows show (and check permissions with) in
+        # a constant number of queries per page
+        folder_qs = with_item_counts(folder_qs.select_related('owner'))
+        file_qs = file_qs.select_related('owner', 'folder')
+
+        items = DirectoryListingItems(
+            [virtual_folders, folder_qs, file_qs],
+            lambda item: {'change': self.has_change_permission(request, item)})
+        paginator = Paginator(items, FILER_PAGINATE_BY)
 
         # Are we moving to clipboard?
         if request.method == 'POST' and '_save' not in request.POST:
             # TODO: Refactor/remove clipboard parts
-            for f in folder_files:
-                if "move-to-clipboard-%d" % (f.id,) in request.POST:
-                    clipboard = tools.get_user_clipboard(request.user)
+            for key in request.POST:
+                m = re.match(r'^move-to-clipboard-(\d+)$', key)
+                if not m:
+                    continue
+                for f in file_qs.filter(id=m.group(1)):
                     if f.has_edit_permission(request):
-                        tools.move_file_to_clipboard([f], clipboard)
+                        tools.move_file_to_clipboard([f], listing.clipboard)
                         return HttpResponseRedirect(request.get_full_path())
                     else:
                         raise PermissionDenied
@@ -392,21 +481,21 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         context = admin_each_context(self.admin_site, request)
         context.update({
             'folder': folder,
-            'clipboard_files': File.objects.filter(
-                in_clipboards__clipboarditem__clipboard__user=request.user
-            ).distinct(),
+            'clipboard_files': listing.clipboard_files,
             'paginator': paginator,
             'paginated_items': paginated_items,  # [(item, item_perms), ]
             'uploader_connections': settings.FILER_UPLOADER_CONNECTIONS,
             'permissions': permissions,
-            'permstest': userperms_for_request(folder, request),
+            'permstest': folder_perms,
             'current_url': request.path,
             'title': 'Directory listing for %s' % folder.name,
             'search_string': ' '.join(search_terms),
             'q': urlquote(q),
             'show_result_count': show_result_count,
-            'folder_children': folder_children,
-            'folder_files': folder_files,
+            'folder_children': folder_qs,
+            'folder_files': file_qs,
+            'folder_children_count': items.counts()[0] + items.counts()[1],
+            'folder_files_count': items.counts()[2],
             'limit_search_to_folder': limit_search_to_folder,
             'is_popup': popup_status(request),
             'select_folder': selectfolder_status(request),
@@ -564,6 +653,71 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             del actions['delete_selected']
         return actions
 
+    def _run_job(self, request, handler, items, arguments, description,
+                 message):
+        """
+        Runs an action as a ``FilerJob`` calling ``handler`` (a function of
+        ``filer.admin.jobs``) on ``items``. ``message`` is shown when it is
+        done, formatted with the ``message_data`` argument and the count of
+        processed items.
+
+        Returns None if the job is done already (the default
+        ``FILER_JOB_EXECUTOR`` runs it in the request), or redirects to the
+        progress page of the job.
+        """
+        arguments['return_url'] = request.get_full_path()
+        job = FilerJob.objects.enqueue(
+            '%s.%s' % (handler.__module__, handler.__name__), items,
+            arguments=arguments, user=request.user,
+            description=force_text(description), message=message)
+        get_executor().submit(job)
+        job = FilerJob.objects.get(pk=job.pk)
+        if job.status == FilerJob.DONE:
+            self.message_user(request, job.get_message())
+            # nobody follows the progress of a job done in the request
+            job.delete()
+            return None
+        return HttpResponseRedirect(
+            reverse('admin:filer-job_progress', args=(job.pk,)))
+
+    def _get_job(self, request, job_id):
+        job = get_object_or_404(FilerJob, pk=job_id)
+        if not request.user.is_superuser and job.user_id != request.user.pk:
+            raise PermissionDenied
+        return job
+
+    def job_progress(self, request, job_id):
+        job = self._get_job(request, job_id)
+        opts = self.model._meta
+        context = admin_each_context(self.admin_site, request)
+        context.update({
+            "title": job.description,
+            "breadcrumbs_action": job.description,
+            "job": job,
+            "status_url": reverse('admin:filer-job_status', args=(job.pk,)),
+            "return_url": job.arguments.get('return_url') or reverse(
+                'admin:filer-directory_listing-root'),
+            "opts": opts,
+            "root_path": reverse('admin:index'),
+            "app_label": opts.app_label,
+        })
+        return render(request, "admin/filer/job_progress.html", context)
+
+    def job_status(self, request, job_id):
+        """
+        The progress of a job as JSON, polled by its progress page.
+        """
+        job = self._get_job(request, job_id)
+        status = {
+            'status': job.status,
+            'total': job.total,
+            'position': job.position,
+            'message': job.get_message() if job.status == FilerJob.DONE else '',
+            'error': job.last_error if job.status == FilerJob.FAILED else '',
+        }
+        return HttpResponse(json.dumps(status),
+                            content_type='application/json')
+
     def move_to_clipboard(self, request, files_queryset, folders_queryset):
         """
         Action which moves the selected files and files in selected folders
@@ -623,31 +777,28 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         check_files_edit_permissions(request, files_queryset)
         check_folder_edit_permissions(request, folders_queryset)
 
-        # We define it like that so that we can modify it inside the
-        # set_files function
-        files_count = [0]
-
-        def set_files(files):
-            for f in files:
-                if f.is_public != set_public:
-                    f.is_public = set_public
-                    f.save()
-                    files_count[0] += 1
-
-        def set_folders(folders):
-            for f in folders:
-                set_files(f.files)
-                set_folders(f.children.all())
-
-        set_files(files_queryset)
-        set_folders(folders_queryset)
-
         if set_public:
-            self.message_user(request, _("Successfully disabled permissions for %(count)d files.") % {"count": files_count[0], })
+            description = self.files_set_public.short_description
+            message = _("Successfully disabled permissions for %(count)d files.")
         else:
-            self.message_user(request, _("Successfully enabled permissions for %(count)d files.") % {"count": files_count[0], })
-
-        return None
+            description = self.files_set_private.short_description
+            message = _("Successfully enabled permissions for %(count)d files.")
+        return self._run_job(
+            request, jobs.set_files_public_or_private,
+            self._list_files_in_folders(files_queryset, folders_queryset),
+            {'is_public': set_public}, description, message)
+
+    def _list_files_in_folders(self, files_queryset, folders_queryset):
+        """
+        Returns the pks of the files and of the files in the folders and
+        their descendants.
+        """
+        pks = list(files_queryset.values_list('pk', flat=True))
+        subtrees = jobs.get_subtrees_filter(folders_queryset)
+        if subtrees is not None:
+            pks.extend(File.objects.filter(subtrees).exclude(
+                pk__in=pks).order_by('pk').values_list('pk', flat=True))
+        return pks
 
     def files_set_private(self, request, files_queryset, folders_queryset):
         return self.files_set_public_or_private(request, False, files_queryset,
@@ -706,27 +857,22 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                 raise PermissionDenied
             n = files_queryset.count() + folders_queryset.count()
             if n:
-                # delete all explicitly selected files
-                for f in files_queryset:
-                    self.log_deletion(request, f, force_text(f))
-                    f.delete()
-                # delete all files in all selected folders and their children
-                # This would happen automatically by ways of the delete
-                # cascade, but then the individual .delete() methods won't be
-                # called and the files won't be deleted from the filesystem.
-                folder_ids = set()
-                for folder in folders_queryset:
-                    folder_ids.add(folder.id)
-                    folder_ids.update(
-                        folder.get_descendants().values_list('id', flat=True))
-                for f in File.objects.filter(folder__in=folder_ids):
+                # The deletion of the explicitly selected files and folders
+                # is logged only. All files in the selected folders and
+                # their children are deleted before the folders: this would
+                # happen automatically by ways of the delete cascade, but
+                # then the stored files wouldn't be deleted.
+                for f in itertools.chain(files_queryset, folders_queryset):
                     self.log_deletion(request, f, force_text(f))
-                    f.delete()
-                # delete all folders
-                for f in folders_queryset:
-                    self.log_deletion(request, f, force_text(f))
-                    f.delete()
-                self.message_user(request, _("Successfully deleted %(count)d files and/or folders.") % {"count": n, })
+                items = [['file', pk] for pk in self._list_files_in_folders(
+                    files_queryset, folders_queryset)]
+                items.extend(['folder', pk] for pk in
+                             folders_queryset.values_list('pk', flat=True))
+                return self._run_job(
+                    request, jobs.delete_files_or_folders, items,
+                    {'message_data': {'count': n}},
+                    self.delete_files_or_folders.short_description,
+                    _("Successfully deleted %(count)d files and/or folders."))
             # Return None to display the change list page again.
             return None
 
@@ -845,14 +991,6 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         root_folders = Folder.objects.filter(parent__isnull=True).order_by('name')
         return list(self._list_all_destination_folders_recursive(request, folders_queryset, current_folder, root_folders, allow_self, 0))
 
-    def _move_files_and_folders_impl(self, files_queryset, folders_queryset, destination):
-        for f in files_queryset:
-            f.folder = destination
-            f.save()
-        for f in folders_queryset:
-            f.move_to(destination, 'last-child')
-            f.save()
-
     def move_files_and_folders(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
         app_label = opts.app_label
@@ -879,11 +1017,14 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                 messages.error(request, _("Folders with names %s already exist at the selected "
                                           "destination") % ", ".join(conflicting_names))
             elif n:
-                self._move_files_and_folders_impl(files_queryset, folders_queryset, destination)
-                self.message_user(request, _("Successfully moved %(count)d files and/or folders to folder '%(destination)s'.") % {
-                    "count": n,
-                    "destination": destination,
-                })
+                items = [['file', pk] for pk in files_queryset.values_list('pk', flat=True)]
+                items.extend(['folder', pk] for pk in folders_queryset.values_list('pk', flat=True))
+                return self._run_job(
+                    request, jobs.move_files_and_folders, items,
+                    {'destination': destination.pk,
+                     'message_data': {'destination': force_text(destination)}},
+                    self.move_files_and_folders.short_description,
+                    _("Successfully moved %(count)d files and/or folders to folder '%(destination)s'."))
             return None
 
         context = admin_each_context(self.admin_site, request)
@@ -927,25 +1068,17 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         }
         file_obj.save()
 
-    def _rename_files(self, files, form_data, global_counter):
-        n = 0
-        for f in sorted(files):
-            self._rename_file(f, form_data, n, global_counter + n)
-            n += 1
-        return n
-
-    def _rename_folder(self, folder, form_data, global_counter):
-        return self._rename_files_impl(folder.files.all(), folder.children.all(), form_data, global_counter)
-
-    def _rename_files_impl(self, files_queryset, folders_queryset, form_data, global_counter):
-        n = 0
-
+    def _list_files_to_rename(self, files_queryset, folders_queryset, global_counter):
+        """
+        Returns ``[pk, counter, global_counter]`` of the files to rename, the
+        files in the folders first.
+        """
+        items = []
         for f in folders_queryset:
-            n += self._rename_folder(f, form_data, global_counter + n)
-
-        n += self._rename_files(files_queryset, form_data, global_counter + n)
-
-        return n
+            items.extend(self._list_files_to_rename(f.files.all(), f.children.all(), global_counter + len(items)))
+        for counter, f in enumerate(sorted(files_queryset)):
+            items.append([f.pk, counter, global_counter + len(items)])
+        return items
 
     def rename_files(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
@@ -961,10 +1094,12 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             form = RenameFilesForm(request.POST)
             if form.is_valid():
                 if files_queryset.count() + folders_queryset.count():
-                    n = self._rename_files_impl(files_queryset, folders_queryset, form.cleaned_data, 0)
-                    self.message_user(request, _("Successfully renamed %(count)d files.") % {
-                        "count": n,
-                    })
+                    return self._run_job(
+                        request, jobs.rename_files,
+                        self._list_files_to_rename(files_queryset, folders_queryset, 0),
+                        {'form_data': form.cleaned_data},
+                        self.rename_files.short_description,
+                        _("Successfully renamed %(count)d files."))
                 return None
         else:
             form = RenameFilesForm()
@@ -1006,9 +1141,10 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         # Due to how inheritance works, we have to set both pk and id to None
         file_obj.pk = None
         file_obj.id = None
-        file_obj.save()
         file_obj.folder = destination
         file_obj.file = file_obj._copy_file(filename)
+        # The copy has the same size, checksum and dimensions
+        file_obj.keep_file_data()
         file_obj.original_filename = self._generate_new_filename(file_obj.original_filename, suffix)
         file_obj.save()
 
@@ -1048,15 +1184,21 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             perm.folder = folder
             perm.save()
 
-        return 1 + self._copy_files_and_folders_impl(old_folder.files.all(), old_folder.children.all(), folder, suffix, overwrite)
-
-    def _copy_files_and_folders_impl(self, files_queryset, folders_queryset, destination, suffix, overwrite):
-        n = self._copy_files(files_queryset, destination, suffix, overwrite)
+        # The content is copied separately (see _list_to_copy), the folder
+        # itself is counted
+        return 1
 
+    def _list_to_copy(self, files_queryset, folders_queryset, parent=None):
+        """
+        Returns ``['file', pk, parent_pk]`` and ``['folder', pk, parent_pk]``
+        of the files and folders to copy (recursivelly), every folder before
+        its content. ``parent_pk`` is None for the destination.
+        """
+        items = [['file', pk, parent] for pk in files_queryset.values_list('pk', flat=True)]
         for f in folders_queryset:
-            n += self._copy_folder(f, destination, suffix, overwrite)
-
-        return n
+            items.append(['folder', f.pk, parent])
+            items.extend(self._list_to_copy(f.files.all(), f.children.all(), f.pk))
+        return items
 
     def copy_files_and_folders(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
@@ -1081,11 +1223,14 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                     raise PermissionDenied
                 if files_queryset.count() + folders_queryset.count():
                     # We count all files and folders here (recursivelly)
-                    n = self._copy_files_and_folders_impl(files_queryset, folders_queryset, destination, form.cleaned_data['suffix'], False)
-                    self.message_user(request, _("Successfully copied %(count)d files and/or folders to folder '%(destination)s'.") % {
-                        "count": n,
-                        "destination": destination,
-                    })
+                    return self._run_job(
+                        request, jobs.copy_files_and_folders,
+                        self._list_to_copy(files_queryset, folders_queryset),
+                        {'destination': destination.pk,
+                         'suffix': form.cleaned_data['suffix'],
+                         'message_data': {'destination': force_text(destination)}},
+                        self.copy_files_and_folders.short_description,
+                        _("Successfully copied %(count)d files and/or folders to folder '%(destination)s'."))
                 return None
         else:
             form = CopyFilesAndFoldersForm()
@@ -1150,6 +1295,8 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
     def _resize_image(self, image, form_data):
         original_width = float(image.width)
         original_height = float(image.height)
+        # The image is resized in place, other files must keep the original
+        image.detach_blob()
         thumbnailer = FilerActionThumbnailer(file=image.file.file, name=image.file.name, source_storage=image.file.source_storage, thumbnail_storage=image.file.source_storage)
         # This should overwrite the original image
         new_image = thumbnailer.get_thumbnail({
@@ -1159,7 +1306,7 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             'subject_location': image.subject_location,
         })
         image.file.file = new_image.file
-        image.generate_sha1()
+        image.invalidate_file_data()
         image.save()  # Also gets new width and height
 
         subject_location = normalize_subject_location(image.subject_location)
@@ -1173,25 +1320,6 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             image.subject_location = "%d,%d" % (new_x, new_y)
             image.save()
 
-    def _resize_images(self, files, form_data):
-        n = 0
-        for f in files:
-            if isinstance(f, Image):
-                self._resize_image(f, form_data)
-                n += 1
-        return n
-
-    def _resize_folder(self, folder, form_data):
-        return self._resize_images_impl(folder.files.all(), folder.children.all(), form_data)
-
-    def _resize_images_impl(self, files_queryset, folders_queryset, form_data):
-        n = self._resize_images(files_queryset, form_data)
-
-        for f in folders_queryset:
-            n += self._resize_folder(f, form_data)
-
-        return n
-
     def resize_images(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
         app_label = opts.app_label
@@ -1211,9 +1339,14 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                     form.cleaned_data['crop'] = form.cleaned_data['thumbnail_option'].crop
                     form.cleaned_data['upscale'] = form.cleaned_data['thumbnail_option'].upscale
                 if files_queryset.count() + folders_queryset.count():
-                    # We count all files here (recursivelly)
-                    n = self._resize_images_impl(files_queryset, folders_queryset, form.cleaned_data)
-                    self.message_user(request, _("Successfully resized %(count)d images.") % {"count": n, })
+                    # We count all images here (recursivelly)
+                    form_data = dict((key, form.cleaned_data[key]) for key in ('width', 'height', 'crop', 'upscale'))
+                    return self._run_job(
+                        request, jobs.resize_images,
+                        self._list_files_in_folders(files_queryset, folders_queryset),
+                        {'form_data': form_data},
+                        self.resize_images.short_description,
+                        _("Successfully resized %(count)d images."))
                 return None
         else:
             form = ResizeImagesForm()
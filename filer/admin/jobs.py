@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+The handlers of the jobs (see ``FilerJob``) of the actions of the folder
+admin. They call the methods of the folder admin registered on the default
+admin site, which can be overridden as before.
+
+Files and folders deleted since the job was enqueued are skipped.
+"""
+from __future__ import unicode_literals
+
+from django.contrib import admin
+from django.db.models import Q
+
+from filer.models import File, Folder, Image
+from filer.utils.transfer import set_files_public
+
+
+def get_folder_admin():
+    from filer.admin.folderadmin import FolderAdmin
+    return admin.site._registry.get(Folder) or FolderAdmin(Folder, admin.site)
+
+
+def get_files(pks):
+    """
+    Returns the files of ``pks`` which still exist, in the same order.
+    """
+    files = dict((f.pk, f) for f in File.objects.filter(pk__in=pks))
+    return [files[pk] for pk in pks if pk in files]
+
+
+def get_folder(pk):
+    # fetched one at a time, moving or deleting a folder changes the tree
+    for folder in Folder.objects.filter(pk=pk):
+        return folder
+    return None
+
+
+def get_subtrees_filter(folders):
+    """
+    Returns the filter of the files in ``folders`` and their descendants, or
+    None if there are no folders.
+    """
+    subtrees = None
+    for folder in folders:
+        subtree = Q(folder__tree_id=folder.tree_id,
+                    folder__lft__gte=folder.lft,
+                    folder__rght__lte=folder.rght)
+        subtrees = subtree if subtrees is None else subtrees | subtree
+    return subtrees
+
+
+def commit_every_item(handler):
+    """
+    Marks a handler changing stored files, which are not rolled back with the
+    transaction of a chunk: the job commits every item (see ``FilerJob``).
+    """
+    handler.max_chunk_size = 1
+    return handler
+
+
+@commit_every_item
+def set_files_public_or_private(job, pks):
+    return set_files_public(get_files(pks), job.arguments['is_public'])
+
+
+def delete_files_or_folders(job, items):
+    """
+    ``items`` are ``['file', pk]`` for the files, including the files in the
+    selected folders, followed by ``['folder', pk]`` for the selected
+    folders. The files are deleted with bulk queries, the deletion of a
+    folder would not delete their stored files.
+    """
+    file_pks = [pk for kind, pk in items if kind == 'file']
+    if file_pks:
+        File.objects.delete_files(File.objects.filter(pk__in=file_pks))
+    for kind, pk in items:
+        if kind == 'folder':
+            folder = get_folder(pk)
+            if folder is not None:
+                # and the files added since the job was enqueued
+                File.objects.delete_files(
+                    File.objects.filter(get_subtrees_filter([folder])))
+                folder.delete()
+    return len(items)
+
+
+def move_files_and_folders(job, items):
+    """
+    ``items`` are ``['file', pk]`` and ``['folder', pk]`` for the selected
+    files and folders.
+    """
+    destination = Folder.objects.get(pk=job.arguments['destination'])
+    for f in get_files([pk for kind, pk in items if kind == 'file']):
+        f.folder = destination
+        f.save()
+    for kind, pk in items:
+        if kind == 'folder':
+            folder = get_folder(pk)
+            if folder is not None:
+                folder.move_to(destination, 'last-child')
+                folder.save()
+    return len(items)
+
+
+def rename_files(job, items):
+    """
+    ``items`` are ``[pk, counter, global_counter]`` of the files to rename.
+    """
+    folder_admin = get_folder_admin()
+    counters = dict((pk, (counter, global_counter))
+                    for pk, counter, global_counter in items)
+    files = get_files([pk for pk, counter, global_counter in items])
+    for f in files:
+        folder_admin._rename_file(f, job.arguments['form_data'], *counters[f.pk])
+    return len(files)
+
+
+@commit_every_item
+def copy_files_and_folders(job, items):
+    """
+    ``items`` are ``['file', pk, parent_pk]`` and ``['folder', pk,
+    parent_pk]``, the folders before their content: a parent of None is the
+    destination, other parents are copied already. The copies of the folders
+    are kept in the state of the job.
+    """
+    folder_admin = get_folder_admin()
+    suffix = job.arguments['suffix']
+    copies = job.state.setdefault('folders', {})
+    n = 0
+    for kind, pk, parent_pk in items:
+        destination_pk = job.arguments['destination']
+        if parent_pk is not None:
+            if str(parent_pk) not in copies:
+                # the parent was deleted before it was copied
+                continue
+            destination_pk = copies[str(parent_pk)]
+        destination = Folder.objects.get(pk=destination_pk)
+        if kind == 'folder':
+            folder = get_folder(pk)
+            if folder is not None:
+                n += folder_admin._copy_folder(folder, destination, suffix,
+                                               False)
+                # the folder is saved as its copy
+                copies[str(pk)] = folder.pk
+        else:
+            n += folder_admin._copy_files(get_files([pk]), destination,
+                                          suffix, False)
+    return n
+
+
+@commit_every_item
+def resize_images(job, pks):
+    folder_admin = get_folder_admin()
+    n = 0
+    for f in get_files(pks):
+        if isinstance(f, Image):
+            folder_admin._resize_image(f, job.arguments['form_data'])
+            n += 1
+    return n
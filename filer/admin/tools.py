@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.utils.functional import cached_property
 
+from filer import settings as filer_settings
+from filer.models import Folder, File, tools
+from filer.utils.cache import get_cache_key, get_version
 from filer.utils.compatibility import LTE_DJANGO_1_7, LTE_DJANGO_1_6
 
 
@@ -54,3 +59,76 @@ def userperms_for_request(item, request):
             if x:
                 r.append(p)
     return r
+
+
+class DirectoryListingContext(object):
+    """
+    Memoizes the lookups of one request to the directory listing.
+
+    Whether a folder exists and the permissions of the user on it are also
+    kept for ``FILER_DIRECTORY_LISTING_CACHE_TIMEOUT`` seconds in a per-user
+    cache. Its keys contain the version counter of the folder tree, which is
+    bumped whenever a folder is saved, moved or deleted and whenever a folder
+    permission or a group membership changes.
+    """
+    permission_types = ('read', 'edit', 'add_children')
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+        self._folders = {}
+
+    @cached_property
+    def clipboard(self):
+        return tools.get_user_clipboard(self.user)
+
+    @cached_property
+    def clipboard_files(self):
+        if self.clipboard is None:
+            return File.objects.none()
+        return self.clipboard.files.all()
+
+    def _get_cache_key(self, folder_id):
+        return get_cache_key(
+            'directory_listing', get_version('folder_permissions'),
+            self.user.pk, self.user.is_superuser, folder_id)
+
+    def _get_folder_entry(self, folder_id):
+        if folder_id not in self._folders:
+            entry = None
+            if self.user.is_authenticated():
+                entry = cache.get(self._get_cache_key(folder_id))
+            self._folders[folder_id] = entry or {}
+        return self._folders[folder_id]
+
+    def _set_folder_entry(self, folder_id, **values):
+        entry = self._get_folder_entry(folder_id)
+        entry.update(values)
+        if self.user.is_authenticated():
+            cache.set(self._get_cache_key(folder_id), entry,
+                      filer_settings.FILER_DIRECTORY_LISTING_CACHE_TIMEOUT)
+
+    def folder_exists(self, folder_id):
+        try:
+            folder_id = int(folder_id)
+        except (TypeError, ValueError):
+            return False
+        entry = self._get_folder_entry(folder_id)
+        if 'exists' not in entry:
+            self._set_folder_entry(folder_id, exists=Folder.objects.filter(
+                id=folder_id).exists())
+        return entry['exists']
+
+    def folder_permissions(self, folder):
+        """
+        Returns the permission types (see ``permission_types``) the user has
+        on ``folder``, a real or a virtual folder.
+        """
+        if not isinstance(folder, Folder):
+            return userperms_for_request(folder, self.request)
+        entry = self._get_folder_entry(folder.pk)
+        if 'permissions' not in entry:
+            self._set_folder_entry(
+                folder.pk, exists=True,
+                permissions=userperms_for_request(folder, self.request))
+        return entry['permissions']
@@ -7,3 +7,7 @@ from django.utils.translation import ugettext_lazy as _
 class FilerConfig(AppConfig):
     name = 'filer'
     verbose_name = _("django filer")
+
+    def ready(self):
+        from filer.models.foldermodels import connect_group_change_receiver
+        connect_group_change_receiver()
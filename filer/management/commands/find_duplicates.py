@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, NoArgsCommand
+from django.template.defaultfilters import filesizeformat
+
+from optparse import make_option
+
+from filer.models.filemodels import File
+
+
+class Command(NoArgsCommand):
+    """
+    Report files with identical content (same sha1) ::
+
+        manage.py find_duplicates
+        manage.py find_duplicates --verbosity=2
+
+    Sizes are taken from the database, the storages are never accessed.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--min-size',
+            action='store',
+            dest='min_size',
+            type='int',
+            default=0,
+            help='Only report clusters of files of at least this many bytes'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        min_size = options.get('min_size') or 0
+        cluster_count = 0
+        file_count = 0
+        reclaimable = 0
+        for cluster in File.objects.iter_duplicate_clusters():
+            if (cluster['size'] or 0) < min_size:
+                continue
+            cluster_count += 1
+            file_count += cluster['count']
+            reclaimable += cluster['reclaimable']
+            if verbosity >= 1:
+                self.stdout.write('%s: %d files, %d stored, %s reclaimable' % (
+                    cluster['sha1'], cluster['count'], cluster['stored_count'],
+                    filesizeformat(cluster['reclaimable'])))
+            if verbosity >= 2:
+                files = (File.objects.non_polymorphic()
+                         .filter(sha1=cluster['sha1'])
+                         .order_by('pk')
+                         .values_list('pk', 'file', 'is_public'))
+                for pk, name, is_public in files.iterator():
+                    self.stdout.write('    #%s %s%s' % (
+                        pk, name, '' if is_public else ' (private)'))
+        self.stdout.write(
+            '%d duplicate clusters / %d files / %s reclaimable' % (
+                cluster_count, file_count, filesizeformat(reclaimable)))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand, NoArgsCommand
+
+from easy_thumbnails.models import Source
+from easy_thumbnails.utils import get_storage_hash
+from optparse import make_option
+
+from filer import settings as filer_settings
+from filer.models.blobmodels import Blob
+from filer.models.filemodels import File
+from filer.utils.orphans import (KnownNames, find_orphans, get_excluded_dirs,
+                                 normalize_root)
+
+
+class Command(NoArgsCommand):
+    """
+    Report (or delete, with ``--delete``) the stored files and thumbnails in
+    the filer storages that don't belong to any file ::
+
+        manage.py find_orphans --verbosity=2
+        manage.py find_orphans --delete --workers=8
+
+    Only the directories filer stores its files in (the ``UPLOAD_TO_PREFIX``
+    and the thumbnail ``base_dir`` of ``FILER_STORAGES``) are scanned. Files
+    modified less than ``--min-age`` seconds ago are skipped, they may belong
+    to uploads in progress.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--delete',
+            action='store_true',
+            dest='delete',
+            default=False,
+            help='Delete the orphaned files instead of only reporting them'),
+        make_option('--min-age',
+            action='store',
+            dest='min_age',
+            type='int',
+            default=24 * 60 * 60,
+            help='Skip files modified less than this many seconds ago'),
+        make_option('--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=500,
+            help='Number of orphaned files deleted at once'),
+        make_option('--workers',
+            action='store',
+            dest='workers',
+            type='int',
+            default=4,
+            help='Number of threads deleting files'),
+    )
+
+    def get_known_names(self, is_public):
+        names = (File.objects.non_polymorphic().filter(is_public=is_public)
+                 .values_list('file', flat=True).iterator())
+        if is_public:
+            names = chain(names, Blob.objects.values_list('name', flat=True).iterator())
+        return KnownNames(names)
+
+    def get_scans(self):
+        """
+        Returns the ``(label, storage, root, is_public, thumbnail base_dir)``
+        of the directories to scan.
+        """
+        scans = []
+        for key, is_public in (('public', True), ('private', False)):
+            storages = filer_settings.FILER_STORAGES[key]
+            field = File._meta.get_field('file')
+            root = normalize_root(storages['main'].get('UPLOAD_TO_PREFIX'))
+            scans.append(('%s files' % key, field.storages[key], root,
+                          is_public, None))
+            base_dir = normalize_root(
+                field.thumbnail_options[key].get('base_dir'))
+            scans.append(('%s thumbnails' % key, field.thumbnail_storages[key],
+                          base_dir, is_public, base_dir))
+        return scans
+
+    def delete_batch(self, storage, names, is_thumbnail):
+        if self.pool is not None:
+            self.pool.map(storage.delete, names)
+        else:
+            for name in names:
+                storage.delete(name)
+        if not is_thumbnail:
+            Source.objects.filter(name__in=names,
+                                  storage_hash=get_storage_hash(storage)).delete()
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        delete = options.get('delete')
+        batch_size = options.get('batch_size') or 500
+        workers = options.get('workers') or 1
+        max_time = datetime.now() - timedelta(seconds=options.get('min_age') or 0)
+        known = {True: self.get_known_names(True),
+                 False: self.get_known_names(False)}
+        scans = self.get_scans()
+        total = 0
+        self.pool = ThreadPool(workers) if delete and workers > 1 else None
+        try:
+            for label, storage, root, is_public, base_dir in scans:
+                exclude = get_excluded_dirs(
+                    root, storage, [(scan[1], scan[2]) for scan in scans])
+                count = 0
+                batch = []
+                try:
+                    for name in find_orphans(storage, known[is_public], root,
+                                             exclude, base_dir, max_time):
+                        count += 1
+                        if verbosity >= 2:
+                            self.stdout.write('%s: %s' % (label, name))
+                        if delete:
+                            batch.append(name)
+                            if len(batch) >= batch_size:
+                                self.delete_batch(storage, batch, base_dir is not None)
+                                batch = []
+                except (NotImplementedError, OSError) as e:
+                    self.stderr.write('%s: could not be listed (%s)' % (label, e))
+                if batch:
+                    self.delete_batch(storage, batch, base_dir is not None)
+                total += count
+                if verbosity >= 1:
+                    self.stdout.write('%d orphaned %s%s' % (
+                        count, label, ' deleted' if delete else ''))
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+        if verbosity >= 1 and not delete and total:
+            self.stdout.write('Run with --delete to delete them')
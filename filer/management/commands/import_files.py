@@ -2,18 +2,30 @@
 
 from __future__ import unicode_literals
 
+import hashlib
+import io
+import multiprocessing
 import os
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.files import File as DjangoFile
 from django.core.management.base import BaseCommand, NoArgsCommand
+from django.db import connections, router
+from django.db.models import AutoField, Max
+from django.utils import six
+from django.utils.timezone import now
 
 from optparse import make_option
 
 from filer.models.filemodels import File
-from filer.models.foldermodels import Folder
+from filer.models.foldermodels import Folder, invalidate_permission_index
 from filer.models.imagemodels import Image
 from filer.settings import FILER_IS_PUBLIC_DEFAULT
-from filer.utils.compatibility import upath
+from filer.utils.compatibility import atomic, upath
+from filer.utils.image_probe import probe_file
+from filer.utils.pil_exif import get_exif_datetime, get_subject_location
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
 
 
 class FileImporter(object):
@@ -33,7 +45,7 @@ class FileImporter(object):
             iext = os.path.splitext(file_obj.name)[1].lower()
         except:
             iext = ''
-        if iext in ['.jpg', '.jpeg', '.png', '.gif']:
+        if iext in IMAGE_EXTENSIONS:
             obj, created = Image.objects.get_or_create(
                 original_filename=file_obj.name,
                 file=file_obj,
@@ -76,11 +88,21 @@ class FileImporter(object):
                     print("folder_created #%s folder : %s -- created : %s" % (self.folder_created, current_parent, created))
         return current_parent
 
-    def walker(self, path=None, base_folder=None):
+    def get_folder_names(self, path, base_folder, root):
         """
-        This method walk a directory structure and create the
-        Folders and Files as they appear.
+        Returns the names of the folders (like breadcrumbs) the files in
+        ``root``, a directory inside ``path``, are imported into.
         """
+        root_folder_name = os.path.basename(path)
+        rel_folders = root.partition(path)[2].strip(os.path.sep).split(os.path.sep)
+        while '' in rel_folders:
+            rel_folders.remove('')
+        if base_folder:
+            return base_folder.split('/') + [root_folder_name] + rel_folders
+        else:
+            return [root_folder_name] + rel_folders
+
+    def prepare_paths(self, path, base_folder):
         path = path or self.path
         base_folder = base_folder or self.base_folder
         # prevent trailing slashes and other inconsistencies on path.
@@ -90,22 +112,289 @@ class FileImporter(object):
             print("The directory structure will be imported in %s" % (base_folder,))
         if self.verbosity >= 1:
             print("Import the folders and files in %s" % (path,))
-        root_folder_name = os.path.basename(path)
+        return path, base_folder
+
+    def print_summary(self):
+        if self.verbosity >= 1:
+            print(('folder_created #%s / file_created #%s / ' + 'image_created #%s') % (self.folder_created, self.file_created, self.image_created))
+
+    def walker(self, path=None, base_folder=None):
+        """
+        This method walk a directory structure and create the
+        Folders and Files as they appear.
+        """
+        path, base_folder = self.prepare_paths(path, base_folder)
         for root, dirs, files in os.walk(path):
-            rel_folders = root.partition(path)[2].strip(os.path.sep).split(os.path.sep)
-            while '' in rel_folders:
-                rel_folders.remove('')
-            if base_folder:
-                folder_names = base_folder.split('/') + [root_folder_name] + rel_folders
-            else:
-                folder_names = [root_folder_name] + rel_folders
+            folder_names = self.get_folder_names(path, base_folder, root)
             folder = self.get_or_create_folder(folder_names)
             for file_obj in files:
                 dj_file = DjangoFile(open(os.path.join(root, file_obj), mode='rb'),
                                      name=file_obj)
                 self.import_file(file_obj=dj_file, folder=folder)
+        self.print_summary()
+
+
+def is_image(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def inspect_file(path):
+    """
+    Reads the data filer stores about the file at ``path``: checksum, size
+    and, for images, dimensions and EXIF data. Runs in the worker
+    processes of the bulk importer, so it must not touch the database.
+    """
+    sha = hashlib.sha1()
+    size = 0
+    with open(path, 'rb') as fh:
+        while True:
+            buf = fh.read(1024 * 1024)
+            if not buf:
+                break
+            sha.update(buf)
+            size += len(buf)
+    info = {'sha1': sha.hexdigest(), 'size': size,
+            'width': None, 'height': None, 'exif': {}}
+    if is_image(path):
+        try:
+            with open(path, 'rb') as fh:
+                image_info = probe_file(fh)
+        except Exception:
+            image_info = None
+        if image_info is not None:
+            info['width'], info['height'] = image_info.width, image_info.height
+            info['exif'] = image_info.exif
+    return info
+
+
+class BulkFileImporter(FileImporter):
+    """
+    Imports large directory structures:
+
+    * the folder tree is created first, in one pass, and the MPTT fields are
+      rebuilt once all folders exist
+    * files are hashed and images are measured by ``workers`` processes
+    * the rows are inserted in batches of ``batch_size`` files, each batch
+      in a transaction
+    * if a ``checkpoint`` file is given, the paths of the imported files are
+      appended to it after each batch and skipped when the import is run
+      again, so an interrupted import can be resumed. Files already in
+      their folder with the same name and checksum are skipped too, in case
+      the import stopped between a batch and its checkpoint.
+    """
+    def __init__(self, *args, **kwargs):
+        super(BulkFileImporter, self).__init__(*args, **kwargs)
+        self.workers = int(kwargs.get('workers') or 1)
+        self.batch_size = int(kwargs.get('batch_size') or 500)
+        self.checkpoint = kwargs.get('checkpoint')
+        self.folder_cache = {}
+        self.loaded_parents = set()
+
+    def get_existing_folder(self, parent, name):
+        """
+        Returns the existing folder ``name`` in ``parent`` or None. The
+        subfolders of each folder are loaded with one query.
+        """
+        parent_id = parent.pk if parent else None
+        if parent_id not in self.loaded_parents:
+            for child in Folder.objects.filter(parent_id=parent_id).order_by('pk'):
+                self.folder_cache.setdefault((parent_id, child.name), child)
+            self.loaded_parents.add(parent_id)
+        return self.folder_cache.get((parent_id, name))
+
+    def create_folders(self, paths):
+        """
+        Gets or creates the folders for all the given paths (tuples of folder
+        names) and returns them in a dict keyed by path.
+
+        Missing folders are inserted with one query per level of the tree
+        and the MPTT fields of the affected trees are rebuilt at the end,
+        instead of after every insert.
+        """
+        all_paths = set()
+        for path in paths:
+            all_paths.update(tuple(path[:i]) for i in range(1, len(path) + 1))
+        folders = {(): None}
+        tree_ids = set()
+        next_tree_id = None
+        for depth in range(1, max([len(path) for path in all_paths] + [0]) + 1):
+            missing = []
+            for path in sorted(p for p in all_paths if len(p) == depth):
+                folders[path] = self.get_existing_folder(folders[path[:-1]], path[-1])
+                if folders[path] is None:
+                    missing.append(path)
+            if not missing:
+                continue
+            new_folders = []
+            for path in missing:
+                parent = folders[path[:-1]]
+                if parent is None:
+                    if next_tree_id is None:
+                        next_tree_id = Folder.objects.aggregate(
+                            Max('tree_id'))['tree_id__max'] or 0
+                    next_tree_id += 1
+                    tree_id, level = next_tree_id, 0
+                else:
+                    tree_id, level = parent.tree_id, parent.level + 1
+                tree_ids.add(tree_id)
+                # lft=0 marks the folders whose MPTT fields are not built yet
+                new_folders.append(Folder(name=path[-1], parent=parent,
+                    tree_id=tree_id, level=level, lft=0, rght=0))
+            Folder.objects.bulk_create(new_folders)
+            for folder in Folder.objects.filter(lft=0, level=depth - 1):
+                self.folder_cache[(folder.parent_id, folder.name)] = folder
+                # a new folder has no subfolders yet
+                self.loaded_parents.add(folder.pk)
+            for path in missing:
+                parent = folders[path[:-1]]
+                folders[path] = self.folder_cache[(parent.pk if parent else None, path[-1])]
+            self.folder_created += len(missing)
+        for tree_id in sorted(tree_ids):
+            Folder._tree_manager.partial_rebuild(tree_id)
+        if tree_ids:
+            invalidate_permission_index()
+        return folders
+
+    def read_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return set()
+        with io.open(self.checkpoint, encoding='utf-8') as fh:
+            return set(line.rstrip('\n') for line in fh)
+
+    def write_checkpoint(self, rel_paths):
+        if not self.checkpoint:
+            return
+        with io.open(self.checkpoint, 'a', encoding='utf-8') as fh:
+            for rel_path in rel_paths:
+                fh.write('%s\n' % rel_path)
+
+    def walker(self, path=None, base_folder=None):
+        path, base_folder = self.prepare_paths(path, base_folder)
+        done = self.read_checkpoint()
+        tasks = []
+        folder_paths = []
+        for root, dirs, files in os.walk(path):
+            folder_path = tuple(self.get_folder_names(path, base_folder, root))
+            folder_paths.append(folder_path)
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                rel_path = os.path.relpath(full_path, path)
+                if rel_path not in done:
+                    tasks.append((full_path, rel_path, folder_path))
+        folders = self.create_folders(folder_paths)
+        tasks = [(full_path, rel_path, folders[folder_path])
+                 for full_path, rel_path, folder_path in tasks]
         if self.verbosity >= 1:
-            print(('folder_created #%s / file_created #%s / ' + 'image_created #%s') % (self.folder_created, self.file_created, self.image_created))
+            print("%d folders / %d files to import (%d already imported)" % (
+                len(folder_paths), len(tasks), len(done)))
+
+        pool = None
+        full_paths = [task[0] for task in tasks]
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers)
+            infos = pool.imap(inspect_file, full_paths, chunksize=16)
+        else:
+            infos = six.moves.map(inspect_file, full_paths)
+        try:
+            batch = []
+            for task, info in six.moves.zip(tasks, infos):
+                batch.append(task + (info,))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self.print_summary()
+
+    def import_batch(self, batch):
+        """
+        Stores the files of the batch and creates their rows with a few
+        queries. ``batch`` is a list of
+        ``(full_path, rel_path, folder, info)`` tuples.
+        """
+        image_ctype = ContentType.objects.get_for_model(Image)
+        file_ctype = ContentType.objects.get_for_model(File)
+        existing = set(File.objects.non_polymorphic().filter(
+            original_filename__in=set(os.path.basename(task[0]) for task in batch),
+            sha1__in=set(task[3]['sha1'] for task in batch),
+        ).values_list('folder_id', 'original_filename', 'sha1'))
+        files = []
+        images = []
+        for full_path, rel_path, folder, info in batch:
+            filename = os.path.basename(full_path)
+            if (folder.pk if folder else None, filename, info['sha1']) in existing:
+                # imported already
+                continue
+            obj = File(
+                original_filename=filename,
+                folder=folder,
+                is_public=FILER_IS_PUBLIC_DEFAULT,
+                sha1=info['sha1'],
+                _file_size=info['size'],
+                polymorphic_ctype=image_ctype if is_image(filename) else file_ctype)
+            with open(full_path, 'rb') as fh:
+                obj.file.save(filename, DjangoFile(fh, name=filename), save=False)
+            if is_image(filename):
+                images.append((obj, info))
+            else:
+                files.append(obj)
+        with atomic():
+            File.objects.bulk_create(files)
+            if images:
+                self.insert_files([obj for obj, info in images])
+                self.create_images(images)
+        self.write_checkpoint([task[1] for task in batch])
+        self.image_created += len(images)
+        self.file_created += len(files)
+        if self.verbosity >= 2:
+            print("file_created #%s / image_created #%s" % (self.file_created, self.image_created))
+
+    def insert_files(self, files):
+        """
+        Inserts the rows of the file table for ``files`` and sets their
+        primary keys, with one query if the database returns the ids of a
+        bulk insert and one query per file otherwise.
+        """
+        db = router.db_for_write(File)
+        if getattr(connections[db].features, 'can_return_ids_from_bulk_insert', False):
+            File.objects.bulk_create(files)
+            return
+        fields = [f for f in getattr(File._meta, 'local_concrete_fields', File._meta.local_fields)
+                  if not isinstance(f, AutoField)]
+        for obj in files:
+            obj.pk = File._base_manager._insert([obj], fields=fields,
+                                                return_id=True, using=db)
+            obj._state.adding = False
+            obj._state.db = db
+
+    def create_images(self, images):
+        """
+        Inserts the rows of the image table for the ``(file, info)`` tuples
+        of ``images``, the rows of the file table must already exist. Django
+        can't ``bulk_create`` multi-table inherited models, so the insert is
+        done with the lower level API ``bulk_create`` uses itself.
+        """
+        parent_link = Image._meta.get_ancestor_link(File)
+        objs = []
+        for file_obj, info in images:
+            image = Image(_width=info['width'], _height=info['height'])
+            setattr(image, parent_link.attname, file_obj.pk)
+            image.exif = info['exif']
+            subject_location = get_subject_location(info['exif'])
+            if subject_location is not None:
+                image.subject_location = '%d,%d' % subject_location
+            if hasattr(image, 'date_taken'):
+                image.date_taken = get_exif_datetime(info['exif']) or now()
+            objs.append(image)
+        fields = getattr(Image._meta, 'local_concrete_fields', Image._meta.local_fields)
+        db = router.db_for_write(Image)
+        batch_size = max(connections[db].ops.bulk_batch_size(fields, objs), 1)
+        for i in range(0, len(objs), batch_size):
+            Image._base_manager._insert(objs[i:i + batch_size], fields=fields, using=db)
 
 
 class Command(NoArgsCommand):
@@ -114,6 +403,12 @@ class Command(NoArgsCommand):
 
         manage.py --path=/tmp/assets/images
         manage.py --path=/tmp/assets/news --folder=images
+
+    Large directory structures can be imported in bulk mode, which hashes the
+    files in several processes, inserts the rows in batches and can resume an
+    interrupted import ::
+
+        manage.py --path=/tmp/assets --bulk --workers=4 --checkpoint=/tmp/assets.done
     """
 
     option_list = BaseCommand.option_list + (
@@ -127,8 +422,33 @@ class Command(NoArgsCommand):
             dest='base_folder',
             default=False,
             help='Specify the destination folder in which the directory structure should be imported'),
+        make_option('--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help='Use the bulk importer, intended for large directory structures'),
+        make_option('--workers',
+            action='store',
+            dest='workers',
+            type='int',
+            default=1,
+            help='Number of processes computing checksums and image dimensions (bulk mode)'),
+        make_option('--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=500,
+            help='Number of files inserted per transaction (bulk mode)'),
+        make_option('--checkpoint',
+            action='store',
+            dest='checkpoint',
+            default=None,
+            help='File recording the imported files, used to resume an interrupted import (bulk mode)'),
     )
 
     def handle_noargs(self, **options):
-        file_importer = FileImporter(**options)
+        if options.get('bulk'):
+            file_importer = BulkFileImporter(**options)
+        else:
+            file_importer = FileImporter(**options)
         file_importer.walker()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, NoArgsCommand
+from django.db import connections
+from django.utils import six
+
+from optparse import make_option
+
+from filer.models.imagemodels import Image
+from filer.models.thumbnailoptionmodels import ThumbnailOption
+from filer.utils.thumbnails import pregenerate_thumbnails
+
+
+def pregenerate_image_thumbnails(args):
+    """
+    Generates the missing thumbnails of one image. Runs in the worker
+    processes, returns ``(generated, existing, error)``.
+    """
+    pk, thumbnail_options = args
+    try:
+        image = Image.objects.get(pk=pk)
+        generated, existing = pregenerate_thumbnails(image, thumbnail_options)
+    except Exception as e:
+        return 0, 0, '#%s: %s' % (pk, e)
+    return generated, existing, None
+
+
+class Command(NoArgsCommand):
+    """
+    Generate the thumbnails used by filer for all the images, so they don't
+    have to be generated while rendering pages ::
+
+        manage.py pregenerate_thumbnails
+        manage.py pregenerate_thumbnails --workers=4
+
+    Thumbnails which already exist are skipped.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+            action='store',
+            dest='workers',
+            type='int',
+            default=1,
+            help='Number of processes generating thumbnails'),
+        make_option('--progress',
+            action='store',
+            dest='progress',
+            type='int',
+            default=100,
+            help='Report the progress every PROGRESS images'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        workers = options.get('workers') or 1
+        progress = options.get('progress') or 100
+        thumbnail_options = [o.as_dict for o in ThumbnailOption.objects.all()]
+        pks = list(Image.objects.order_by('pk').values_list('pk', flat=True))
+        tasks = [(pk, thumbnail_options) for pk in pks]
+
+        pool = None
+        if workers > 1:
+            # the worker processes must not share the database connections
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(
+                pregenerate_image_thumbnails, tasks, chunksize=8)
+        else:
+            results = six.moves.map(pregenerate_image_thumbnails, tasks)
+
+        start = time.time()
+        done = generated = existing = errors = 0
+        try:
+            for image_generated, image_existing, error in results:
+                done += 1
+                generated += image_generated
+                existing += image_existing
+                if error:
+                    errors += 1
+                    if verbosity >= 1:
+                        self.stderr.write(error)
+                if verbosity >= 1 and (done % progress == 0 or done == len(tasks)):
+                    elapsed = max(time.time() - start, 0.001)
+                    self.stdout.write(
+                        '%d/%d images, %d thumbnails generated, %d existing, '
+                        '%d errors (%.1f images/s, %.1f thumbnails/s)' % (
+                            done, len(tasks), generated, existing, errors,
+                            done / elapsed, generated / elapsed))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, NoArgsCommand
+
+from optparse import make_option
+
+from filer.models.deletionmodels import PendingDeletion
+
+
+class Command(NoArgsCommand):
+    """
+    Delete the stored files (and their thumbnails) queued for deletion when
+    their files were deleted ::
+
+        manage.py reap_deleted_files --workers=8
+
+    Meant to be run periodically with ``FILER_DEFERRED_DELETION`` enabled.
+    Failed deletions are retried on the next runs.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=500,
+            help='Number of queued files processed at once'),
+        make_option('--workers',
+            action='store',
+            dest='workers',
+            type='int',
+            default=4,
+            help='Number of threads deleting files'),
+        make_option('--max-attempts',
+            action='store',
+            dest='max_attempts',
+            type='int',
+            default=5,
+            help='Give up on files that failed to be deleted this many times'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(deleted, skipped, failed):
+            if verbosity >= 2:
+                self.stdout.write('%d deleted, %d skipped, %d failed' % (
+                    deleted, skipped, failed))
+
+        deleted, skipped, failed = PendingDeletion.objects.reap(
+            batch_size=options.get('batch_size') or 500,
+            workers=options.get('workers') or 1,
+            max_attempts=options.get('max_attempts') or 5,
+            progress=progress)
+        if verbosity >= 1:
+            self.stdout.write(
+                '%d files deleted, %d skipped as they are in use again, '
+                '%d failed' % (deleted, skipped, failed))
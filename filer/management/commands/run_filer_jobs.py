@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, NoArgsCommand
+
+from optparse import make_option
+
+from filer.models.jobmodels import FilerJob
+
+
+class Command(NoArgsCommand):
+    """
+    Run the pending jobs of the admin actions, polling the database for new
+    ones ::
+
+        manage.py run_filer_jobs --interval=5
+
+    Meant to be run by a process supervisor with ``FILER_JOB_EXECUTOR`` set
+    to ``'filer.utils.jobs.WorkerExecutor'``, several workers can run at the
+    same time. Failed jobs are resumed from their last checkpoint, finished
+    jobs are deleted after ``--keep-days``.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval',
+            action='store',
+            dest='interval',
+            type='float',
+            default=5,
+            help='Seconds to wait before polling again when no job is pending'),
+        make_option('--stale-after',
+            action='store',
+            dest='stale_after',
+            type='int',
+            default=60 * 60,
+            help='Resume running jobs without a checkpoint in this many '
+                 'seconds, their worker most likely died'),
+        make_option('--keep-days',
+            action='store',
+            dest='keep_days',
+            type='float',
+            default=7,
+            help='Delete the jobs done or failed this many days ago'),
+        make_option('--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Exit when no job is pending'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        interval = options.get('interval') or 5
+        stale_after = options.get('stale_after') or 60 * 60
+        keep_days = options.get('keep_days')
+        if keep_days is None:
+            keep_days = 7
+        while True:
+            FilerJob.objects.requeue_stale(stale_after)
+            FilerJob.objects.delete_finished(keep_days * 24 * 60 * 60)
+            job = FilerJob.objects.run_job()
+            if job is None:
+                if options.get('once'):
+                    break
+                time.sleep(interval)
+            elif verbosity >= 1:
+                if job.status == FilerJob.DONE:
+                    self.stdout.write('%s: %d of %d items processed' % (
+                        job, job.position, job.total))
+                else:
+                    self.stdout.write('%s: attempt %d failed: %s' % (
+                        job, job.attempts, job.last_error))
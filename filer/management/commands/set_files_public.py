@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError, NoArgsCommand
+
+from optparse import make_option
+
+from filer.models.filemodels import File
+from filer.models.foldermodels import Folder
+from filer.utils.transfer import set_files_public
+
+
+class Command(NoArgsCommand):
+    """
+    Disable (or enable, with ``--private``) the permission checks of files,
+    moving them to the public (or private) storage ::
+
+        manage.py set_files_public --folder=12 --workers=8
+        manage.py set_files_public --folder=12 --private
+
+    Without ``--folder`` all the files are changed. The files are moved by
+    several threads, the storages can usually move many files at once.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--private',
+            action='store_true',
+            dest='private',
+            default=False,
+            help='Make the files private instead of public'),
+        make_option('--folder',
+            action='store',
+            dest='folder',
+            type='int',
+            default=None,
+            help='Only change the files in the folder with this id and its '
+                 'subfolders'),
+        make_option('--workers',
+            action='store',
+            dest='workers',
+            type='int',
+            default=4,
+            help='Number of threads moving files'),
+        make_option('--progress',
+            action='store',
+            dest='progress',
+            type='int',
+            default=100,
+            help='Report the progress every PROGRESS files'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        is_public = not options.get('private')
+        progress_every = options.get('progress') or 100
+        files = File.objects.exclude(is_public=is_public)
+        if options.get('folder') is not None:
+            try:
+                folder = Folder.objects.get(pk=options['folder'])
+            except Folder.DoesNotExist:
+                raise CommandError('Folder %s does not exist' % options['folder'])
+            files = files.filter(
+                folder__in=folder.get_descendants(include_self=True))
+        start = time.time()
+
+        def progress(done, total):
+            if verbosity >= 1 and (done % progress_every == 0 or done == total):
+                elapsed = max(time.time() - start, 0.001)
+                self.stdout.write('%d/%d files moved (%.1f files/s)' % (
+                    done, total, done / elapsed))
+
+        count = set_files_public(files.order_by('pk'), is_public,
+                                 workers=options.get('workers') or 1,
+                                 progress=progress)
+        if verbosity >= 1 and not count:
+            self.stdout.write('No files to move')
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0003_thumbnailoption'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='sha1',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=40, verbose_name='sha1'),
+        ),
+    ]
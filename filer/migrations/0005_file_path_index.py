@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0004_file_sha1_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='file',
+            index_together=set([('file', 'is_public')]),
+        ),
+    ]
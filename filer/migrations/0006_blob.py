@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0005_file_path_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.CharField(max_length=40, unique=True, verbose_name='sha1')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='name')),
+                ('size', models.BigIntegerField(blank=True, null=True, verbose_name='size')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='references')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+            ],
+            options={
+                'verbose_name': 'blob',
+                'verbose_name_plural': 'blobs',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from filer.settings import FILER_IMAGE_MODEL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0007_pendingdeletion'),
+    ]
+
+    operations = []
+    if not FILER_IMAGE_MODEL:
+        operations.append(
+            migrations.AddField(
+                model_name='image',
+                name='_thumbnail_manifest',
+                field=models.TextField(blank=True, default='', editable=False),
+            )
+        )
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from filer.settings import FILER_IMAGE_MODEL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0008_image__thumbnail_manifest'),
+    ]
+
+    operations = []
+    if not FILER_IMAGE_MODEL:
+        operations.append(
+            migrations.AddField(
+                model_name='image',
+                name='_exif',
+                field=models.TextField(blank=True, editable=False, null=True),
+            )
+        )
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('filer', '0009_image__exif'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilerJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=255, verbose_name='action')),
+                ('description', models.CharField(blank=True, default='', max_length=255, verbose_name='description')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=16, verbose_name='status')),
+                ('_items', models.TextField(default='[]', editable=False)),
+                ('_arguments', models.TextField(default='{}', editable=False)),
+                ('_checkpoint', models.TextField(default='{}', editable=False)),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='total')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='position')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='count')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='last error')),
+                ('message', models.TextField(blank=True, default='', verbose_name='message')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='started at')),
+                ('modified_at', models.DateTimeField(blank=True, null=True, verbose_name='modified at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finished at')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='filer_jobs', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0010_filerjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingdeletion',
+            name='batch',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32, verbose_name='batch'),
+        ),
+    ]
@@ -1,22 +1,19 @@
 # -*- coding: utf-8 -*-
+import json
 import os
 
 from django.db import models
-from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
+from easy_thumbnails.models import Thumbnail
+from easy_thumbnails.utils import get_storage_hash
+
 from filer import settings as filer_settings
 from filer.models.filemodels import File
 from filer.utils.filer_easy_thumbnails import FilerThumbnailer
-from filer.utils.pil_exif import get_exif_for_file
-
-try:
-    from PIL import Image as PILImage
-except ImportError:
-    try:
-        import Image as PILImage
-    except ImportError:
-        raise ImportError("The Python Imaging Library was not found.")
+from filer.utils.image_probe import probe_file, probe_stored_file
+from filer.utils.pil_exif import get_subject_location
+from filer.utils.thumbnails import get_icon_thumbnail_options
 
 import logging
 
@@ -45,6 +42,11 @@ class BaseImage(File):
     subject_location = models.CharField(_('subject location'), max_length=64, null=True, blank=True,
                                         default=None)
 
+    # The EXIF data as JSON, None if it was not read yet, see ``exif``
+    _exif = models.TextField(null=True, blank=True, editable=False)
+    # The generated thumbnails, see ``thumbnail_manifest``
+    _thumbnail_manifest = models.TextField(blank=True, default='', editable=False)
+
     @classmethod
     def matches_file_type(cls, iname, ifile, request):
         # This was originally in admin/clipboardadmin.py  it was inside of a try
@@ -55,16 +57,56 @@ class BaseImage(File):
         iext = os.path.splitext(iname)[1].lower()
         return iext in ['.jpg', '.jpeg', '.png', '.gif']
 
+    def __init__(self, *args, **kwargs):
+        super(BaseImage, self).__init__(*args, **kwargs)
+        self._image_data_updated = False
+
     def save(self, *args, **kwargs):
         self.has_all_mandatory_data = self._check_validity()
+        if not self._image_data_updated and (
+                self.file_data_changed() or self._width is None):
+            self.update_image_data()
+        if self.file_data_changed() or (self.file and self.file.name != self._old_file_name):
+            # the thumbnails of the old content or of the copied file
+            self.thumbnail_manifest = {}
+        super(BaseImage, self).save(*args, **kwargs)
+        self._image_data_updated = False
+
+    def update_image_data(self):
+        """
+        Reads the dimensions and the EXIF data of the image, and the subject
+        location from the EXIF data if none was set, in one pass over the
+        header of the file.
+        """
         try:
-            # do this more efficient somehow?
-            self.file.seek(0)
-            self._width, self._height = PILImage.open(self.file).size
+            info = self.probe_file()
         except Exception:
             # probably the image is missing. nevermind.
-            pass
-        super(BaseImage, self).save(*args, **kwargs)
+            info = None
+        if info is not None:
+            self._width, self._height = info.width, info.height
+        self.exif = info.exif if info is not None else {}
+        if not self.subject_location:
+            subject_location = get_subject_location(self.exif)
+            if subject_location is not None:
+                self.subject_location = '%d,%d' % subject_location
+        # saving doesn't have to read them again
+        self._image_data_updated = True
+
+    def probe_file(self):
+        """
+        Returns the dimensions, format and EXIF orientation of the image as
+        an ``ImageInfo``, or None. Only the header of the image is read,
+        see ``filer.utils.image_probe``.
+        """
+        if not self.file._committed:
+            content = self.file.file
+            content.seek(0)
+            try:
+                return probe_file(content)
+            finally:
+                content.seek(0)
+        return probe_stored_file(self.file.storage, self.file.name)
 
     def _check_validity(self):
         if not self.name:
@@ -78,15 +120,27 @@ class BaseImage(File):
             return 1.0
 
     def _get_exif(self):
-        if hasattr(self, '_exif_cache'):
-            return self._exif_cache
-        else:
-            if self.file:
-                self._exif_cache = get_exif_for_file(self.file)
-            else:
+        if self._exif is None and self.file and not self._image_data_updated:
+            # saved by a version not storing the EXIF data yet
+            self.update_image_data()
+            if self.pk and not self.file_data_changed():
+                self.__class__._default_manager.filter(pk=self.pk).update(
+                    _exif=self._exif)
+                self._image_data_updated = False
+        if not hasattr(self, '_exif_cache'):
+            try:
+                self._exif_cache = json.loads(self._exif or '{}')
+            except ValueError:
                 self._exif_cache = {}
         return self._exif_cache
-    exif = property(_get_exif)
+
+    def _set_exif(self, exif):
+        self._exif_cache = exif
+        self._exif = json.dumps(exif, separators=(',', ':'), sort_keys=True)
+    # The EXIF data of the image, decoded by ``ExifTags`` (see
+    # ``filer.utils.pil_exif.serialize_exif``). It is read when the content
+    # of the file changes and stored, reading it doesn't touch the file.
+    exif = property(_get_exif, _set_exif)
 
     def has_edit_permission(self, request):
         return self.has_generic_permission(request, 'edit')
@@ -107,7 +161,7 @@ class BaseImage(File):
             return False
         elif user.is_superuser:
             return True
-        elif user == self.owner:
+        elif user.pk == self.owner_id:
             return True
         elif self.folder:
             return self.folder.has_generic_permission(request, permission_type)
@@ -129,31 +183,125 @@ class BaseImage(File):
     def height(self):
         return self._height or 0
 
+    def _get_thumbnail_manifest(self):
+        if not hasattr(self, '_thumbnail_manifest_cache'):
+            try:
+                self._thumbnail_manifest_cache = json.loads(self._thumbnail_manifest or '{}')
+            except ValueError:
+                self._thumbnail_manifest_cache = {}
+        return self._thumbnail_manifest_cache
+
+    def _set_thumbnail_manifest(self, manifest):
+        self._thumbnail_manifest_cache = manifest
+        self._thumbnail_manifest = json.dumps(manifest, sort_keys=True) if manifest else ''
+    # The thumbnails generated for the file, by the name of the thumbnail
+    # that is checked first by easy_thumbnails: ``[name, width, height]``.
+    # The urls of the thumbnails are resolved from it without asking the
+    # storage whether they exist.
+    thumbnail_manifest = property(_get_thumbnail_manifest, _set_thumbnail_manifest)
+
+    def _get_thumbnail_key(self, thumbnail_options):
+        thumbnailer = self.file
+        if hasattr(thumbnailer, 'get_options'):
+            thumbnail_options = thumbnailer.get_options(thumbnail_options)
+        return thumbnailer.get_thumbnail_name(thumbnail_options)
+
+    def update_thumbnail_manifest(self, thumbnails):
+        """
+        Records the ``(thumbnail_options, thumbnail)`` tuples of
+        ``thumbnails`` in the manifest, and saves it if it changed.
+        """
+        manifest = dict(self.thumbnail_manifest)
+        for thumbnail_options, thumbnail in thumbnails:
+            # the dimensions are known if the thumbnail was generated or
+            # THUMBNAIL_CACHE_DIMENSIONS is enabled, they are not read
+            # from the storage
+            width, height = getattr(thumbnail, '_dimensions_cache', None) or (None, None)
+            manifest[self._get_thumbnail_key(thumbnail_options)] = [
+                thumbnail.name, width, height]
+        if manifest == self.thumbnail_manifest:
+            return
+        self.thumbnail_manifest = manifest
+        if self.pk:
+            self.__class__._default_manager.filter(pk=self.pk).update(
+                _thumbnail_manifest=self._thumbnail_manifest)
+
+    def delete_thumbnails(self):
+        """
+        Deletes the thumbnails in the manifest and the ones easy_thumbnails
+        knows of from the thumbnail storage, unless other files share the
+        stored file, and clears the manifest.
+        """
+        names = set(entry[0] for entry in self.thumbnail_manifest.values())
+        self.thumbnail_manifest = {}
+        if File.objects.non_polymorphic().filter(
+                file=self.file.name, is_public=self.is_public
+        ).exclude(pk=self.pk).exists():
+            # the thumbnails are shared too
+            return
+        storage = self.file.thumbnail_storage
+        source_cache = self.file.get_source_cache()
+        if source_cache is not None:
+            storage_hash = get_storage_hash(storage)
+            cached = [(thumbnail.pk, thumbnail.name)
+                      for thumbnail in source_cache.thumbnails.all()
+                      if thumbnail.storage_hash == storage_hash]
+            names.update(name for pk, name in cached)
+            Thumbnail.objects.filter(pk__in=[pk for pk, name in cached]).delete()
+        for name in names:
+            storage.delete(name)
+
+    def _delete_thumbnails_before_move(self):
+        self.is_public = not self.is_public
+        self.delete_thumbnails()
+        self.is_public = not self.is_public
+
+    def _delete_stored_file(self):
+        if not filer_settings.FILER_DEFERRED_DELETION:
+            self.delete_thumbnails()
+        super(BaseImage, self)._delete_stored_file()
+
     def _generate_thumbnails(self, required_thumbnails):
         _thumbnails = {}
-        for name, opts in six.iteritems(required_thumbnails):
-            try:
-                opts.update({'subject_location': self.subject_location})
-                thumb = self.file.get_thumbnail(opts)
-                _thumbnails[name] = thumb.url
-            except Exception as e:
-                # catch exception and manage it. We can re-raise it for debugging
-                # purposes and/or just logging it, provided user configured
-                # proper logging configuration
-                if filer_settings.FILER_ENABLE_LOGGING:
-                    logger.error('Error while generating thumbnail: %s', e)
-                if filer_settings.FILER_DEBUG:
-                    raise
+        missing = []
+        manifest = self.thumbnail_manifest
+        for name in required_thumbnails:
+            opts = dict(required_thumbnails[name])
+            opts['subject_location'] = self.subject_location
+            entry = manifest.get(self._get_thumbnail_key(opts))
+            if entry:
+                _thumbnails[name] = self.file.thumbnail_storage.url(entry[0])
+            else:
+                missing.append((name, opts))
+        if not missing:
+            return _thumbnails
+        generated = []
+        try:
+            # decode the source image only once for all sizes
+            thumbs = self.file.get_multiple_thumbnails([opts for name, opts in missing])
+            generated = [(name, opts, thumb) for (name, opts), thumb in zip(missing, thumbs)]
+        except Exception:
+            # try the sizes one by one below, so that all errors are handled
+            # and the working sizes are still returned
+            for name, opts in missing:
+                try:
+                    generated.append((name, opts, self.file.get_thumbnail(opts)))
+                except Exception as e:
+                    # catch exception and manage it. We can re-raise it for debugging
+                    # purposes and/or just logging it, provided user configured
+                    # proper logging configuration
+                    if filer_settings.FILER_ENABLE_LOGGING:
+                        logger.error('Error while generating thumbnail: %s', e)
+                    if filer_settings.FILER_DEBUG:
+                        raise
+        for name, opts, thumb in generated:
+            _thumbnails[name] = thumb.url
+        self.update_thumbnail_manifest((opts, thumb) for name, opts, thumb in generated)
         return _thumbnails
 
     @property
     def icons(self):
-        required_thumbnails = dict(
-            (size, {'size': (int(size), int(size)),
-                    'crop': True,
-                    'upscale': True,
-                    'subject_location': self.subject_location})
-            for size in filer_settings.FILER_ADMIN_ICON_SIZES)
+        required_thumbnails = get_icon_thumbnail_options(self.subject_location)
         return self._generate_thumbnails(required_thumbnails)
 
     @property
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import re
+
+from django.db import IntegrityError, models
+from django.db.models import F
+from django.utils.translation import ugettext_lazy as _
+
+from filer import settings as filer_settings
+from filer.utils.compatibility import atomic, python_2_unicode_compatible
+from filer.utils.transfer import transfer_file
+
+_EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,16}$')
+
+
+class BlobManager(models.Manager):
+    def get_name(self, sha1, filename):
+        """
+        Returns the storage name of the blob with the checksum ``sha1``. The
+        extension of ``filename`` is kept, so that webservers can guess the
+        content type.
+        """
+        extension = os.path.splitext(filename or '')[1].lower()
+        if not _EXTENSION_RE.match(extension):
+            extension = ''
+        prefix = filer_settings.FILER_STORAGES['public']['main'].get(
+            'UPLOAD_TO_PREFIX') or ''
+        return os.path.join(prefix, 'blobs', sha1[0:2], sha1[2:4],
+                            sha1 + extension)
+
+    def acquire(self, sha1, size, filename, storage, content=None,
+                source=None):
+        """
+        Adds a reference to the blob with the checksum ``sha1`` and returns
+        its storage name. A missing blob is stored in ``storage``, either
+        from ``content`` or copied from ``source``, a ``(storage, name)``
+        tuple.
+        """
+        try:
+            with atomic():
+                name = self._add_reference(sha1)
+                if name is not None:
+                    return name
+                name = self.get_name(sha1, filename)
+                if not storage.exists(name):
+                    if source is not None:
+                        name = transfer_file(source[0], source[1], storage, name)
+                    else:
+                        name = storage.save(name, content)
+                self.create(sha1=sha1, name=name, size=size, references=1)
+                return name
+        except IntegrityError:
+            # the same content was stored concurrently
+            with atomic():
+                name = self._add_reference(sha1)
+            if name is None:
+                raise
+            return name
+
+    def _add_reference(self, sha1):
+        try:
+            blob = self.select_for_update().get(sha1=sha1)
+        except self.model.DoesNotExist:
+            return None
+        self.filter(pk=blob.pk).update(references=F('references') + 1)
+        return blob.name
+
+    def add_reference(self, name):
+        """
+        Adds a reference to the blob stored at ``name``. Returns False if
+        ``name`` is not a blob.
+        """
+        return bool(self.filter(name=name).update(
+            references=F('references') + 1))
+
+    def release(self, name, delete):
+        """
+        Removes a reference to the blob stored at ``name``. When the last
+        reference is removed the blob is deleted and ``delete()`` is called
+        to delete the stored file.
+
+        Returns None if ``name`` is not a blob, else whether it was deleted.
+        """
+        with atomic():
+            try:
+                blob = self.select_for_update().get(name=name)
+            except self.model.DoesNotExist:
+                return None
+            if blob.references > 1:
+                self.filter(pk=blob.pk).update(references=F('references') - 1)
+                return False
+            blob.delete()
+            # still locked, the content can't be acquired again meanwhile
+            delete()
+            return True
+
+    def release_many(self, references):
+        """
+        Removes ``references[name]`` references to the blobs stored at the
+        names of the ``references`` dict at once. Blobs losing their last
+        reference are deleted, their stored files have to be deleted by the
+        caller. Returns the names of the blobs that are still referenced.
+        """
+        names = list(references)
+        kept = []
+        with atomic():
+            for i in range(0, len(names), 500):
+                unreferenced = []
+                for blob in self.select_for_update().filter(name__in=names[i:i + 500]):
+                    count = references[blob.name]
+                    if blob.references > count:
+                        self.filter(pk=blob.pk).update(
+                            references=F('references') - count)
+                        kept.append(blob.name)
+                    else:
+                        unreferenced.append(blob.pk)
+                self.filter(pk__in=unreferenced).delete()
+        return kept
+
+
+@python_2_unicode_compatible
+class Blob(models.Model):
+    """
+    The content of public files, stored once in the public storage under a
+    name derived from its sha1 checksum (``FILER_CONTENT_ADDRESSABLE_STORAGE``).
+    All the files with the same content share a blob, ``references`` counts
+    them and the blob is deleted with the last one.
+    """
+    sha1 = models.CharField(_('sha1'), max_length=40, unique=True)
+    name = models.CharField(_('name'), max_length=255, unique=True)
+    size = models.BigIntegerField(_('size'), null=True, blank=True)
+    references = models.PositiveIntegerField(_('references'), default=0)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+
+    objects = BlobManager()
+
+    class Meta:
+        app_label = 'filer'
+        verbose_name = _('blob')
+        verbose_name_plural = _('blobs')
+
+    def __str__(self):
+        return self.name
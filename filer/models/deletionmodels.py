@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from django.db import models
+from django.db.models import F
+from django.utils.translation import ugettext_lazy as _
+
+from easy_thumbnails.models import Source
+from easy_thumbnails.utils import get_storage_hash
+
+from filer.fields.multistorage_file import STORAGES, THUMBNAIL_STORAGES
+from filer.utils.compatibility import python_2_unicode_compatible
+
+
+class PendingDeletionManager(models.Manager):
+    def enqueue(self, entries):
+        """
+        Queues the stored files of the ``(name, is_public)`` tuples of
+        ``entries`` for deletion and returns the queryset of the new entries.
+        """
+        # the primary keys are not set by bulk_create on most databases,
+        # the entries are found by the batch they are created in
+        batch = uuid.uuid4().hex
+        self.bulk_create([self.model(name=name, is_public=is_public,
+                                     batch=batch)
+                          for name, is_public in set(entries) if name],
+                         batch_size=500)
+        return self.filter(batch=batch)
+
+    def _get_referenced(self, entries):
+        # imported here, the file models queue their stored files
+        from filer.models.blobmodels import Blob
+        from filer.models.filemodels import File
+        names = set(entry.name for entry in entries)
+        referenced = set(File.objects.non_polymorphic().filter(
+            file__in=names).values_list('file', 'is_public'))
+        referenced.update((name, True) for name in Blob.objects.filter(
+            name__in=names).values_list('name', flat=True))
+        return referenced
+
+    def _get_thumbnails(self, entries):
+        """
+        Returns the ids of the sources of ``entries`` in the cache of
+        easy_thumbnails by ``(name, is_public)`` and the ``(storage, name)``
+        of their thumbnails.
+        """
+        sources, thumbnails = {}, []
+        for key in ('public', 'private'):
+            names = [entry.name for entry in entries
+                     if entry.is_public == (key == 'public')]
+            if not names:
+                continue
+            thumbnail_storage = THUMBNAIL_STORAGES[key]
+            thumbnail_storage_hash = get_storage_hash(thumbnail_storage)
+            for source in Source.objects.filter(
+                    name__in=names,
+                    storage_hash=get_storage_hash(STORAGES[key])
+            ).prefetch_related('thumbnails'):
+                sources[(source.name, key == 'public')] = source.pk
+                thumbnails.extend(
+                    (thumbnail_storage, thumbnail.name)
+                    for thumbnail in source.thumbnails.all()
+                    if thumbnail.storage_hash == thumbnail_storage_hash)
+        return sources, thumbnails
+
+    def reap(self, batch_size=500, workers=1, max_attempts=5, progress=None,
+             queryset=None):
+        """
+        Deletes the queued stored files and their thumbnails, or only the
+        entries of ``queryset``. Returns the number of queued files that were
+        deleted, that were skipped because they are referenced again and that
+        failed.
+
+        The queue is processed in batches of ``batch_size`` files: the
+        database is queried a few times per batch and the storages are
+        called by ``workers`` threads. Failed deletions are retried by later
+        runs, up to ``max_attempts`` times. ``progress`` is called as
+        ``progress(deleted, skipped, failed)`` after every batch.
+        """
+        if queryset is None:
+            queryset = self.all()
+        deleted = skipped = failed = 0
+        last_pk = 0
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            while True:
+                entries = list(queryset.filter(pk__gt=last_pk,
+                                               attempts__lt=max_attempts)
+                               .order_by('pk')[:batch_size])
+                if not entries:
+                    break
+                last_pk = entries[-1].pk
+                referenced = self._get_referenced(entries)
+                done = [entry for entry in entries
+                        if (entry.name, entry.is_public) in referenced]
+                skipped += len(done)
+                entries = [entry for entry in entries
+                           if (entry.name, entry.is_public) not in referenced]
+                sources, thumbnails = self._get_thumbnails(entries)
+
+                tasks = thumbnails + list(
+                    (STORAGES['public' if entry.is_public else 'private'], entry)
+                    for entry in entries)
+                results = (pool.imap_unordered(_delete_stored_file, tasks)
+                           if pool is not None else
+                           (_delete_stored_file(task) for task in tasks))
+                for entry, error in results:
+                    if not isinstance(entry, self.model):
+                        # a thumbnail, it can be regenerated if its deletion
+                        # failed and the source is deleted again
+                        continue
+                    if error is None:
+                        done.append(entry)
+                        deleted += 1
+                    else:
+                        self.filter(pk=entry.pk).update(
+                            attempts=F('attempts') + 1, last_error=error)
+                        failed += 1
+                Source.objects.filter(pk__in=[
+                    sources[(entry.name, entry.is_public)] for entry in done
+                    if (entry.name, entry.is_public) in sources]).delete()
+                self.filter(pk__in=[entry.pk for entry in done]).delete()
+                if progress is not None:
+                    progress(deleted, skipped, failed)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        return deleted, skipped, failed
+
+
+def _delete_stored_file(task):
+    storage, item = task
+    name = getattr(item, 'name', item)
+    try:
+        storage.delete(name)
+    except Exception as e:
+        return item, '%s: %s' % (e.__class__.__name__, e)
+    return item, None
+
+
+@python_2_unicode_compatible
+class PendingDeletion(models.Model):
+    """
+    A stored file (and its thumbnails) to delete, queued when its ``File``
+    was deleted and deleted later in batches by
+    ``PendingDeletion.objects.reap()`` (the ``reap_deleted_files`` management
+    command). Files that are referenced again are not deleted.
+    """
+    name = models.CharField(_('name'), max_length=255)
+    is_public = models.BooleanField(_('is public'), default=True)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True, default='')
+    batch = models.CharField(_('batch'), max_length=32, blank=True,
+                             default='', db_index=True, editable=False)
+
+    objects = PendingDeletionManager()
+
+    class Meta:
+        app_label = 'filer'
+        verbose_name = _('pending deletion')
+        verbose_name_plural = _('pending deletions')
+
+    def __str__(self):
+        return self.name
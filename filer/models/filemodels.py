@@ -4,11 +4,15 @@ from __future__ import unicode_literals
 
 import hashlib
 import os
+from collections import Counter
 
 from django.core import urlresolvers
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Count, Max
+from django.db.models.signals import class_prepared, post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 try:
@@ -21,23 +25,183 @@ except ImportError:
 from filer import settings as filer_settings
 from filer.fields.multistorage_file import MultiStorageFileField
 from filer.models import mixins
+from filer.models.blobmodels import Blob
+from filer.models.deletionmodels import PendingDeletion
 from filer.models.foldermodels import Folder
-from filer.utils.compatibility import python_2_unicode_compatible, LTE_DJANGO_1_7
+from filer.server.signing import sign_url
+from filer.utils.cache import get_cache_key, get_version
+from filer.utils.compatibility import (atomic, on_commit,
+                                      python_2_unicode_compatible, LTE_DJANGO_1_7)
+from filer.utils.transfer import transfer_file
+
+
+def get_path_cache_key(path, is_public):
+    # The folder permissions version covers the changes of the folder tree
+    # and of the permissions, the entry of a path is deleted when its file
+    # is saved or deleted (see ``invalidate_file_caches``).
+    return get_cache_key(
+        'file_path', get_version('folder_permissions'), int(is_public),
+        hashlib.sha1(path.encode('utf-8')).hexdigest())
 
 
 class FileManager(PolymorphicManager):
+    def get_by_path(self, path, is_public=False):
+        """
+        Returns the file stored at ``path``, the same as
+        ``get(file=path, is_public=is_public)`` would, for serving it.
+
+        The lookup is cached until the file stored at ``path`` is saved or
+        deleted or the folder tree or folder permissions change. The returned
+        ``File`` is built from the cache: it only has the fields needed to
+        check permissions and to serve the file (``id``, ``file``,
+        ``is_public``, ``owner``, ``sha1``, ``_file_size`` and the ``folder``
+        with its owner and tree position).
+        """
+        key = get_path_cache_key(path, is_public)
+        row = cache.get(key)
+        if row is None:
+            rows = list(self.filter(file=path, is_public=is_public).values_list(
+                'id', 'owner_id', 'sha1', '_file_size', 'folder_id',
+                'folder__owner_id', 'folder__tree_id', 'folder__lft',
+                'folder__rght')[:2])
+            if not rows:
+                raise self.model.DoesNotExist(
+                    'No file is stored at "%s"' % path)
+            if len(rows) > 1:
+                raise self.model.MultipleObjectsReturned(
+                    'More than one file is stored at "%s"' % path)
+            row = rows[0]
+            cache.set(key, row, filer_settings.FILER_FILE_PATH_CACHE_TIMEOUT)
+        (file_id, owner_id, sha1, size, folder_id, folder_owner_id,
+         tree_id, lft, rght) = row
+        folder = None
+        if folder_id is not None:
+            folder = Folder(id=folder_id, owner_id=folder_owner_id,
+                            tree_id=tree_id, lft=lft, rght=rght)
+            folder._state.adding, folder._state.db = False, self.db
+        file_obj = File(id=file_id, file=path, is_public=is_public,
+                        owner_id=owner_id, sha1=sha1, _file_size=size,
+                        folder=folder)
+        file_obj._state.adding, file_obj._state.db = False, self.db
+        return file_obj
+
+    def get_canonical_targets(self, file_ids):
+        """
+        Resolves the canonical URLs of many files at once. Returns a dict
+        mapping the ids of the public files with a stored file to a
+        ``(timestamp, url)`` tuple: the upload timestamp in their canonical
+        URL and their current URL.
+
+        The results are cached until the file is saved or deleted.
+        """
+        keys = dict((get_cache_key('canonical', int(file_id)), int(file_id))
+                    for file_id in file_ids)
+        targets = cache.get_many(list(keys))
+        missing = [file_id for key, file_id in keys.items()
+                   if key not in targets]
+        if missing:
+            found = dict(
+                (get_cache_key('canonical', file_obj.pk),
+                 (file_obj.uploaded_at.strftime('%s'), file_obj.url))
+                for file_obj in self.all().non_polymorphic().filter(
+                    pk__in=missing, is_public=True).only(
+                    'id', 'file', 'is_public', 'uploaded_at')
+                if file_obj.file)
+            # remember the files without a canonical URL too, the cache
+            # doesn't tell None apart from a missing entry
+            found.update((key, ()) for key, file_id in keys.items()
+                         if key not in targets and key not in found)
+            cache.set_many(found, filer_settings.FILER_CANONICAL_CACHE_TIMEOUT)
+            targets.update(found)
+        return dict((keys[key], target) for key, target in targets.items()
+                    if target)
+
     def find_all_duplicates(self):
         r = {}
-        for file_obj in self.all():
-            if file_obj.sha1:
-                q = self.filter(sha1=file_obj.sha1)
-                if len(q) > 1:
-                    r[file_obj.sha1] = q
+        for cluster in self.iter_duplicate_clusters():
+            r[cluster['sha1']] = self.filter(sha1=cluster['sha1'])
         return r
 
+    def iter_duplicate_clusters(self):
+        """
+        Streams one dict per sha1 that is shared by more than one file, using
+        a single grouped query. Each dict contains:
+
+        * ``sha1``
+        * ``count``: the number of files with this checksum
+        * ``stored_count``: the number of distinct stored files among them
+          (files may already share the same stored file)
+        * ``size``: the size of one copy, as recorded in ``_file_size``
+        * ``reclaimable``: the number of bytes used by redundant copies
+        """
+        clusters = (
+            self.exclude(sha1='')
+                .order_by()
+                .values('sha1')
+                .annotate(count=Count('id'),
+                          stored_count=Count('file', distinct=True),
+                          size=Max('_file_size'))
+                .filter(count__gt=1)
+                .order_by('sha1'))
+        for cluster in clusters.iterator():
+            cluster['reclaimable'] = (
+                (cluster['stored_count'] - 1) * (cluster['size'] or 0))
+            yield cluster
+
     def find_duplicates(self, file_obj):
         return [i for i in self.exclude(pk=file_obj.pk).filter(sha1=file_obj.sha1)]
 
+    def _get_delete_overrides(self, queryset):
+        """
+        Returns the content type ids of the files of ``queryset`` whose model
+        overrides ``File.delete()``.
+        """
+        base = getattr(File.delete, '__func__', File.delete)
+        ctype_ids = set(queryset.order_by().values_list(
+            'polymorphic_ctype', flat=True).distinct())
+        overrides = []
+        for ctype_id in ctype_ids:
+            model = ContentType.objects.get_for_id(ctype_id).model_class()
+            if (model is not None and
+                    getattr(model.delete, '__func__', model.delete) is not base):
+                overrides.append(ctype_id)
+        return overrides
+
+    def delete_files(self, queryset):
+        """
+        Deletes the files of ``queryset`` with a few bulk queries instead of
+        calling ``delete()`` on each of them, and returns their number. The
+        files of models overriding ``delete()`` are still deleted one by one.
+
+        Their stored files are queued as ``PendingDeletion`` and deleted in
+        batches once the transaction is committed, or later by the
+        ``reap_deleted_files`` management command if
+        ``FILER_DEFERRED_DELETION`` is True.
+        """
+        queryset = queryset.non_polymorphic()
+        with atomic():
+            n = 0
+            overrides = self._get_delete_overrides(queryset)
+            if overrides:
+                for f in self.filter(pk__in=list(queryset.filter(
+                        polymorphic_ctype__in=overrides).values_list(
+                        'pk', flat=True))):
+                    f.delete()
+                    n += 1
+                queryset = queryset.exclude(polymorphic_ctype__in=overrides)
+            stored_files = list(queryset.values_list('file', 'is_public'))
+            kept = set(Blob.objects.release_many(Counter(
+                name for name, is_public in stored_files if is_public)))
+            entries = PendingDeletion.objects.enqueue(
+                (name, is_public) for name, is_public in stored_files
+                if not (is_public and name in kept))
+            queryset.delete()
+        if not filer_settings.FILER_DEFERRED_DELETION:
+            # the stored files can't be restored if the transaction is
+            # rolled back, and only the ones of these files are deleted
+            on_commit(lambda: PendingDeletion.objects.reap(queryset=entries))
+        return n + len(stored_files)
+
 
 @python_2_unicode_compatible
 class File(PolymorphicModel, mixins.IconsMixin):
@@ -48,7 +212,8 @@ class File(PolymorphicModel, mixins.IconsMixin):
     file = MultiStorageFileField(_('file'), null=True, blank=True, max_length=255)
     _file_size = models.IntegerField(_('file size'), null=True, blank=True)
 
-    sha1 = models.CharField(_('sha1'), max_length=40, blank=True, default='')
+    sha1 = models.CharField(_('sha1'), max_length=40, blank=True, default='',
+                            db_index=True)
 
     has_all_mandatory_data = models.BooleanField(_('has all mandatory data'), default=False, editable=False)
 
@@ -81,39 +246,149 @@ class File(PolymorphicModel, mixins.IconsMixin):
     def __init__(self, *args, **kwargs):
         super(File, self).__init__(*args, **kwargs)
         self._old_is_public = self.is_public
+        # Read the raw value, so that the file is not touched in any way
+        file_value = self.__dict__.get('file')
+        self._old_file_name = getattr(file_value, 'name', file_value)
+        self._file_data_changed_hint = None
 
     def _move_file(self):
         """
         Move the file from src to dst.
         """
-        src_file_name = self.file.name
-        dst_file_name = self._meta.get_field('file').generate_filename(
-            self, self.original_filename)
+        self._delete_thumbnails_before_move()
+        self._transfer_file()
 
+    def _delete_thumbnails_before_move(self):
+        # We are toggling the is_public to make sure that easy_thumbnails can
+        # delete the thumbnails
+        self.is_public = not self.is_public
+        self.file.delete_thumbnails()
+        self.is_public = not self.is_public
+
+    def _transfer_file(self):
+        """
+        Moves the stored file to the storage matching ``is_public``. Called
+        in the transaction saving the file, see ``_plan_transfer``.
+        """
+        transfer = self._plan_transfer()
+        self._finish_transfer(transfer, self._copy_stored_file(transfer))
+
+    def _plan_transfer(self):
+        """
+        Returns the ``(src_storage, src_name, dst_storage, dst_name, blob)``
+        transfer moving the stored file to the storage matching
+        ``is_public``, ``blob`` is ``'acquire'`` if the file becomes a blob
+        and ``'release'`` if it leaves one.
+
+        The stored file is then copied by ``_copy_stored_file``, which only
+        touches the storages and can run in other threads, and the transfer
+        is finished in the transaction saving the file by
+        ``_finish_transfer`` (or discarded by ``_discard_transfer``).
+        """
+        src_name = self.file.name
         if self.is_public:
             src_storage = self.file.storages['private']
             dst_storage = self.file.storages['public']
         else:
             src_storage = self.file.storages['public']
             dst_storage = self.file.storages['private']
+        if (self.is_public and self.sha1 and
+                filer_settings.FILER_CONTENT_ADDRESSABLE_STORAGE):
+            return (src_storage, src_name, dst_storage,
+                    Blob.objects.get_name(self.sha1, src_name), 'acquire')
+        blob = None
+        if not self.is_public and Blob.objects.filter(name=src_name).exists():
+            # private files are permission checked by their path, they never
+            # share a blob
+            blob = 'release'
+        dst_name = self._meta.get_field('file').generate_filename(
+            self, self.original_filename)
+        return src_storage, src_name, dst_storage, dst_name, blob
 
-        # delete the thumbnail
-        # We are toggling the is_public to make sure that easy_thumbnails can
-        # delete the thumbnails
-        self.is_public = not self.is_public
-        self.file.delete_thumbnails()
-        self.is_public = not self.is_public
-        # This is needed because most of the remote File Storage backend do not
-        # open the file.
-        src_file = src_storage.open(src_file_name)
-        src_file.open()
-        self.file = dst_storage.save(dst_file_name,
-            ContentFile(src_file.read()))
-        src_storage.delete(src_file_name)
+    def _copy_stored_file(self, transfer):
+        """
+        Copies the stored file of ``transfer`` and returns the name of the
+        copy. Only touches the storages.
+        """
+        src_storage, src_name, dst_storage, dst_name, blob = transfer
+        if blob == 'acquire' and dst_storage.exists(dst_name):
+            # the blob is stored already
+            return dst_name
+        return transfer_file(src_storage, src_name, dst_storage, dst_name)
+
+    def _finish_transfer(self, transfer, name):
+        """
+        Points the file to the copy ``name`` of its stored file and updates
+        the references of the blobs, in the transaction saving the file. The
+        source is deleted once the transaction is committed.
+        """
+        src_storage, src_name, dst_storage, dst_name, blob = transfer
+        if blob == 'acquire':
+            self.file = Blob.objects.acquire(
+                self.sha1, self._file_size, src_name, dst_storage,
+                source=(src_storage, src_name))
+            if name != self.file.name:
+                # copied to another name, the blob was stored concurrently
+                dst_storage.delete(name)
+        else:
+            self.file = name
+        if blob == 'release':
+            Blob.objects.release(src_name,
+                                 lambda: src_storage.delete(src_name))
+        else:
+            on_commit(lambda: src_storage.delete(src_name))
+        # the content did not change
+        self._old_file_name = self.file.name
+
+    def _discard_transfer(self, transfer, name):
+        """
+        Deletes the copy ``name`` of the stored file of a transfer that is
+        not finished.
+        """
+        src_storage, src_name, dst_storage, dst_name, blob = transfer
+        # a copy to the name of a blob is used by the next upload of the
+        # same content
+        if blob != 'acquire':
+            dst_storage.delete(name)
+
+    def _store_blob(self):
+        """
+        Stores the uploaded content as a blob, or refers to the blob with the
+        same content if there is one already.
+        """
+        content = self.file.file
+        content.seek(0)
+        name = Blob.objects.acquire(
+            self.sha1, self._file_size, self.file.name,
+            self.file.storages['public'], content=content)
+        if self.pk and name == self._old_file_name:
+            # the same content was uploaded again, it is referenced already
+            Blob.objects.release(name, lambda: None)
+        self.file = name
+
+    def detach_blob(self):
+        """
+        Gives the file a stored file of its own if it shares a blob with
+        other files, e.g. before changing the stored file in place. The blob
+        is released when the file is saved.
+        """
+        if not self.is_public or not Blob.objects.filter(name=self.file.name).exists():
+            return
+        storage = self.file.storages['public']
+        self.file = transfer_file(
+            storage, self.file.name, storage,
+            self._meta.get_field('file').generate_filename(
+                self, self.original_filename))
 
     def _copy_file(self, destination, overwrite=False):
         """
         Copies the file to a destination files and returns it.
+
+        The content is not read into memory: local files are cloned or
+        copied by the file system where possible, see
+        ``filer.utils.transfer.transfer_file``. The copy has the same content,
+        call ``keep_file_data()`` after assigning it to skip computing the
+        size and checksum again.
         """
 
         if overwrite:
@@ -123,13 +398,11 @@ class File(PolymorphicModel, mixins.IconsMixin):
             raise NotImplementedError
 
         src_file_name = self.file.name
+        if self.is_public and Blob.objects.add_reference(src_file_name):
+            # the copy shares the blob
+            return src_file_name
         storage = self.file.storages['public' if self.is_public else 'private']
-
-        # This is needed because most of the remote File Storage backend do not
-        # open the file.
-        src_file = storage.open(src_file_name)
-        src_file.open()
-        return storage.save(destination, ContentFile(src_file.read()))
+        return transfer_file(storage, src_file_name, storage, destination)
 
     def generate_sha1(self):
         sha = hashlib.sha1()
@@ -143,6 +416,56 @@ class File(PolymorphicModel, mixins.IconsMixin):
         # to make sure later operations can read the whole file
         self.file.seek(0)
 
+    def file_data_changed(self):
+        """
+        Returns True if the data derived from the content of the file (size,
+        checksum) may be outdated: a new file was assigned or uploaded, or the
+        data was never computed. Depending on the storage backend computing it
+        means downloading the whole file, so it is not done on every save.
+        """
+        if not self.file:
+            return False
+        if self._file_data_changed_hint is not None:
+            return self._file_data_changed_hint
+        return (not self.file._committed or
+                self.file.name != self._old_file_name or
+                not self.sha1 or self._file_size is None)
+
+    def invalidate_file_data(self):
+        """
+        Forces the data derived from the content of the file to be computed
+        on the next save, e.g. after the stored file was overwritten in place.
+        """
+        self._file_data_changed_hint = True
+
+    def keep_file_data(self):
+        """
+        Keeps the data derived from the content of the file on the next save
+        although the file changed, e.g. after a copy of it was assigned.
+        """
+        self._file_data_changed_hint = False
+
+    def update_file_data(self):
+        """
+        Computes the size and the sha1 checksum of the file.
+        """
+        try:
+            self._file_size = self.file.size
+        except:
+            pass
+        sha1 = None
+        if not self.file._committed:
+            # Uploads may come with a checksum that was computed while the
+            # chunks were received (see ``filer.utils.files.Sha1UploadHandler``)
+            sha1 = getattr(self.file.file, 'sha1', None)
+        if sha1:
+            self.sha1 = sha1
+        else:
+            try:
+                self.generate_sha1()
+            except Exception:
+                pass
+
     def save(self, *args, **kwargs):
         # check if this is a subclass of "File" or not and set
         # _file_type_plugin_name
@@ -153,32 +476,53 @@ class File(PolymorphicModel, mixins.IconsMixin):
             pass
         elif issubclass(self.__class__, File):
             self._file_type_plugin_name = self.__class__.__name__
-        # cache the file size
-        # TODO: only do this if needed (depending on the storage backend the whole file will be downloaded)
-        try:
-            self._file_size = self.file.size
-        except:
-            pass
-        if self._old_is_public != self.is_public and self.pk:
-            self._move_file()
-            self._old_is_public = self.is_public
-        # generate SHA1 hash
-        # TODO: only do this if needed (depending on the storage backend the whole file will be downloaded)
-        try:
-            self.generate_sha1()
-        except Exception:
-            pass
-        super(File, self).save(*args, **kwargs)
+        # cache the file size and generate SHA1 hash
+        if self.file_data_changed():
+            self.update_file_data()
+        if (self.is_public and self.file and not self.file._committed and
+                self.sha1 and filer_settings.FILER_CONTENT_ADDRESSABLE_STORAGE):
+            self._store_blob()
+        # the cached lookup of the previous path (see invalidate_file_caches)
+        self._previous_path = (self._old_file_name, self._old_is_public)
+        # the references of the blobs are updated along with the row
+        with atomic():
+            if self._old_is_public != self.is_public and self.pk:
+                self._move_file()
+                self._old_is_public = self.is_public
+            old_file_name = self._old_file_name
+            super(File, self).save(*args, **kwargs)
+            self._old_file_name = self.file.name if self.file else None
+            if (self.is_public and old_file_name and
+                    old_file_name != self._old_file_name):
+                # a new file replaced a blob
+                storage = self.file.storages['public']
+                Blob.objects.release(old_file_name,
+                                     lambda: storage.delete(old_file_name))
+        self._file_data_changed_hint = None
     save.alters_data = True
 
     def delete(self, *args, **kwargs):
         # Delete the model before the file
         super(File, self).delete(*args, **kwargs)
+        if self.is_public:
+            released = Blob.objects.release(
+                self.file.name, self._delete_stored_file)
+            if released is not None:
+                return
+        if filer_settings.FILER_DEFERRED_DELETION:
+            # the references are checked when the queue is processed
+            self._delete_stored_file()
         # Delete the file if there are no other Files referencing it.
-        if not File.objects.filter(file=self.file.name, is_public=self.is_public).exists():
-            self.file.delete(False)
+        elif not File.objects.filter(file=self.file.name, is_public=self.is_public).exists():
+            self._delete_stored_file()
     delete.alters_data = True
 
+    def _delete_stored_file(self):
+        if filer_settings.FILER_DEFERRED_DELETION:
+            PendingDeletion.objects.enqueue([(self.file.name, self.is_public)])
+        else:
+            self.file.delete(False)
+
     @property
     def label(self):
         if self.name in ['', None]:
@@ -210,7 +554,7 @@ class File(PolymorphicModel, mixins.IconsMixin):
             return False
         elif user.is_superuser:
             return True
-        elif user == self.owner:
+        elif user.pk == self.owner_id:
             return True
         elif self.folder:
             return self.folder.has_generic_permission(request, permission_type)
@@ -257,6 +601,35 @@ class File(PolymorphicModel, mixins.IconsMixin):
             r = ''
         return r
 
+    def _sign_url(self, url, path, request, max_age):
+        if self.is_public or not filer_settings.FILER_SIGNED_URLS or not url:
+            return url
+        return sign_url(url, path, user=request.user, max_age=max_age)
+
+    def get_signed_url(self, request, max_age=None):
+        """
+        Returns the URL of the file with a token granting the user of
+        ``request`` access to it without checking the permissions again (see
+        ``filer.server.signing``), or None if the user can't read the file.
+
+        Public files, and all files unless ``FILER_SIGNED_URLS`` is enabled,
+        get their plain URL.
+        """
+        if not self.has_read_permission(request):
+            return None
+        return self._sign_url(self.url, self.file.name, request, max_age)
+
+    def get_signed_thumbnail_url(self, request, thumbnail_options,
+                                 max_age=None):
+        """
+        Returns the URL of the thumbnail of ``thumbnail_options``, signed
+        like ``get_signed_url``, or None if the user can't read the file.
+        """
+        if not self.has_read_permission(request):
+            return None
+        thumbnail = self.file.get_thumbnail(thumbnail_options)
+        return self._sign_url(thumbnail.url, thumbnail.name, request, max_age)
+
     @property
     def canonical_url(self):
         url = ''
@@ -320,3 +693,34 @@ class File(PolymorphicModel, mixins.IconsMixin):
         app_label = 'filer'
         verbose_name = _('file')
         verbose_name_plural = _('files')
+        index_together = (('file', 'is_public'),)
+
+
+def invalidate_file_caches(sender, instance, **kwargs):
+    """
+    Invalidates the cached lookups of the current and the previous path of
+    a file (see ``FileManager.get_by_path``) and its cached canonical URL
+    when a file, or a subclass of it, is saved or deleted.
+    """
+    paths = [(instance.file.name if instance.file else None,
+              instance.is_public),
+             getattr(instance, '_previous_path', (None, None))]
+    keys = [get_path_cache_key(name, is_public)
+            for name, is_public in paths if name]
+    keys.append(get_cache_key('canonical', instance.pk))
+    cache.delete_many(keys)
+
+
+def connect_file_receivers(sender, **kwargs):
+    # Connected for File and its subclasses only, a receiver for any sender
+    # would run for every model and disable their fast deletes.
+    if issubclass(sender, File):
+        post_save.connect(invalidate_file_caches, sender=sender,
+                          dispatch_uid='filer_file_post_save')
+        post_delete.connect(invalidate_file_caches, sender=sender,
+                            dispatch_uid='filer_file_post_delete')
+
+
+connect_file_receivers(File)
+class_prepared.connect(connect_file_receivers,
+                       dispatch_uid='filer_file_class_prepared')
@@ -2,18 +2,23 @@
 
 from __future__ import unicode_literals
 
+import bisect
+
 from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.core import urlresolvers
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, m2m_changed
 from django.utils.http import urlquote
 from django.utils.translation import ugettext_lazy as _
 
 from filer.models import mixins
 from filer import settings as filer_settings
-from filer.utils.compatibility import python_2_unicode_compatible
+from filer.utils.cache import bump_version, get_cache_key, get_version
+from filer.utils.compatibility import python_2_unicode_compatible, LTE_DJANGO_1_6
 
 import mptt
 
@@ -23,6 +28,105 @@ class FolderManager(models.Manager):
         return self.get_query_set().filter(has_all_mandatory_data=False)
 
 
+class FolderPermissionIndex(object):
+    """
+    The set of folders a user has a given permission on.
+
+    Instead of expanded id sets, rules of type ``CHILDREN`` are kept as the
+    MPTT interval ``(tree_id, lft, rght)`` of the folder they are attached
+    to. Overlapping intervals are merged, so checking a folder is a binary
+    search in the intervals of its tree. Instances are picklable and meant to
+    be stored in the cache.
+    """
+    def __init__(self, unrestricted=False):
+        self.unrestricted = unrestricted
+        self.allow = _FolderSet()
+        self.deny = _FolderSet()
+
+    def add(self, permission, value, folder_id, tree_id, lft, rght):
+        folder_set = self.allow if value == FolderPermission.ALLOW else self.deny
+        if folder_id is None:
+            folder_set.all = True
+        elif permission == FolderPermission.CHILDREN:
+            folder_set.add_interval(tree_id, lft, rght)
+        else:
+            folder_set.ids.add(folder_id)
+
+    def finalize(self):
+        self.allow.finalize()
+        self.deny.finalize()
+
+    def covers(self, folder):
+        """
+        Returns True if the permission is granted on ``folder``. Deny has
+        precedence over allow.
+        """
+        if self.unrestricted:
+            return True
+        return self.allow.covers(folder) and not self.deny.covers(folder)
+
+    def as_q(self, prefix=''):
+        """
+        Returns a ``Q`` object that filters a queryset down to the covered
+        folders. ``prefix`` is the lookup path to the folder, e.g.
+        ``'folder__'`` for files.
+        """
+        if self.unrestricted:
+            return Q()
+        q = self.allow.as_q(prefix)
+        if not self.deny.is_empty():
+            q &= ~self.deny.as_q(prefix)
+        return q
+
+
+class _FolderSet(object):
+    def __init__(self):
+        self.all = False
+        self.ids = set()
+        self.trees = {}
+
+    def add_interval(self, tree_id, lft, rght):
+        self.trees.setdefault(tree_id, []).append((lft, rght))
+
+    def finalize(self):
+        # Merge the intervals of every tree into sorted, disjoint
+        # ``(starts, ends)`` lists suitable for bisection.
+        for tree_id, intervals in list(self.trees.items()):
+            starts, ends = [], []
+            for lft, rght in sorted(intervals):
+                if ends and lft <= ends[-1]:
+                    ends[-1] = max(ends[-1], rght)
+                else:
+                    starts.append(lft)
+                    ends.append(rght)
+            self.trees[tree_id] = (starts, ends)
+
+    def is_empty(self):
+        return not (self.all or self.ids or self.trees)
+
+    def covers(self, folder):
+        if self.all or folder.id in self.ids:
+            return True
+        if folder.tree_id not in self.trees:
+            return False
+        starts, ends = self.trees[folder.tree_id]
+        i = bisect.bisect_right(starts, folder.lft) - 1
+        return i >= 0 and folder.lft <= ends[i]
+
+    def as_q(self, prefix=''):
+        if self.all:
+            return Q()
+        q = Q(**{prefix + 'id__in': list(self.ids)})
+        for tree_id, (starts, ends) in self.trees.items():
+            for lft, rght in zip(starts, ends):
+                q |= Q(**{
+                    prefix + 'tree_id': tree_id,
+                    prefix + 'lft__gte': lft,
+                    prefix + 'lft__lte': rght,
+                })
+        return q
+
+
 class FolderPermissionManager(models.Manager):
     """
     Theses methods are called by introspection from "has_generic_permisison" on
@@ -32,6 +136,10 @@ class FolderPermissionManager(models.Manager):
         """
         Give a list of a Folders where the user has read rights or the string
         "All" if the user has all rights.
+
+        Kept for backwards compatibility, the ids of all the folders below a
+        permission are loaded: filter with ``get_permission_index(user,
+        'read').as_q()`` instead.
         """
         return self.__get_id_list(user, "can_read")
 
@@ -44,44 +152,47 @@ class FolderPermissionManager(models.Manager):
     def __get_id_list(self, user, attr):
         if user.is_superuser or not filer_settings.FILER_ENABLE_PERMISSIONS:
             return 'All'
-        allow_list = set()
-        deny_list = set()
-        group_ids = user.groups.all().values_list('id', flat=True)
-        q = Q(user=user) | Q(group__in=group_ids) | Q(everybody=True)
-        perms = self.filter(q).order_by('folder__tree_id', 'folder__level',
-                                        'folder__lft')
-        for perm in perms:
-            p = getattr(perm, attr)
-
-            if p is None:
-                # Not allow nor deny, we continue with the next permission
-                continue
+        index = self.get_permission_index(user, attr[len('can_'):])
+        return set(Folder.objects.filter(index.as_q()).values_list('id', flat=True))
 
-            if not perm.folder:
-                assert perm.type == FolderPermission.ALL
-
-                if p == FolderPermission.ALLOW:
-                    allow_list.update(Folder.objects.all().values_list('id', flat=True))
-                else:
-                    deny_list.update(Folder.objects.all().values_list('id', flat=True))
-
-                continue
-
-            folder_id = perm.folder.id
-
-            if p == FolderPermission.ALLOW:
-                allow_list.add(folder_id)
-            else:
-                deny_list.add(folder_id)
-
-            if perm.type == FolderPermission.CHILDREN:
-                if p == FolderPermission.ALLOW:
-                    allow_list.update(perm.folder.get_descendants().values_list('id', flat=True))
-                else:
-                    deny_list.update(perm.folder.get_descendants().values_list('id', flat=True))
+    def get_permission_index(self, user, permission_type):
+        """
+        Returns the ``FolderPermissionIndex`` of ``user`` for
+        ``permission_type`` ('read', 'edit' or 'add_children').
 
-        # Deny has precedence over allow
-        return allow_list - deny_list
+        The index is cached per user and permission type until a folder
+        permission, the folder tree or a group membership changes.
+        """
+        if user.is_superuser or not filer_settings.FILER_ENABLE_PERMISSIONS:
+            return FolderPermissionIndex(unrestricted=True)
+        version = get_version('folder_permissions')
+        memo = getattr(user, '_filer_permission_indexes', None)
+        if memo is None or memo.get('version') != version:
+            memo = user._filer_permission_indexes = {'version': version}
+        if permission_type not in memo:
+            key = get_cache_key('folder_permissions', version, user.pk,
+                                permission_type)
+            index = cache.get(key)
+            if index is None:
+                index = self._build_permission_index(user, permission_type)
+                cache.set(key, index,
+                          filer_settings.FILER_PERMISSION_CACHE_TIMEOUT)
+            memo[permission_type] = index
+        return memo[permission_type]
+
+    def _build_permission_index(self, user, permission_type):
+        attr = "can_%s" % permission_type
+        index = FolderPermissionIndex()
+        group_ids = user.groups.all().values_list('id', flat=True)
+        q = Q(user=user) | Q(group__in=group_ids) | Q(everybody=True)
+        perms = self.filter(q).exclude(**{attr: None}).values_list(
+            'type', attr, 'folder_id', 'folder__tree_id', 'folder__lft',
+            'folder__rght')
+        for perm_type, value, folder_id, tree_id, lft, rght in perms:
+            assert folder_id is not None or perm_type == FolderPermission.ALL
+            index.add(perm_type, value, folder_id, tree_id, lft, rght)
+        index.finalize()
+        return index
 
 
 @python_2_unicode_compatible
@@ -174,7 +285,7 @@ class Folder(models.Model, mixins.IconsMixin):
             return False
         elif user.is_superuser:
             return True
-        elif user == self.owner:
+        elif user.pk == self.owner_id:
             return True
         else:
             if not hasattr(self, "permission_cache") or\
@@ -185,17 +296,15 @@ class Folder(models.Model, mixins.IconsMixin):
                         'user': request.user,
                     }
 
-                # This calls methods on the manager i.e. get_read_id_list()
-                func = getattr(FolderPermission.objects,
-                               "get_%s_id_list" % permission_type)
-                permission = func(user)
-                if permission == "All":
+                index = FolderPermission.objects.get_permission_index(
+                    user, permission_type)
+                if index.unrestricted:
                     self.permission_cache[permission_type] = True
                     self.permission_cache['read'] = True
                     self.permission_cache['edit'] = True
                     self.permission_cache['add_children'] = True
                 else:
-                    self.permission_cache[permission_type] = self.id in permission
+                    self.permission_cache[permission_type] = index.covers(self)
             return self.permission_cache[permission_type]
 
     def get_admin_url_path(self):
@@ -321,3 +430,58 @@ class FolderPermission(models.Model):
         verbose_name = _('folder permission')
         verbose_name_plural = _('folder permissions')
         app_label = 'filer'
+
+
+def invalidate_permission_index(**kwargs):
+    """
+    Folder permission indexes store MPTT intervals, so they have to be
+    rebuilt whenever a permission, the folder tree or a group membership
+    changes.
+    """
+    bump_version('folder_permissions')
+
+
+def _invalidate_permission_index_on_group_change(sender, instance, model,
+                                                 action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_permission_index()
+
+
+def connect_group_change_receiver():
+    """
+    Connects the invalidation of the permission indexes to the changes of
+    the groups of the users. Called once the user model is loaded.
+    """
+    try:
+        from django.contrib.auth import get_user_model
+    except ImportError:
+        # Django < 1.5
+        user_model = auth_models.User
+    else:
+        user_model = get_user_model()
+    groups = getattr(user_model, 'groups', None)
+    if groups is not None:
+        m2m_changed.connect(_invalidate_permission_index_on_group_change,
+                            sender=groups.through,
+                            dispatch_uid='filer_group_membership_m2m_changed')
+
+
+post_save.connect(invalidate_permission_index, sender=FolderPermission,
+                  dispatch_uid='filer_folderpermission_post_save')
+post_delete.connect(invalidate_permission_index, sender=FolderPermission,
+                    dispatch_uid='filer_folderpermission_post_delete')
+post_save.connect(invalidate_permission_index, sender=Folder,
+                  dispatch_uid='filer_folder_post_save')
+post_delete.connect(invalidate_permission_index, sender=Folder,
+                    dispatch_uid='filer_folder_post_delete')
+if LTE_DJANGO_1_6:
+    # see FilerConfig.ready() otherwise
+    connect_group_change_receiver()
+try:
+    from mptt.signals import node_moved
+except ImportError:
+    # django-mptt < 0.7
+    pass
+else:
+    node_moved.connect(invalidate_permission_index, sender=Folder,
+                       dispatch_uid='filer_folder_node_moved')
@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
 import logging
 
-from django.conf import settings
 from django.db import models
-from django.utils.timezone import now, make_aware, get_current_timezone
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 from filer import settings as filer_settings
 from filer.models.abstract import BaseImage
 from filer.utils.loader import load_object
+from filer.utils.pil_exif import get_exif_datetime
+from filer.utils.thumbnails import pregenerate_thumbnails
 
 logger = logging.getLogger("filer")
 
@@ -29,20 +29,7 @@ if not filer_settings.FILER_IMAGE_MODEL:
         def save(self, *args, **kwargs):
             if self.date_taken is None:
                 try:
-                    exif_date = self.exif.get('DateTimeOriginal', None)
-                    if exif_date is not None:
-                        d, t = exif_date.split(" ")
-                        year, month, day = d.split(':')
-                        hour, minute, second = t.split(':')
-                        if getattr(settings, "USE_TZ", False):
-                            tz = get_current_timezone()
-                            self.date_taken = make_aware(datetime(
-                                int(year), int(month), int(day),
-                                int(hour), int(minute), int(second)), tz)
-                        else:
-                            self.date_taken = datetime(
-                                int(year), int(month), int(day),
-                                int(hour), int(minute), int(second))
+                    self.date_taken = get_exif_datetime(self.exif)
                 except Exception:
                     pass
             if self.date_taken is None:
@@ -52,3 +39,21 @@ else:
     # This is just an alias for the real model defined elsewhere
     # to let imports works transparently
     Image = load_object(filer_settings.FILER_IMAGE_MODEL)
+
+
+def pregenerate_thumbnails_on_save(sender, instance, raw=False, **kwargs):
+    if raw or not instance.file_data_changed():
+        return
+    try:
+        pregenerate_thumbnails(instance)
+    except Exception as e:
+        if filer_settings.FILER_ENABLE_LOGGING:
+            logger.error('Error while generating thumbnails: %s', e)
+        if filer_settings.FILER_DEBUG:
+            raise
+
+
+if filer_settings.FILER_PREGENERATE_THUMBNAILS:
+    models.signals.post_save.connect(
+        pregenerate_thumbnails_on_save, sender=Image,
+        dispatch_uid='filer_pregenerate_thumbnails')
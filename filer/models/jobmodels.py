@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from filer import settings as filer_settings
+from filer.utils.compatibility import atomic, python_2_unicode_compatible
+from filer.utils.loader import load_object
+
+
+class FilerJobManager(models.Manager):
+    def enqueue(self, action, items, arguments=None, user=None,
+                description='', message=''):
+        """
+        Creates a pending job calling the handler at the dotted path
+        ``action`` on the (JSON serializable) ``items``, see ``FilerJob``.
+        """
+        job = self.model(action=action, user=user, description=description,
+                         message=message, total=len(items))
+        job.items = list(items)
+        job.arguments = arguments or {}
+        job.state = {}
+        job.save()
+        return job
+
+    def claim(self, pk=None):
+        """
+        Marks the oldest pending job (or the pending job ``pk``) as running
+        and returns it, or returns None. A job is claimed by a single caller
+        even if several workers poll the same database.
+        """
+        pending = self.filter(status=self.model.PENDING)
+        if pk is not None:
+            pending = pending.filter(pk=pk)
+        for job_pk in pending.order_by('pk').values_list('pk', flat=True)[:10]:
+            now = timezone.now()
+            claimed = self.filter(pk=job_pk, status=self.model.PENDING).update(
+                status=self.model.RUNNING, attempts=F('attempts') + 1,
+                started_at=now, modified_at=now)
+            if claimed:
+                return self.get(pk=job_pk)
+        return None
+
+    def run_job(self, pk=None, max_attempts=None, raise_errors=False):
+        """
+        Claims a job (see ``claim``) and runs it. A job that fails is pending
+        again, to resume from its last checkpoint, until it failed
+        ``max_attempts`` times. Returns the job or None if none was claimed.
+        """
+        job = self.claim(pk)
+        if job is None:
+            return None
+        try:
+            job.run()
+        except Exception as e:
+            job.fail(e, max_attempts)
+            if raise_errors:
+                raise
+        return job
+
+    def requeue_stale(self, max_age):
+        """
+        Makes the running jobs without a checkpoint in the last ``max_age``
+        seconds pending again, their worker most likely died.
+        """
+        return self.filter(
+            status=self.model.RUNNING,
+            modified_at__lt=timezone.now() - timedelta(seconds=max_age),
+        ).update(status=self.model.PENDING)
+
+    def delete_finished(self, max_age):
+        """
+        Deletes the jobs done or failed more than ``max_age`` seconds ago.
+        """
+        return self.filter(
+            status__in=(self.model.DONE, self.model.FAILED),
+            finished_at__lt=timezone.now() - timedelta(seconds=max_age),
+        ).delete()
+
+
+@python_2_unicode_compatible
+class FilerJob(models.Model):
+    """
+    A long running operation on many files and folders, e.g. an admin action.
+
+    The handler at the dotted path ``action`` is called as
+    ``handler(job, chunk)`` with consecutive chunks of ``FILER_JOB_CHUNK_SIZE``
+    ``items`` and returns the number of items it counts as processed. It can
+    read ``job.arguments`` and keep data in the ``job.state`` dict, which is
+    saved along with the position after every chunk: a failed job resumes
+    after the last completed chunk. Handlers changing stored files, which
+    are not rolled back with the chunk, set a ``max_chunk_size`` attribute
+    (e.g. 1 to commit every item). The jobs are run by the
+    ``FILER_JOB_EXECUTOR`` (see ``filer.utils.jobs``).
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+
+    action = models.CharField(_('action'), max_length=255)
+    description = models.CharField(_('description'), max_length=255,
+                                   blank=True, default='')
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'),
+                             related_name='filer_jobs', verbose_name=_('user'),
+                             null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(_('status'), max_length=16,
+                              choices=STATUS_CHOICES, default=PENDING,
+                              db_index=True)
+    _items = models.TextField(default='[]', editable=False)
+    _arguments = models.TextField(default='{}', editable=False)
+    _checkpoint = models.TextField(default='{}', editable=False)
+    total = models.PositiveIntegerField(_('total'), default=0)
+    position = models.PositiveIntegerField(_('position'), default=0)
+    count = models.PositiveIntegerField(_('count'), default=0)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True, default='')
+    message = models.TextField(_('message'), blank=True, default='')
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    started_at = models.DateTimeField(_('started at'), null=True, blank=True)
+    modified_at = models.DateTimeField(_('modified at'), null=True, blank=True)
+    finished_at = models.DateTimeField(_('finished at'), null=True, blank=True)
+
+    objects = FilerJobManager()
+
+    class Meta:
+        app_label = 'filer'
+        verbose_name = _('job')
+        verbose_name_plural = _('jobs')
+
+    def __str__(self):
+        return self.description or self.action
+
+    @property
+    def items(self):
+        return json.loads(self._items)
+
+    @items.setter
+    def items(self, value):
+        self._items = json.dumps(value)
+
+    @property
+    def arguments(self):
+        return json.loads(self._arguments)
+
+    @arguments.setter
+    def arguments(self, value):
+        self._arguments = json.dumps(value)
+
+    @property
+    def state(self):
+        # the handlers change the dict in place
+        if not hasattr(self, '_state_cache'):
+            self._state_cache = json.loads(self._checkpoint)
+        return self._state_cache
+
+    @state.setter
+    def state(self, value):
+        self._state_cache = value
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_message(self):
+        """
+        The ``message`` of the job, formatted with the ``message_data``
+        argument and the ``count`` of processed items.
+        """
+        data = {'count': self.count}
+        data.update(self.arguments.get('message_data', {}))
+        return self.message % data if self.message else ''
+
+    def _update(self, **fields):
+        fields['modified_at'] = timezone.now()
+        for name, value in fields.items():
+            setattr(self, name, value)
+        FilerJob.objects.filter(pk=self.pk).update(**fields)
+
+    def run(self, chunk_size=None):
+        """
+        Processes the items after the last checkpoint.
+        """
+        handler = load_object(self.action)
+        chunk_size = chunk_size or filer_settings.FILER_JOB_CHUNK_SIZE
+        chunk_size = min(chunk_size,
+                         getattr(handler, 'max_chunk_size', chunk_size))
+        items = self.items
+        while self.position < len(items):
+            chunk = items[self.position:self.position + chunk_size]
+            # the changes of a chunk are kept along with its checkpoint only
+            with atomic():
+                count = handler(self, chunk) or 0
+                self._update(position=self.position + len(chunk),
+                             count=self.count + count,
+                             _checkpoint=json.dumps(self.state))
+        self._update(status=self.DONE, finished_at=timezone.now())
+
+    def fail(self, error, max_attempts=None):
+        if max_attempts is None:
+            max_attempts = filer_settings.FILER_JOB_MAX_ATTEMPTS
+        retry = self.attempts < max_attempts
+        self._update(status=self.PENDING if retry else self.FAILED,
+                     finished_at=None if retry else timezone.now(),
+                     last_error='%s: %s' % (error.__class__.__name__, error))
+        # the state of the chunk that failed is not saved
+        self.__dict__.pop('_state_cache', None)
@@ -25,14 +25,14 @@ class ServerBase(object):
         * if save_as is False the header will not be added
         * if save_as is a filename, it will be used in the header
         * if save_as is True or None the filename will be determined from the
-          file path
+          file name
         """
         save_as = kwargs.get('save_as', None)
         if save_as is False:
             return
         file_obj = kwargs.get('file_obj', None)
         if save_as is True or save_as is None:
-            filename = os.path.basename(file_obj.path)
+            filename = os.path.basename(file_obj.name)
         else:
             filename = save_as
         response['Content-Disposition'] = smart_str(
@@ -1,35 +1,225 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import stat
-from django.http import Http404, HttpResponse, HttpResponseNotModified
-from django.utils.http import http_date
+import time
+import uuid
+
+from django.http import (Http404, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils.http import http_date, parse_http_date_safe
+try:
+    from django.http import FileResponse
+except ImportError:
+    # Django < 1.8
+    FileResponse = None
 from django.views.static import was_modified_since
 from filer.utils.compatibility import LTE_DJANGO_1_4
 from filer.server.backends.base import ServerBase
 
+RE_RANGE = re.compile(r'^(\d*)-(\d*)$')
+
+
+def parse_range_header(header, size):
+    """
+    Parses the value of a ``Range`` header into a list of ``(start, end)``
+    tuples of byte positions (both inclusive).
+
+    Returns None if the header is missing, malformed or not about bytes, in
+    which case it must be ignored. Returns an empty list if none of the ranges
+    can be satisfied.
+    """
+    if not header or '=' not in header:
+        return None
+    unit, ranges_spec = header.split('=', 1)
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in ranges_spec.split(','):
+        m = RE_RANGE.match(spec.strip())
+        if not m or m.groups() == ('', ''):
+            return None
+        first, last = m.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        else:
+            # suffix range: the last n bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+        if start < size and end >= start:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
 
 class DefaultServer(ServerBase):
     """
-    Serve static files from the local filesystem through django.
+    Serve files through django.
     This is a bad idea for most situations other than testing.
 
-    This will only work for files that can be accessed in the local filesystem.
+    Files are streamed in chunks of ``chunk_size`` bytes and single or
+    multiple byte ranges (``Range`` and ``If-Range`` headers) are supported.
+    Files in the local filesystem are read directly, other storages are read
+    through ``storage.open()``.
+
+    Whole files are returned as a ``FileResponse`` (Django >= 1.8), which WSGI
+    servers with ``wsgi.file_wrapper`` support can send with ``sendfile()``
+    instead of through the worker.
     """
+    chunk_size = 64 * 1024
+
+    def __init__(self, chunk_size=None):
+        if chunk_size:
+            self.chunk_size = int(chunk_size)
+
+    def get_file_info(self, file_obj):
+        """
+        Returns a tuple ``(opener, size, mtime)`` for ``file_obj``. ``opener``
+        is a callable returning the file opened for binary reading. ``mtime``
+        may be None if the storage does not know it.
+        """
+        try:
+            fullpath = file_obj.path
+        except NotImplementedError:
+            fullpath = None
+        if fullpath is not None:
+            # the following code is largely borrowed from
+            # `django.views.static.serve` and django-filetransfers:
+            # filetransfers.backends.default
+            if not os.path.exists(fullpath):
+                raise Http404('"%s" does not exist' % fullpath)
+            statobj = os.stat(fullpath)
+            return (lambda: open(fullpath, 'rb'),
+                    statobj[stat.ST_SIZE], statobj[stat.ST_MTIME])
+        storage = file_obj.storage
+        if not storage.exists(file_obj.name):
+            raise Http404('"%s" does not exist' % file_obj.name)
+        # Prefer the size cached on the filer file to asking the storage
+        size = getattr(getattr(file_obj, 'instance', None), '_file_size', None)
+        if size is None:
+            size = storage.size(file_obj.name)
+        try:
+            mtime = int(time.mktime(
+                storage.modified_time(file_obj.name).timetuple()))
+        except NotImplementedError:
+            mtime = None
+        return (lambda: storage.open(file_obj.name, 'rb'), size, mtime)
+
+    def get_etag(self, file_obj, size, mtime):
+        sha1 = getattr(getattr(file_obj, 'instance', None), 'sha1', None)
+        if sha1:
+            return '"%s"' % sha1
+        if mtime is not None:
+            return '"%x-%x"' % (mtime, size)
+        return None
+
     def serve(self, request, file_obj, **kwargs):
-        fullpath = file_obj.path
-        # the following code is largely borrowed from `django.views.static.serve`
-        # and django-filetransfers: filetransfers.backends.default
-        if not os.path.exists(fullpath):
-            raise Http404('"%s" does not exist' % fullpath)
-        # Respect the If-Modified-Since header.
-        statobj = os.stat(fullpath)
+        opener, size, mtime = self.get_file_info(file_obj)
+        etag = self.get_etag(file_obj, size, mtime)
 
         content_type_key = 'mimetype' if LTE_DJANGO_1_4 else 'content_type'
-        response_params = {content_type_key: self.get_mimetype(fullpath)}
-        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
-                                  statobj[stat.ST_MTIME], statobj[stat.ST_SIZE]):
+        content_type = self.get_mimetype(file_obj.name)
+        response_params = {content_type_key: content_type}
+        # Respect the If-None-Match and If-Modified-Since headers.
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if etag and if_none_match:
+            if etag in [e.strip() for e in if_none_match.split(',')]:
+                return HttpResponseNotModified(**response_params)
+        elif mtime is not None and not was_modified_since(
+                request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime, size):
             return HttpResponseNotModified(**response_params)
-        response = HttpResponse(open(fullpath, 'rb').read(), **response_params)
-        response["Last-Modified"] = http_date(statobj[stat.ST_MTIME])
+
+        ranges = None
+        if self.if_range_matches(request, etag, mtime):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        if ranges == []:
+            response = HttpResponse(status=416, **response_params)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+        if not ranges and FileResponse is not None:
+            response = FileResponse(opener(), **response_params)
+            response.block_size = self.chunk_size
+            content_length = size
+        elif not ranges:
+            response = StreamingHttpResponse(
+                self.stream(opener, [(0, size - 1)]), **response_params)
+            content_length = size
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(
+                self.stream(opener, ranges), status=206, **response_params)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            content_length = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [(start, end, self.part_header(
+                boundary, content_type, start, end, size))
+                for start, end in ranges]
+            closing = ('--%s--\r\n' % boundary).encode('ascii')
+            response = StreamingHttpResponse(
+                self.stream_multipart(opener, parts, closing), status=206,
+                **{content_type_key:
+                   'multipart/byteranges; boundary=%s' % boundary})
+            content_length = len(closing) + sum(
+                len(header) + end - start + 1 + 2
+                for start, end, header in parts)
+
+        if mtime is not None:
+            response["Last-Modified"] = http_date(mtime)
+        if etag:
+            response["ETag"] = etag
+        response["Accept-Ranges"] = 'bytes'
         self.default_headers(request=request, response=response, file_obj=file_obj, **kwargs)
+        response['Content-Length'] = content_length
         return response
+
+    def if_range_matches(self, request, etag, mtime):
+        """
+        Returns False if the ``If-Range`` precondition fails, in which case
+        the whole file must be served.
+        """
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        return mtime is not None and parse_http_date_safe(if_range) == mtime
+
+    def part_header(self, boundary, content_type, start, end, size):
+        return ('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d'
+                '\r\n\r\n' % (boundary, content_type, start, end, size)
+                ).encode('ascii')
+
+    def read_range(self, fh, start, end):
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = fh.read(min(self.chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def stream(self, opener, ranges):
+        fh = opener()
+        try:
+            for start, end in ranges:
+                for data in self.read_range(fh, start, end):
+                    yield data
+        finally:
+            fh.close()
+
+    def stream_multipart(self, opener, parts, closing):
+        fh = opener()
+        try:
+            for start, end, header in parts:
+                yield header
+                for data in self.read_range(fh, start, end):
+                    yield data
+                yield b'\r\n'
+            yield closing
+        finally:
+            fh.close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+
+from filer.server.backends.base import ServerBase
+from filer.utils.loader import load_object
+
+
+def storage_presigned_url(storage, name, expires, **params):
+    """
+    The default signer: asks the storage for the URL through its
+    ``presigned_url(name, expires, **params)`` method.
+    """
+    return storage.presigned_url(name, expires=expires, **params)
+
+
+class PresignedRedirectServer(ServerBase):
+    """
+    Redirects to a short-lived presigned URL of the storage, so that files in
+    object storages are served by the storage instead of by django.
+
+    The URL is generated by ``signer``, a callable (or its import path)
+    called as ``signer(storage, name, expires, **params)`` where ``expires``
+    is a unix timestamp. ``params`` may contain the ``content_disposition``
+    to send with the file. By default the ``presigned_url()`` method of the
+    storage is used.
+
+    The URLs are valid for ``max_age`` seconds at least: the expiry is
+    rounded up to the next but one multiple of ``max_age``. The issued URLs
+    are cached until they expire, so a file gets the same URL (which the
+    browser may cache) for a while.
+    """
+    def __init__(self, max_age=300, signer=None):
+        self.max_age = int(max_age)
+        self.signer = load_object(signer or storage_presigned_url)
+
+    def get_expires(self):
+        return (int(time.time()) // self.max_age + 2) * self.max_age
+
+    def get_cache_key(self, file_obj, expires, params):
+        # imported here, filer.settings instantiates the server backends
+        from filer.utils.cache import get_cache_key
+        storage = file_obj.storage
+        value = '%s.%s:%s:%s' % (
+            storage.__class__.__module__, storage.__class__.__name__,
+            file_obj.name, sorted(params.items()))
+        return get_cache_key('presigned', expires,
+                             hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+    def get_url(self, file_obj, expires, **params):
+        key = self.get_cache_key(file_obj, expires, params)
+        url = cache.get(key)
+        if url is None:
+            url = self.signer(file_obj.storage, file_obj.name, expires, **params)
+            cache.set(key, url, max(int(expires - time.time()), 1))
+        return url
+
+    def serve(self, request, file_obj, **kwargs):
+        params = {}
+        save_as = kwargs.get('save_as', None)
+        if save_as is not False:
+            if save_as is True or save_as is None:
+                save_as = os.path.basename(file_obj.name)
+            params['content_disposition'] = 'attachment; filename=%s' % save_as
+        expires = self.get_expires()
+        response = HttpResponseRedirect(self.get_url(file_obj, expires, **params))
+        # the redirect may be cached as long as the URL is valid
+        patch_cache_control(response, private=True,
+                            max_age=max(int(expires - time.time()), 0))
+        return response
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Signed URLs for private files and thumbnails.
+
+A signed URL carries a ``token`` query parameter with an expiry timestamp,
+an optional user id and a HMAC of those and of the path of the file in its
+storage. The protected file views accept a valid token instead of checking
+the permissions of the user, so the permissions are checked once when the
+URL is generated (by ``File.get_signed_url`` and
+``File.get_signed_thumbnail_url``) instead of on every request.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36
+
+from filer import settings as filer_settings
+
+TOKEN_PARAM = 'token'
+SALT = 'filer.server.signing'
+
+
+def get_expires(max_age=None):
+    """
+    Returns the expiry timestamp of a URL signed now, valid for at least
+    ``max_age`` seconds (``FILER_SIGNED_URLS_MAX_AGE`` by default).
+
+    The expiry is rounded up, so that the URLs of a file are the same for a
+    while and can be cached by browsers.
+    """
+    max_age = max_age or filer_settings.FILER_SIGNED_URLS_MAX_AGE
+    return (int(time.time()) // max_age + 2) * max_age
+
+
+def get_signature(path, expires, user_id):
+    value = '%s:%s:%s' % (path, expires, user_id or '')
+    return salted_hmac(SALT, value).hexdigest()
+
+
+def sign(path, user=None, max_age=None):
+    """
+    Returns the token for the file stored at ``path``. If ``user`` is given,
+    the token is only valid for requests by this user.
+    """
+    expires = get_expires(max_age)
+    user_id = user.pk if user is not None else None
+    return '%s.%s.%s' % (int_to_base36(expires), user_id or '',
+                         get_signature(path, expires, user_id))
+
+
+def sign_url(url, path, user=None, max_age=None):
+    """
+    Adds a token for the file stored at ``path`` to ``url``.
+    """
+    return '%s%s%s=%s' % (url, '&' if '?' in url else '?', TOKEN_PARAM,
+                          sign(path, user=user, max_age=max_age))
+
+
+def verify(request, path):
+    """
+    Returns True if the request carries a valid, unexpired token for the file
+    stored at ``path``. Only tokens for a user need the user of the request
+    to be looked up.
+    """
+    token = request.GET.get(TOKEN_PARAM)
+    if not token or token.count('.') != 2:
+        return False
+    expires, user_id, signature = token.split('.')
+    try:
+        expires = base36_to_int(expires)
+    except ValueError:
+        return False
+    if expires < time.time():
+        return False
+    if not constant_time_compare(signature,
+                                 get_signature(path, expires, user_id)):
+        return False
+    if user_id:
+        user = getattr(request, 'user', None)
+        return (user is not None and user.is_authenticated() and
+                '%s' % user.pk == user_id)
+    return True
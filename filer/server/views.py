@@ -6,6 +6,7 @@ from django.http import Http404
 from easy_thumbnails.files import ThumbnailFile
 from filer import settings as filer_settings
 from filer.models import File
+from filer.server import signing
 from filer.utils.filer_easy_thumbnails import thumbnail_to_original_filename
 
 server = filer_settings.FILER_PRIVATEMEDIA_SERVER
@@ -14,10 +15,14 @@ thumbnail_server = filer_settings.FILER_PRIVATEMEDIA_THUMBNAIL_SERVER
 
 def serve_protected_file(request, path):
     """
-    Serve protected files to authenticated users with read permissions.
+    Serve protected files to authenticated users with read permissions, or
+    to anyone with a valid signed URL.
     """
+    if filer_settings.FILER_SIGNED_URLS and signing.verify(request, path):
+        file_obj = File(file=path, is_public=False)
+        return server.serve(request, file_obj=file_obj.file, save_as=False)
     try:
-        file_obj = File.objects.get(file=path, is_public=False)
+        file_obj = File.objects.get_by_path(path)
     except File.DoesNotExist:
         raise Http404('File not found')
     if not file_obj.has_read_permission(request):
@@ -32,12 +37,20 @@ def serve_protected_thumbnail(request, path):
     """
     Serve protected thumbnails to authenticated users.
     If the user doesn't have read permissions, redirect to a static image.
+    Anyone with a valid signed URL gets the thumbnail.
     """
+    if filer_settings.FILER_SIGNED_URLS and signing.verify(request, path):
+        thumbnail = ThumbnailFile(name=path, storage=File._meta.get_field(
+            'file').thumbnail_storages['private'])
+        try:
+            return thumbnail_server.serve(request, thumbnail, save_as=False)
+        except Exception:
+            raise Http404('File not found')
     source_path = thumbnail_to_original_filename(path)
     if not source_path:
         raise Http404('File not found')
     try:
-        file_obj = File.objects.get(file=source_path, is_public=False)
+        file_obj = File.objects.get_by_path(source_path)
     except File.DoesNotExist:
         raise Http404('File not found')
     if not file_obj.has_read_permission(request):
@@ -242,3 +242,61 @@ FILER_UPLOADER_CONNECTIONS = getattr(
 FILER_DUMP_PAYLOAD = getattr(settings, 'FILER_DUMP_PAYLOAD', False)  # Whether the filer shall dump the files payload
 
 FILER_CANONICAL_URL = getattr(settings, 'FILER_CANONICAL_URL', 'canonical/')
+
+# How long (in seconds) the current URLs of canonical URLs are cached
+FILER_CANONICAL_CACHE_TIMEOUT = getattr(settings, 'FILER_CANONICAL_CACHE_TIMEOUT', 60 * 60)
+
+# Redirect from canonical URLs with "301 Moved Permanently" instead of "302 Found"
+FILER_CANONICAL_REDIRECT_PERMANENT = getattr(settings, 'FILER_CANONICAL_REDIRECT_PERMANENT', False)
+
+# Let clients cache the redirects from canonical URLs for this many seconds
+FILER_CANONICAL_REDIRECT_MAX_AGE = getattr(settings, 'FILER_CANONICAL_REDIRECT_MAX_AGE', 0)
+
+# Prefix for all the keys filer stores in the django cache
+FILER_CACHE_PREFIX = getattr(settings, 'FILER_CACHE_PREFIX', 'filer')
+
+# How long (in seconds) the per-user folder permission index is cached
+FILER_PERMISSION_CACHE_TIMEOUT = getattr(settings, 'FILER_PERMISSION_CACHE_TIMEOUT', 60 * 60)
+
+# Accept the tokens of File.get_signed_url, which grant a user access to
+# private files and thumbnails without checking the permissions (see
+# filer.server.signing)
+FILER_SIGNED_URLS = getattr(settings, 'FILER_SIGNED_URLS', False)
+
+# Minimal time (in seconds) a signed URL is valid
+FILER_SIGNED_URLS_MAX_AGE = getattr(settings, 'FILER_SIGNED_URLS_MAX_AGE', 60 * 60)
+
+# How long (in seconds) the lookups of private files by their storage path are
+# cached
+FILER_FILE_PATH_CACHE_TIMEOUT = getattr(settings, 'FILER_FILE_PATH_CACHE_TIMEOUT', 60 * 60)
+
+# How long (in seconds) the directory listing caches the permissions of a
+# user on a folder
+FILER_DIRECTORY_LISTING_CACHE_TIMEOUT = getattr(settings, 'FILER_DIRECTORY_LISTING_CACHE_TIMEOUT', 60)
+
+# Generate the thumbnails used by filer when an image is saved, instead of
+# when it is displayed for the first time
+FILER_PREGENERATE_THUMBNAILS = getattr(settings, 'FILER_PREGENERATE_THUMBNAILS', False)
+
+# Store the content of public files once, under a name derived from its
+# checksum, and let the files with the same content share it
+FILER_CONTENT_ADDRESSABLE_STORAGE = getattr(settings, 'FILER_CONTENT_ADDRESSABLE_STORAGE', False)
+
+# Queue the stored files of deleted files for deletion by the
+# reap_deleted_files management command, instead of deleting them right away
+FILER_DEFERRED_DELETION = getattr(settings, 'FILER_DEFERRED_DELETION', False)
+
+# Runs the jobs of the long running admin actions (see filer.utils.jobs):
+# ImmediateExecutor runs them in the request, ThreadPoolExecutor and
+# ProcessPoolExecutor in the background, WorkerExecutor leaves them to the
+# run_filer_jobs management command
+FILER_JOB_EXECUTOR = getattr(settings, 'FILER_JOB_EXECUTOR', 'filer.utils.jobs.ImmediateExecutor')
+
+# Number of threads or processes of the background job executors
+FILER_JOB_WORKERS = getattr(settings, 'FILER_JOB_WORKERS', 2)
+
+# Number of items a job processes between two checkpoints
+FILER_JOB_CHUNK_SIZE = getattr(settings, 'FILER_JOB_CHUNK_SIZE', 50)
+
+# How many times a failing job is run before it is given up
+FILER_JOB_MAX_ATTEMPTS = getattr(settings, 'FILER_JOB_MAX_ATTEMPTS', 3)
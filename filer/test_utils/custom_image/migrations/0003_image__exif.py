@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_image', '0002_image__thumbnail_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='_exif',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,8 +1,11 @@
 #-*- coding: utf-8 -*-
 from filer.tests.admin import *
+from filer.tests.commands import *
 from filer.tests.dump import *
 from filer.tests.models import *
 from filer.tests.permissions import *
 from filer.tests.server_backends import *
+from filer.tests.thumbnail_processors import *
 from filer.tests.tools import *
+from filer.tests.transfer import *
 from filer.tests.utils import *
@@ -1,5 +1,8 @@
 #-*- coding: utf-8 -*-
+import hashlib
+import json
 import os
+from datetime import timedelta
 
 try:
     from unittest import skipIf
@@ -7,18 +10,25 @@ except ImportError: # for python 2.6
     from unittest2 import skipIf
 
 import django
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.urlresolvers import reverse
 import django.core.files
 from django.contrib.admin import helpers
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.utils.six import StringIO
 
+from filer.models.deletionmodels import PendingDeletion
 from filer.models.filemodels import File
 from filer.models.foldermodels import Folder, FolderPermission
 from filer.models.imagemodels import Image
+from filer.models.jobmodels import FilerJob
 from filer.models.virtualitems import FolderRoot
+from filer.admin import folderadmin
 from filer.admin.folderadmin import FolderAdmin
 from filer.tests.helpers import (create_superuser, create_folder_structure,
                                  create_image, SettingsOverride)
@@ -230,6 +240,28 @@ class FilerClipboardAdminUrlsTests(TestCase):
         self.assertEqual(Image.objects.all()[0].original_filename,
                          self.image_name)
 
+    def test_filer_ajax_upload_file_computes_sha1_while_receiving(self):
+        folder = Folder.objects.create(name='foo')
+        with open(self.filename, 'rb') as fh:
+            data = fh.read()
+        url = reverse(
+            'admin:filer-ajax_upload',
+            kwargs={'folder_id': folder.pk})+'?filename=%s' % self.image_name
+        generate_sha1 = File.generate_sha1
+        calls = []
+        File.generate_sha1 = lambda self: calls.append(self)
+        try:
+            self.client.post(
+                url,
+                data=data,
+                content_type='application/octet-stream',
+                **{'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+            )
+        finally:
+            File.generate_sha1 = generate_sha1
+        self.assertEqual(calls, [])
+        self.assertEqual(Image.objects.get().sha1, hashlib.sha1(data).hexdigest())
+
     def test_filer_upload_file_error(self, extra_headers={}):
         self.assertEqual(Image.objects.count(), 0)
         folder = Folder.objects.create(name='foo')
@@ -505,6 +537,8 @@ class FilerBulkOperationsTests(BulkOperationsMixin, TestCase):
         self.assertEqual(self.src_folder.files.count(), 1)
         self.assertEqual(self.dst_folder.files.count(), 0)
         self.assertEqual(self.image_obj.original_filename, 'test_file.jpg')
+        # the copy carries the data over instead of computing it again
+        File.objects.filter(pk=self.image_obj.pk).update(sha1='0' * 40)
         url = reverse('admin:filer-directory_listing', kwargs={
             'folder_id': self.src_folder.id,
         })
@@ -520,8 +554,13 @@ class FilerBulkOperationsTests(BulkOperationsMixin, TestCase):
         self.assertEqual(self.src_folder.files[0].id, self.image_obj.id)
         dst_image_obj = self.dst_folder.files[0]
         self.assertEqual(dst_image_obj.original_filename, 'test_filetest.jpg')
+        self.assertEqual(dst_image_obj.sha1, '0' * 40)
+        self.assertEqual(dst_image_obj.size, self.image_obj.size)
+        self.assertEqual(dst_image_obj.width, self.image_obj.width)
+        self.assertNotEqual(dst_image_obj.file.name, self.image_obj.file.name)
+        self.assertEqual(dst_image_obj.file.read(), self.image_obj.file.read())
 
-class FilerDeleteOperationTests(BulkOperationsMixin, TestCase):
+class FilerDeleteOperationTests(BulkOperationsMixin, TransactionTestCase):
     def test_delete_files_or_folders_action(self):
         self.assertNotEqual(File.objects.count(), 0)
         self.assertNotEqual(Image.objects.count(), 0)
@@ -530,6 +569,7 @@ class FilerDeleteOperationTests(BulkOperationsMixin, TestCase):
         folders = []
         for folder in FolderRoot().children.all():
             folders.append('folder-%d' % (folder.id,))
+        paths = [f.file.path for f in File.objects.all()]
         response = self.client.post(url, {
             'action': 'delete_files_or_folders',
             'post': 'yes',
@@ -537,6 +577,9 @@ class FilerDeleteOperationTests(BulkOperationsMixin, TestCase):
         })
         self.assertEqual(File.objects.count(), 0)
         self.assertEqual(Folder.objects.count(), 0)
+        # the stored files are deleted too
+        self.assertFalse([path for path in paths if os.path.exists(path)])
+        self.assertFalse(PendingDeletion.objects.exists())
 
     def test_delete_files_or_folders_action_with_mixed_types(self):
         # add more files/images so we can test the polymorphic queryset with multiple types
@@ -558,6 +601,32 @@ class FilerDeleteOperationTests(BulkOperationsMixin, TestCase):
             })
         self.assertEqual(File.objects.filter(folder__in=[self.folder.id, self.sub_folder1.id]).count(), 0)
 
+    def test_delete_files_reaps_only_its_entries(self):
+        PendingDeletion.objects.enqueue([('unrelated/missing.jpg', True)])
+        path = self.image_obj.file.path
+        File.objects.delete_files(File.objects.filter(pk=self.image_obj.pk))
+        self.assertFalse(os.path.exists(path))
+        entry = PendingDeletion.objects.get()
+        self.assertEqual(entry.name, 'unrelated/missing.jpg')
+        self.assertEqual(entry.attempts, 0)
+
+    def test_delete_files_calls_overridden_delete(self):
+        deleted = []
+
+        def delete(image, *args, **kwargs):
+            deleted.append(image.pk)
+            super(Image, image).delete(*args, **kwargs)
+        Image.delete = delete
+        try:
+            n = File.objects.delete_files(File.objects.filter(
+                folder__in=[self.folder, self.sub_folder1]))
+        finally:
+            del Image.delete
+        self.assertEqual(n, 6)
+        self.assertEqual(len(deleted), 2)
+        self.assertFalse(File.objects.filter(
+            folder__in=[self.folder, self.sub_folder1]).exists())
+
 
 class FilerResizeOperationTests(BulkOperationsMixin, TestCase):
     def test_resize_images_action(self):
@@ -580,6 +649,123 @@ class FilerResizeOperationTests(BulkOperationsMixin, TestCase):
         self.image_obj = Image.objects.get(id=self.image_obj.id)
         self.assertEqual(self.image_obj.width, 42)
         self.assertEqual(self.image_obj.height, 42)
+        # the job was done in the request
+        self.assertFalse(FilerJob.objects.exists())
+
+
+class FilerJobTests(BulkOperationsMixin, TestCase):
+    def test_actions_are_run_by_the_worker_command(self):
+        url = reverse('admin:filer-directory_listing-root')
+        with SettingsOverride(filer_settings,
+                              FILER_JOB_EXECUTOR='filer.utils.jobs.WorkerExecutor'):
+            response = self.client.post(url, {
+                'action': 'copy_files_and_folders',
+                'post': 'yes',
+                'suffix': '',
+                'destination': self.dst_folder.id,
+                helpers.ACTION_CHECKBOX_NAME: 'folder-%d' % (self.folder.id,),
+            })
+        job = FilerJob.objects.get()
+        self.assertRedirects(
+            response, reverse('admin:filer-job_progress', args=(job.pk,)))
+        self.assertEqual(self.dst_folder.children.count(), 0)
+        response = self.client.get(response['Location'])
+        self.assertContains(response, reverse('admin:filer-job_status', args=(job.pk,)))
+
+        call_command('run_filer_jobs', once=True, stdout=StringIO())
+        # the folders and the files in them (recursively)
+        status = json.loads(self.client.get(reverse(
+            'admin:filer-job_status', args=(job.pk,))).content.decode('utf-8'))
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual((status['position'], status['total']), (11, 11))
+        self.assertEqual(status['message'], "Successfully copied 11 files and/or "
+                                            "folders to folder 'Dst'.")
+        copy = self.dst_folder.children.get()
+        self.assertEqual(copy.files.count(), 3)
+        self.assertEqual(
+            sorted((f.name, f.files.count()) for f in copy.children.all()),
+            [('sub folder 1', 3), ('sub folder 2', 2)])
+
+    def test_failed_jobs_resume_from_their_last_checkpoint(self):
+        url = reverse('admin:filer-directory_listing-root')
+        with SettingsOverride(filer_settings,
+                              FILER_JOB_EXECUTOR='filer.utils.jobs.WorkerExecutor',
+                              FILER_JOB_CHUNK_SIZE=3):
+            self.client.post(url, {
+                'action': 'rename_files',
+                'post': 'yes',
+                'rename_format': 'renamed %(global_counter)d',
+                helpers.ACTION_CHECKBOX_NAME: 'folder-%d' % (self.folder.id,),
+            })
+            rename_file = FolderAdmin._rename_file
+            renamed = []
+
+            def failing_rename_file(self, file_obj, *args):
+                if len(renamed) == 4:
+                    raise IOError('storage unavailable')
+                renamed.append(file_obj.pk)
+                rename_file(self, file_obj, *args)
+
+            FolderAdmin._rename_file = failing_rename_file
+            try:
+                job = FilerJob.objects.run_job()
+            finally:
+                FolderAdmin._rename_file = rename_file
+            self.assertEqual(job.status, FilerJob.PENDING)
+            self.assertEqual(job.last_error, 'IOError: storage unavailable'
+                             if str is bytes else 'OSError: storage unavailable')
+            # the renames of the chunk that failed are rolled back
+            self.assertEqual(job.position, 3)
+            self.assertEqual(File.objects.filter(name__startswith='renamed').count(), 3)
+            job = FilerJob.objects.run_job()
+        self.assertEqual((job.status, job.attempts, job.count), (FilerJob.DONE, 2, 8))
+        self.assertEqual(
+            sorted(File.objects.filter(folder__tree_id=self.folder.tree_id)
+                   .values_list('name', flat=True)),
+            ['renamed %d' % i for i in range(1, 9)])
+
+    def test_moved_stored_files_are_committed_one_by_one(self):
+        files = list(File.objects.filter(folder=self.folder).order_by('pk'))
+        job = FilerJob.objects.enqueue(
+            'filer.admin.jobs.set_files_public_or_private',
+            [f.pk for f in files], arguments={'is_public': False})
+        copy_stored_file = File._copy_stored_file
+
+        def failing_copy_stored_file(file_obj, transfer):
+            if file_obj.pk == files[1].pk:
+                raise IOError('storage unavailable')
+            return copy_stored_file(file_obj, transfer)
+
+        File._copy_stored_file = failing_copy_stored_file
+        try:
+            job = FilerJob.objects.run_job()
+        finally:
+            File._copy_stored_file = copy_stored_file
+        self.assertEqual((job.status, job.position), (FilerJob.PENDING, 1))
+        # the move of the first file is kept along with its stored file
+        moved = File.objects.get(pk=files[0].pk)
+        self.assertFalse(moved.is_public)
+        self.assertTrue(moved.file.storage.exists(moved.file.name))
+        self.assertTrue(File.objects.get(pk=files[1].pk).is_public)
+        job = FilerJob.objects.run_job()
+        self.assertEqual((job.status, job.count), (FilerJob.DONE, len(files)))
+        self.assertFalse(File.objects.filter(folder=self.folder,
+                                             is_public=True).exists())
+
+    def test_finished_jobs_are_deleted_by_the_worker_command(self):
+        old = FilerJob.objects.enqueue('filer.admin.jobs.rename_files', [])
+        old = FilerJob.objects.run_job(old.pk)
+        FilerJob.objects.filter(pk=old.pk).update(
+            finished_at=old.finished_at - timedelta(days=8))
+        recent = FilerJob.objects.enqueue('filer.admin.jobs.rename_files', [])
+        FilerJob.objects.run_job(recent.pk)
+        pending = FilerJob.objects.enqueue(
+            'filer.admin.jobs.rename_files', [], user=self.superuser)
+        FilerJob.objects.filter(pk=pending.pk).update(status=FilerJob.RUNNING)
+        call_command('run_filer_jobs', once=True, stdout=StringIO())
+        self.assertEqual(
+            sorted(FilerJob.objects.values_list('pk', flat=True)),
+            [recent.pk, pending.pk])
 
 
 class PermissionAdminTest(TestCase):
@@ -682,6 +868,130 @@ class FolderListingTest(TestCase):
                 set([self.foo_folder.pk, self.bar_folder.pk, self.baz_folder.pk,
                      self.spam_file.pk]))
 
+    def test_listing_filters_with_the_permission_index(self):
+        with SettingsOverride(filer_settings, FILER_ENABLE_PERMISSIONS=True):
+            FolderPermission.objects.create(
+                folder=self.parent,
+                user=self.staff_user,
+                type=FolderPermission.CHILDREN,
+                can_read=FolderPermission.ALLOW)
+            manager = FolderPermission.objects.__class__
+            get_read_id_list = manager.get_read_id_list
+
+            def fail(self, user):
+                raise AssertionError('the readable folder ids are expanded')
+
+            manager.get_read_id_list = fail
+            try:
+                response = self.client.get(
+                    reverse('admin:filer-directory_listing-root'))
+            finally:
+                manager.get_read_id_list = get_read_id_list
+            item_list = response.context['paginated_items'].object_list
+            # the children of BAR are listed in BAR, not in the root
+            self.assertEquals(
+                [folder.pk for folder, folder_perms in item_list
+                 if isinstance(folder, Folder)],
+                [self.parent.pk])
+
+    def test_files_are_sorted_by_label_and_paginated(self):
+        for name, original_filename in [('Zeta', 'z.txt'), ('', 'alpha.txt'),
+                                        ('', 'Beta.txt')]:
+            file_data = django.core.files.base.ContentFile('some data')
+            file_data.name = original_filename
+            File.objects.create(name=name, original_filename=original_filename,
+                                file=file_data, folder=self.parent)
+        url = reverse('admin:filer-directory_listing',
+                      kwargs={'folder_id': self.parent.id})
+        with SettingsOverride(filer_settings, FILER_ENABLE_PERMISSIONS=False):
+            with SettingsOverride(folderadmin, FILER_PAGINATE_BY=3):
+                pages = [
+                    [item.label if isinstance(item, File) else item.name
+                     for item, item_perms in
+                     self.client.get(url, {'page': page}).context[
+                         'paginated_items'].object_list]
+                    for page in (1, 2, 3)]
+        self.assertEqual(pages, [['bar', 'baz', 'foo'],
+                                 ['alpha.txt', 'Beta.txt', 'spam'],
+                                 ['Zeta']])
+
+    def test_listing_query_count_does_not_depend_on_page_size(self):
+        superuser = self.parent.owner
+        image_data = django.core.files.base.ContentFile(b'')
+        create_image().save(image_data, 'JPEG')
+        for i in range(6):
+            subfolder = Folder.objects.create(
+                name='sub%d' % i, parent=self.parent, owner=superuser)
+            Folder.objects.create(name='child', parent=subfolder)
+            for folder in (self.parent, subfolder):
+                file_data = django.core.files.base.ContentFile('some data')
+                file_data.name = 'a%d.txt' % i
+                File.objects.create(owner=superuser, original_filename=file_data.name,
+                                    file=file_data, folder=folder)
+            image_data.name = 'a%d.jpg' % i
+            Image.objects.create(owner=superuser, original_filename=image_data.name,
+                                 file=image_data, folder=self.parent)
+        FolderPermission.objects.create(
+            folder=self.parent, user=self.staff_user,
+            type=FolderPermission.CHILDREN, can_edit=FolderPermission.ALLOW,
+            can_read=FolderPermission.ALLOW)
+        url = reverse('admin:filer-directory_listing',
+                      kwargs={'folder_id': self.parent.id})
+
+        def count_queries(paginate_by):
+            with SettingsOverride(folderadmin, FILER_PAGINATE_BY=paginate_by):
+                # the first request generates the thumbnails
+                self.client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+            item_list = response.context['paginated_items'].object_list
+            self.assertEqual(len(item_list), paginate_by)
+            return len(queries)
+
+        with SettingsOverride(filer_settings, FILER_ENABLE_PERMISSIONS=True):
+            # 9 folders and 3 files (images included) or all the 22 items
+            self.assertEqual(count_queries(12), count_queries(22))
+
+    def test_last_folder_lookup_is_cached(self):
+        folder_url = reverse('admin:filer-directory_listing',
+                             kwargs={'folder_id': self.foo_folder.id})
+        last_url = reverse('admin:filer-directory_listing-last')
+        self.client.get(folder_url)
+        self.assertTrue(self.client.get(last_url)['Location'].endswith(folder_url))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(last_url)
+        self.assertTrue(response['Location'].endswith(folder_url))
+        folder_table = connection.ops.quote_name(Folder._meta.db_table)
+        self.assertFalse([q for q in queries if folder_table in q['sql']])
+        # deleting the folder invalidates the cache
+        self.foo_folder.delete()
+        self.assertTrue(self.client.get(last_url)['Location'].endswith(
+            reverse('admin:filer-directory_listing-root')))
+
+    def test_listing_permissions_are_cached_until_permissions_change(self):
+        url = reverse('admin:filer-directory_listing',
+                      kwargs={'folder_id': self.bar_folder.id})
+        with SettingsOverride(filer_settings, FILER_ENABLE_PERMISSIONS=True):
+            permission = FolderPermission.objects.create(
+                folder=self.bar_folder, user=self.staff_user,
+                type=FolderPermission.THIS, can_edit=FolderPermission.ALLOW,
+                can_read=FolderPermission.ALLOW)
+            response = self.client.get(url)
+            self.assertTrue(response.context['permissions']['has_edit_permission'])
+            self.assertEqual(response.context['permstest'], ['read', 'edit'])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertTrue(response.context['permissions']['has_edit_permission'])
+            permission_table = connection.ops.quote_name(
+                FolderPermission._meta.db_table)
+            self.assertFalse([q for q in queries if permission_table in q['sql']])
+
+            permission.can_edit = FolderPermission.DENY
+            permission.save()
+            response = self.client.get(url)
+            self.assertFalse(response.context['permissions']['has_edit_permission'])
+            self.assertEqual(response.context['permstest'], ['read'])
+
     def test_search_against_owner(self):
         url = reverse('admin:filer-directory_listing',
                       kwargs={'folder_id': self.parent.id})
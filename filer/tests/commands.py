@@ -0,0 +1,337 @@
+#-*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import threading
+from tempfile import mkdtemp
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File as DjangoFile
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db.models import signals
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from filer import settings as filer_settings
+from filer.models.deletionmodels import PendingDeletion
+from filer.models.filemodels import File
+from filer.models.foldermodels import Folder
+from filer.models.imagemodels import Image, pregenerate_thumbnails_on_save
+from filer.models.thumbnailoptionmodels import ThumbnailOption
+from filer.tests.helpers import SettingsOverride, create_image
+from filer.utils.thumbnails import get_required_thumbnail_options
+from filer.utils.transfer import set_files_public
+
+
+class ImportFilesTestCase(TestCase):
+    def setUp(self):
+        self.path = os.path.join(mkdtemp(dir=settings.FILE_UPLOAD_TEMP_DIR), 'assets')
+        os.makedirs(os.path.join(self.path, 'photos', '2015'))
+        os.makedirs(os.path.join(self.path, 'documents'))
+        create_image().save(os.path.join(self.path, 'photos', 'a.jpg'), 'JPEG')
+        create_image().save(os.path.join(self.path, 'photos', '2015', 'b.png'), 'PNG')
+        with open(os.path.join(self.path, 'documents', 'c.txt'), 'wb') as fh:
+            fh.write(b'some text')
+        with open(os.path.join(self.path, 'readme.txt'), 'wb') as fh:
+            fh.write(b'readme')
+        self.checkpoint = os.path.join(os.path.dirname(self.path), 'checkpoint')
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def import_files(self, **kwargs):
+        call_command('import_files', path=self.path, bulk=True,
+                     checkpoint=self.checkpoint, verbosity=0, **kwargs)
+
+    def assertImported(self):
+        self.assertEqual(Folder.objects.count(), 4)
+        assets = Folder.objects.get(name='assets', parent=None)
+        self.assertEqual(
+            sorted(f.name for f in assets.get_descendants()),
+            ['2015', 'documents', 'photos'])
+        year = Folder.objects.get(name='2015')
+        self.assertEqual([f.name for f in year.get_ancestors()],
+                         ['assets', 'photos'])
+
+        self.assertEqual(File.objects.count(), 4)
+        self.assertEqual(Image.objects.count(), 2)
+        image = Image.objects.get(original_filename='b.png')
+        self.assertEqual(image.folder, year)
+        self.assertEqual((image.width, image.height), (800, 600))
+        text_file = File.objects.get(original_filename='c.txt')
+        self.assertFalse(isinstance(text_file, Image))
+        self.assertEqual(text_file.size, 9)
+        self.assertEqual(text_file.sha1,
+                         '37aa63c77398d954473262e1a0057c1e632eda77')
+        self.assertEqual(text_file.file.read(), b'some text')
+
+    def test_bulk_import(self):
+        self.import_files(batch_size=3)
+        self.assertImported()
+
+    def test_bulk_import_with_workers(self):
+        self.import_files(workers=2)
+        self.assertImported()
+
+    def test_bulk_import_resumes_from_checkpoint(self):
+        self.import_files(batch_size=3)
+        with open(self.checkpoint) as fh:
+            self.assertEqual(len(fh.readlines()), 4)
+        # nothing is imported twice
+        self.import_files(batch_size=3)
+        self.assertImported()
+
+    def test_bulk_import_skips_the_imported_files(self):
+        self.import_files(batch_size=3)
+        # stopped after a batch was committed, before the checkpoint
+        os.remove(self.checkpoint)
+        self.import_files(batch_size=3)
+        self.assertImported()
+
+    def test_bulk_import_creates_the_images_of_the_inserted_files(self):
+        self.import_files(batch_size=3)
+        # every file with the image content type has its image row
+        image_ctype = ContentType.objects.get_for_model(Image)
+        self.assertEqual(
+            set(File.objects.non_polymorphic().filter(
+                polymorphic_ctype=image_ctype).values_list('pk', flat=True)),
+            set(Image.objects.values_list('pk', flat=True)))
+        self.assertEqual(
+            sorted(Image.objects.values_list('original_filename', flat=True)),
+            ['a.jpg', 'b.png'])
+
+
+class PregenerateThumbnailsTestCase(TestCase):
+    def setUp(self):
+        self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, 'pregenerate.jpg')
+        create_image().save(self.filename, 'JPEG')
+        ThumbnailOption.objects.create(name='teaser', width=300, height=200)
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+        os.remove(self.filename)
+
+    def create_image(self):
+        with open(self.filename, 'rb') as fh:
+            return Image.objects.create(
+                original_filename='pregenerate.jpg',
+                file=DjangoFile(fh, name='pregenerate.jpg'))
+
+    def assertThumbnailsExist(self, image):
+        for options in get_required_thumbnail_options(image):
+            self.assertTrue(image.file.get_existing_thumbnail(options))
+
+    def test_command(self):
+        image = self.create_image()
+        self.assertEqual(len(get_required_thumbnail_options(image)),
+                         len(Image.DEFAULT_THUMBNAILS) + len(filer_settings.FILER_ADMIN_ICON_SIZES) + 2)
+        self.assertFalse(image.file.get_existing_thumbnail(
+            ThumbnailOption.objects.get().as_dict))
+        out = StringIO()
+        call_command('pregenerate_thumbnails', stdout=out)
+        self.assertTrue('1/1 images, ' in out.getvalue())
+        self.assertTrue(' 0 existing, 0 errors' in out.getvalue())
+        self.assertThumbnailsExist(image)
+
+        out = StringIO()
+        call_command('pregenerate_thumbnails', stdout=out)
+        self.assertTrue('1/1 images, 0 thumbnails generated' in out.getvalue())
+
+    def test_post_save_hook(self):
+        signals.post_save.connect(pregenerate_thumbnails_on_save, sender=Image,
+                                  dispatch_uid='test_pregenerate_thumbnails')
+        try:
+            image = self.create_image()
+        finally:
+            signals.post_save.disconnect(sender=Image,
+                                         dispatch_uid='test_pregenerate_thumbnails')
+        self.assertThumbnailsExist(image)
+
+
+class SetFilesPublicTestCase(TestCase):
+    def setUp(self):
+        self.folder = Folder.objects.create(name='private')
+        self.files = [
+            File.objects.create(original_filename='file%d.txt' % i,
+                                folder=self.folder if i else None,
+                                is_public=False,
+                                file=ContentFile(('content %d' % i).encode('utf-8'),
+                                                 name='file%d.txt' % i))
+            for i in range(3)]
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+
+    def test_command(self):
+        out = StringIO()
+        call_command('set_files_public', folder=self.folder.pk, workers=2,
+                     stdout=out)
+        self.assertTrue('2/2 files moved' in out.getvalue())
+        public_storage = filer_settings.FILER_PUBLICMEDIA_STORAGE
+        for i, f in enumerate(File.objects.order_by('pk')):
+            self.assertEqual(f.is_public, bool(i))
+            if f.is_public:
+                self.assertTrue(f.file.path.startswith(public_storage.location))
+            self.assertEqual(f.file.read(), ('content %d' % i).encode('utf-8'))
+
+        out = StringIO()
+        call_command('set_files_public', folder=self.folder.pk, stdout=out)
+        self.assertTrue('No files to move' in out.getvalue())
+
+        call_command('set_files_public', private=True, stdout=StringIO())
+        self.assertFalse(File.objects.filter(is_public=True).exists())
+
+    def test_failed_copies_keep_the_other_files(self):
+        files = list(File.objects.filter(folder=self.folder).order_by('pk'))
+        private_names = [f.file.name for f in files]
+        copy_stored_file = File._copy_stored_file
+        finish_transfer = File._finish_transfer
+        threads = set()
+
+        def failing_copy_stored_file(file_obj, transfer):
+            if file_obj.pk == files[0].pk:
+                raise IOError('storage unavailable')
+            return copy_stored_file(file_obj, transfer)
+
+        def recording_finish_transfer(file_obj, *args):
+            threads.add(threading.current_thread())
+            finish_transfer(file_obj, *args)
+
+        File._copy_stored_file = failing_copy_stored_file
+        File._finish_transfer = recording_finish_transfer
+        try:
+            self.assertRaises(IOError, set_files_public, files, True,
+                              workers=2)
+        finally:
+            File._copy_stored_file = copy_stored_file
+            File._finish_transfer = finish_transfer
+        # the blobs and the rows are only touched in the calling thread
+        self.assertEqual(threads, set([threading.current_thread()]))
+        failed, moved = [File.objects.get(pk=f.pk) for f in files]
+        self.assertFalse(failed.is_public)
+        self.assertEqual(failed.file.name, private_names[0])
+        self.assertEqual(failed.file.read(), b'content 1')
+        self.assertTrue(moved.is_public)
+        self.assertTrue(moved.file.path.startswith(
+            filer_settings.FILER_PUBLICMEDIA_STORAGE.location))
+        self.assertEqual(moved.file.read(), b'content 2')
+
+
+class ReapDeletedFilesTestCase(TestCase):
+    def setUp(self):
+        self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, 'reap.jpg')
+        create_image().save(self.filename, 'JPEG')
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+        os.remove(self.filename)
+
+    def create_image(self):
+        with open(self.filename, 'rb') as fh:
+            return Image.objects.create(
+                original_filename='reap.jpg',
+                file=DjangoFile(fh, name='reap.jpg'))
+
+    def test_command(self):
+        image = self.create_image()
+        path = image.file.path
+        thumbnail_path = image.file.get_thumbnail({'size': (32, 32)}).path
+        with SettingsOverride(filer_settings, FILER_DEFERRED_DELETION=True):
+            image.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(thumbnail_path))
+        self.assertEqual(PendingDeletion.objects.count(), 1)
+
+        out = StringIO()
+        call_command('reap_deleted_files', workers=2, stdout=out)
+        self.assertTrue('1 files deleted, 0 skipped' in out.getvalue())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(thumbnail_path))
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_files_in_use_are_kept(self):
+        image = self.create_image()
+        PendingDeletion.objects.enqueue([(image.file.name, True)])
+        out = StringIO()
+        call_command('reap_deleted_files', stdout=out)
+        self.assertTrue('0 files deleted, 1 skipped' in out.getvalue())
+        self.assertTrue(os.path.exists(image.file.path))
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_enqueue_returns_only_its_entries(self):
+        first = PendingDeletion.objects.enqueue([('reap/a.jpg', True),
+                                                 ('reap/b.jpg', False)])
+        second = PendingDeletion.objects.enqueue([('reap/c.jpg', True)])
+        self.assertEqual(sorted(first.values_list('name', flat=True)),
+                         ['reap/a.jpg', 'reap/b.jpg'])
+        self.assertEqual(list(second.values_list('name', flat=True)),
+                         ['reap/c.jpg'])
+        self.assertFalse(PendingDeletion.objects.enqueue([]).exists())
+
+    def test_failed_deletions_are_retried(self):
+        PendingDeletion.objects.enqueue([('reap/missing.jpg', True)])
+        storage = filer_settings.FILER_PUBLICMEDIA_STORAGE
+
+        def delete(name):
+            raise IOError('storage unavailable')
+        storage.delete = delete
+        try:
+            deleted, skipped, failed = PendingDeletion.objects.reap(max_attempts=2)
+        finally:
+            del storage.delete
+        self.assertEqual((deleted, skipped, failed), (0, 0, 1))
+        entry = PendingDeletion.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertTrue('storage unavailable' in entry.last_error)
+        self.assertEqual(PendingDeletion.objects.reap(max_attempts=2), (1, 0, 0))
+
+
+class FindOrphansTestCase(TestCase):
+    def setUp(self):
+        self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, 'orphans.jpg')
+        create_image().save(self.filename, 'JPEG')
+        with open(self.filename, 'rb') as fh:
+            self.image = Image.objects.create(
+                original_filename='orphans.jpg',
+                file=DjangoFile(fh, name='orphans.jpg'))
+        self.thumbnail = self.image.file.get_thumbnail({'size': (32, 32)})
+        self.storage = filer_settings.FILER_PUBLICMEDIA_STORAGE
+        self.thumbnail_storage = filer_settings.FILER_PUBLICMEDIA_THUMBNAIL_STORAGE
+        self.orphan = self.storage.save('filer_public/orphans/file.txt',
+                                        ContentFile(b'orphan'))
+        self.orphaned_thumbnail = self.thumbnail_storage.save(
+            'filer_public_thumbnails/filer_public/orphans/image.jpg__32x32_q85.jpg',
+            ContentFile(b'orphan'))
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+        os.remove(self.filename)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('find_orphans', min_age=0, verbosity=2, stdout=out)
+        self.assertTrue('public files: %s' % self.orphan in out.getvalue())
+        self.assertTrue('public thumbnails: %s' % self.orphaned_thumbnail
+                        in out.getvalue())
+        self.assertFalse(self.image.file.name in out.getvalue())
+        self.assertFalse(self.thumbnail.name in out.getvalue())
+        self.assertTrue(self.storage.exists(self.orphan))
+
+        call_command('find_orphans', min_age=3600, delete=True, stdout=StringIO())
+        self.assertTrue(self.storage.exists(self.orphan))
+
+        call_command('find_orphans', min_age=0, delete=True, workers=2,
+                     stdout=StringIO())
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertFalse(self.thumbnail_storage.exists(self.orphaned_thumbnail))
+        self.assertTrue(self.storage.exists(self.image.file.name))
+        self.assertTrue(self.thumbnail_storage.exists(self.thumbnail.name))
@@ -2,10 +2,20 @@
 from __future__ import unicode_literals
 
 import os
+import struct
+from datetime import datetime
+
 from django.conf import settings
 from django.core.files import File as DjangoFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_delete
 from django.forms.models import modelform_factory
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from PIL import Image as PILImage
 
 try:
     from unittest import skipIf, skipUnless
@@ -13,13 +23,16 @@ except ImportError:
     # Django<1.9
     from django.utils.unittest import skipIf, skipUnless
 
+from filer.models.blobmodels import Blob
 from filer.models.foldermodels import Folder
 from filer.models.imagemodels import Image
 from filer.models.filemodels import File
 from filer.models.clipboardmodels import Clipboard
+from filer.models.thumbnailoptionmodels import ThumbnailOption
 from filer.test_utils import ET_2
 from filer.tests.helpers import (create_superuser, create_folder_structure,
-                                 create_image, create_clipboard_item)
+                                 create_image, create_clipboard_item,
+                                 SettingsOverride)
 from filer import settings as filer_settings
 
 
@@ -101,6 +114,191 @@ class FilerApiTests(TestCase):
             self.assertEqual(os.path.basename(icons[size]),
                              file_basename + '__%sx%s_q85_crop_subsampling-2_upscale.jpg' % (size, size))
 
+    @skipUnless(ET_2, 'Skipping for easy_thumbnails version < 2.0')
+    def test_thumbnails_decode_the_source_once(self):
+        image = self.create_filer_image()
+        opened = []
+        original_open = PILImage.open
+
+        def counting_open(*args, **kwargs):
+            opened.append(args)
+            return original_open(*args, **kwargs)
+        PILImage.open = counting_open
+        try:
+            thumbnails = image.thumbnails
+        finally:
+            PILImage.open = original_open
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(set(thumbnails), set(Image.DEFAULT_THUMBNAILS))
+        sidebar_preview = image.file.get_existing_thumbnail(
+            Image.DEFAULT_THUMBNAILS['admin_sidebar_preview'])
+        self.assertEqual((sidebar_preview.width, sidebar_preview.height),
+                         (210, 158))
+        icon = image.file.get_existing_thumbnail(
+            Image.DEFAULT_THUMBNAILS['admin_directory_listing_icon'])
+        self.assertEqual((icon.width, icon.height), (48, 48))
+
+    @skipUnless(ET_2, 'Skipping for easy_thumbnails version < 2.0')
+    def test_thumbnails_source_is_decoded_reduced(self):
+        create_image(size=(1600, 1200)).save(self.filename, 'JPEG')
+        image = self.create_filer_image()
+        options = image.file.get_options({'size': (48, 48), 'crop': True})
+        source_image, source_size = image.file.generate_reduced_source_image(
+            [options])
+        self.assertEqual(source_size, (1600, 1200))
+        self.assertTrue(64 <= source_image.size[0] < 200)
+        self.assertTrue(48 <= source_image.size[1] < 150)
+
+    def test_icons_are_resolved_from_the_manifest(self):
+        image = self.create_filer_image()
+        icons = image.icons
+        image = Image.objects.get(pk=image.pk)
+        storage = image.file.thumbnail_storage
+        checked = []
+
+        def counting_exists(name):
+            checked.append(name)
+            return True
+        storage.exists = counting_exists
+        try:
+            with self.assertNumQueries(0):
+                self.assertEqual(image.icons, icons)
+                self.assertEqual(image.icons, icons)
+        finally:
+            del storage.exists
+        self.assertEqual(checked, [])
+        for size in filer_settings.FILER_ADMIN_ICON_SIZES:
+            options = image.file.get_options(
+                {'size': (int(size), int(size)), 'crop': True, 'upscale': True})
+            name, width, height = image.thumbnail_manifest[
+                image.file.get_thumbnail_name(options)]
+            self.assertEqual(storage.url(name), icons[size])
+            self.assertEqual((width, height), (int(size), int(size)))
+
+    def test_manifest_is_cleared_when_the_file_changes(self):
+        image = self.create_filer_image()
+        thumbnails = image.thumbnails
+        self.assertEqual(len(image.thumbnail_manifest), len(set(thumbnails.values())))
+        names = [entry[0] for entry in image.thumbnail_manifest.values()]
+        storage = image.file.thumbnail_storage
+        image.is_public = False
+        image.save()
+        self.assertEqual(Image.objects.get(pk=image.pk).thumbnail_manifest, {})
+        for name in names:
+            self.assertFalse(storage.exists(name))
+        image.thumbnails
+        image.file = DjangoFile(open(self.filename, 'rb'), name=self.image_name)
+        image.save()
+        self.assertEqual(Image.objects.get(pk=image.pk).thumbnail_manifest, {})
+
+    def test_dimensions_are_read_from_the_image_header(self):
+        PILImage.frombytes('RGB', (800, 600), os.urandom(800 * 600 * 3)).save(
+            self.filename, 'JPEG', quality=95)
+        image = self.create_filer_image()
+        self.assertEqual((image.width, image.height), (800, 600))
+        storage = image.file.storage
+        read = []
+        original_open = storage.open
+
+        class CountingFile(object):
+            def __init__(self, file_obj):
+                self.file_obj = file_obj
+
+            def read(self, *args):
+                data = self.file_obj.read(*args)
+                read.append(len(data))
+                return data
+
+            def __getattr__(self, name):
+                return getattr(self.file_obj, name)
+
+        def counting_open(name, mode='rb'):
+            file_obj = original_open(name, mode)
+            file_obj.file = CountingFile(file_obj.file)
+            return file_obj
+        storage.open = counting_open
+        try:
+            image.default_caption = 'caption'
+            image.save()
+            self.assertEqual(read, [])
+            image._width = image._height = None
+            image.save()
+        finally:
+            del storage.open
+        self.assertEqual((image.width, image.height), (800, 600))
+        self.assertTrue(0 < sum(read) < image.size / 10)
+
+    def test_dimensions_are_read_with_range_requests(self):
+        image = self.create_filer_image()
+        storage = image.file.storage
+        ranges = []
+
+        def read_range(name, offset, size):
+            ranges.append((offset, size))
+            with storage.open(name) as file_obj:
+                file_obj.seek(offset)
+                return file_obj.read(size)
+        storage.read_range = read_range
+        try:
+            info = image.probe_file()
+        finally:
+            del storage.read_range
+        self.assertEqual((info.width, info.height, info.format),
+                         (image.width, image.height, 'JPEG'))
+        self.assertEqual(ranges[0][0], 0)
+
+    def save_image_with_exif(self):
+        # a TIFF header with an IFD holding DateTimeOriginal and SubjectLocation
+        date = b'2015:06:07 08:09:10\x00'
+        exif = (b'Exif\x00\x00II*\x00' + struct.pack('<IH', 8, 2) +
+                struct.pack('<HHII', 0x9003, 2, len(date), 38) +
+                struct.pack('<HHIHH', 0xA214, 3, 2, 400, 300) +
+                struct.pack('<I', 0) + date)
+        self.img.save(self.filename, 'JPEG', exif=exif)
+
+    def test_image_data_is_read_in_one_pass(self):
+        self.save_image_with_exif()
+        probed = []
+        original_probe_file = Image.probe_file
+
+        def counting_probe_file(image):
+            probed.append(image)
+            return original_probe_file(image)
+        Image.probe_file = counting_probe_file
+        try:
+            image = self.create_filer_image()
+        finally:
+            Image.probe_file = original_probe_file
+        self.assertEqual(len(probed), 1)
+        self.assertEqual(image.subject_location, '400,300')
+        if hasattr(image, 'date_taken'):
+            self.assertEqual(image.date_taken.replace(tzinfo=None),
+                             datetime(2015, 6, 7, 8, 9, 10))
+
+        image = Image.objects.get(pk=image.pk)
+        storage = image.file.storage
+
+        def failing_open(*args, **kwargs):
+            raise AssertionError('The file was opened')
+        storage.open = failing_open
+        try:
+            with self.assertNumQueries(0):
+                exif = image.exif
+        finally:
+            del storage.open
+        self.assertEqual(exif['DateTimeOriginal'], '2015:06:07 08:09:10')
+        self.assertEqual(exif['SubjectLocation'], [400, 300])
+
+    def test_exif_of_older_images_is_stored_when_read(self):
+        self.save_image_with_exif()
+        image = self.create_filer_image()
+        Image.objects.filter(pk=image.pk).update(_exif=None)
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual(image.exif['DateTimeOriginal'], '2015:06:07 08:09:10')
+        image = Image.objects.get(pk=image.pk)
+        self.assertNotEqual(image._exif, None)
+        self.assertEqual(image.exif['SubjectLocation'], [400, 300])
+
     def test_file_upload_public_destination(self):
         """
         Test where an image `is_public` == True is uploaded.
@@ -289,3 +487,216 @@ class FilerApiTests(TestCase):
         canonical = image.canonical_url
         self.assertTrue(canonical.startswith('/filer/test-path/'))
 
+    def test_canonical_redirect_is_cached(self):
+        image = self.create_filer_image()
+        canonical = image.canonical_url
+        self.client.logout()
+        self.assertRedirects(self.client.get(canonical), image.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(canonical)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.has_header('Cache-Control'))
+        with SettingsOverride(filer_settings,
+                              FILER_CANONICAL_REDIRECT_PERMANENT=True,
+                              FILER_CANONICAL_REDIRECT_MAX_AGE=300):
+            response = self.client.get(canonical)
+        self.assertEqual(response.status_code, 301)
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        # a wrong timestamp is still not found
+        self.assertEqual(self.client.get(canonical.replace(
+            '/%s/' % image.uploaded_at.strftime('%s'), '/1/')).status_code, 404)
+
+    def test_get_canonical_targets(self):
+        public_image = self.create_filer_image()
+        private_image = self.create_filer_image()
+        private_image.is_public = False
+        private_image.save()
+        file_ids = [public_image.pk, private_image.pk, 12345]
+        expected = {public_image.pk: (
+            public_image.uploaded_at.strftime('%s'), public_image.url)}
+        with self.assertNumQueries(1):
+            self.assertEqual(File.objects.get_canonical_targets(file_ids), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(File.objects.get_canonical_targets(file_ids), expected)
+        private_image.is_public = True
+        private_image.save()
+        self.assertEqual(
+            set(File.objects.get_canonical_targets(file_ids)),
+            set([public_image.pk, private_image.pk]))
+
+
+    def test_find_all_duplicates(self):
+        image_1 = self.create_filer_image()
+        image_2 = self.create_filer_image()
+        # shares the stored file of image_2, so it is not reclaimable
+        image_3 = File.objects.get(pk=image_2.pk)
+        image_3.pk = None
+        image_3.id = None
+        image_3.save()
+        self.assertEqual(image_1.sha1, image_2.sha1)
+
+        with self.assertNumQueries(1):
+            clusters = list(File.objects.iter_duplicate_clusters())
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]['count'], 3)
+        self.assertEqual(clusters[0]['stored_count'], 2)
+        self.assertEqual(clusters[0]['reclaimable'], image_1.size)
+
+        duplicates = File.objects.find_all_duplicates()
+        self.assertEqual(list(duplicates.keys()), [image_1.sha1])
+        self.assertEqual(set(duplicates[image_1.sha1]),
+                         set([image_1, image_2, image_3]))
+
+        out = StringIO()
+        call_command('find_duplicates', stdout=out)
+        self.assertIn('1 duplicate clusters / 3 files', out.getvalue())
+
+    def test_metadata_changes_do_not_touch_the_file(self):
+        image = self.create_filer_image()
+        sha1, size = image.sha1, image.size
+        self.assertTrue(sha1)
+        generate_sha1 = File.generate_sha1
+        calls = []
+        File.generate_sha1 = lambda self: calls.append(self)
+        try:
+            image = Image.objects.get(pk=image.pk)
+            image.description = 'Only metadata'
+            image.save()
+            self.assertEqual(calls, [])
+
+            image.invalidate_file_data()
+            image.save()
+            self.assertEqual(len(calls), 1)
+        finally:
+            File.generate_sha1 = generate_sha1
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual((image.sha1, image.size), (sha1, size))
+
+    def test_cache_receivers_keep_the_fast_deletes(self):
+        collector = Collector(using='default')
+        self.assertTrue(collector.can_fast_delete(ThumbnailOption.objects.all()))
+        # the files and their subclasses invalidate their cached lookups
+        self.assertTrue(post_delete.has_listeners(File))
+        self.assertTrue(post_delete.has_listeners(Image))
+
+    def test_get_by_path(self):
+        folder = Folder.objects.create(name='private', owner=self.superuser)
+        image = self.create_filer_image()
+        image.is_public = False
+        image.folder = folder
+        image.save()
+        path = image.file.name
+        file_obj = File.objects.get_by_path(path)
+        self.assertEqual(file_obj.pk, image.pk)
+        self.assertEqual(file_obj.owner_id, self.superuser.pk)
+        self.assertEqual((file_obj.sha1, file_obj.size), (image.sha1, image.size))
+        self.assertEqual(
+            (file_obj.folder.pk, file_obj.folder.tree_id, file_obj.folder.lft),
+            (folder.pk, folder.tree_id, folder.lft))
+        with self.assertNumQueries(0):
+            File.objects.get_by_path(path)
+        # saving other files keeps the lookup
+        other = self.create_filer_image()
+        other.is_public = False
+        other.save()
+        with self.assertNumQueries(0):
+            File.objects.get_by_path(path)
+        self.assertRaises(File.DoesNotExist,
+                          File.objects.get_by_path, path, is_public=True)
+
+        image.folder = None
+        image.save()
+        self.assertEqual(File.objects.get_by_path(path).folder, None)
+        image.delete()
+        self.assertRaises(File.DoesNotExist, File.objects.get_by_path, path)
+
+    def test_private_thumbnail_is_served_without_file_query(self):
+        image = self.create_filer_image()
+        image.is_public = False
+        image.save()
+        thumbnail = image.file.get_thumbnail({'size': (32, 32)})
+        response = self.client.get(thumbnail.url)
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(thumbnail.url)
+        self.assertEqual(response.status_code, 200)
+        file_table = connection.ops.quote_name(File._meta.db_table)
+        self.assertFalse([q for q in queries if file_table in q['sql']])
+
+
+class ContentAddressableStorageTests(TransactionTestCase):
+
+    def setUp(self):
+        self.settings_override = SettingsOverride(
+            filer_settings, FILER_CONTENT_ADDRESSABLE_STORAGE=True)
+        self.settings_override.__enter__()
+        self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, 'blob.jpg')
+        create_image().save(self.filename, 'JPEG')
+
+    def tearDown(self):
+        for f in File.objects.all():
+            f.delete()
+        os.remove(self.filename)
+        self.settings_override.__exit__(None, None, None)
+
+    def create_filer_image(self, **kwargs):
+        with open(self.filename, 'rb') as fh:
+            return Image.objects.create(original_filename='blob.jpg',
+                                        file=DjangoFile(fh, name='blob.jpg'),
+                                        **kwargs)
+
+    def test_uploads_share_the_blob(self):
+        image_1 = self.create_filer_image()
+        image_2 = self.create_filer_image()
+        blob = Blob.objects.get()
+        self.assertEqual(blob.name, image_1.file.name)
+        self.assertEqual(blob.name, image_2.file.name)
+        self.assertTrue(blob.name.startswith('filer_public/blobs/%s/' % blob.sha1[:2]))
+        self.assertTrue(blob.name.endswith('.jpg'))
+        self.assertEqual(blob.references, 2)
+        self.assertEqual(image_2.width, 800)
+
+        storage = filer_settings.FILER_PUBLICMEDIA_STORAGE
+        image_1.delete()
+        self.assertEqual(Blob.objects.get().references, 1)
+        self.assertTrue(storage.exists(blob.name))
+        image_2.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(storage.exists(blob.name))
+
+    def test_private_files_are_not_shared(self):
+        private_image = self.create_filer_image(is_public=False)
+        self.assertFalse(Blob.objects.exists())
+        image = self.create_filer_image()
+        name = image.file.name
+
+        private_image.is_public = True
+        private_image.save()
+        self.assertEqual(private_image.file.name, name)
+        self.assertEqual(Blob.objects.get().references, 2)
+
+        image.is_public = False
+        image.save()
+        self.assertNotEqual(image.file.name, name)
+        self.assertTrue(image.file.path.startswith(
+            filer_settings.FILER_PRIVATEMEDIA_STORAGE.location))
+        self.assertEqual(Blob.objects.get().references, 1)
+
+    def test_copy_shares_the_blob(self):
+        image = self.create_filer_image()
+        name = image._copy_file('copy.jpg')
+        self.assertEqual(name, image.file.name)
+        self.assertEqual(Blob.objects.get().references, 2)
+        Blob.objects.release(name, lambda: None)
+
+    def test_bulk_deletion_releases_the_blob(self):
+        image = self.create_filer_image()
+        self.create_filer_image()
+        self.create_filer_image()
+        File.objects.delete_files(File.objects.exclude(pk=image.pk))
+        self.assertEqual(Blob.objects.get().references, 1)
+        self.assertTrue(os.path.exists(image.file.path))
+        File.objects.delete_files(File.objects.all())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(image.file.path))
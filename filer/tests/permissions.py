@@ -1,6 +1,7 @@
 #-*- coding: utf-8 -*-
 from django.contrib.auth.models import Group
 from django.core.files import File as DjangoFile
+from django.db.models.signals import m2m_changed
 from django.conf import settings
 from django.test.testcases import TestCase
 from filer import settings as filer_settings
@@ -313,3 +314,68 @@ class FolderPermissionsTestCase(TestCase):
 
         finally:
             filer_settings.FILER_ENABLE_PERMISSIONS = old_setting
+
+    def test_permission_index_uses_tree_intervals(self):
+        request1 = Mock()
+        setattr(request1, 'user', self.test_user1)
+        child = Folder.objects.create(name='child', parent=self.folder)
+        grandchild = Folder.objects.create(name='grandchild', parent=child)
+
+        old_setting = filer_settings.FILER_ENABLE_PERMISSIONS
+        try:
+            filer_settings.FILER_ENABLE_PERMISSIONS = True
+
+            FolderPermission.objects.create(folder=self.folder, type=FolderPermission.CHILDREN, group=self.group1, can_read=FolderPermission.ALLOW)
+            FolderPermission.objects.create(folder=child, type=FolderPermission.THIS, user=self.test_user1, can_read=FolderPermission.DENY)
+
+            index = FolderPermission.objects.get_permission_index(self.test_user1, 'read')
+            self.assertEqual(index.allow.ids, set())
+            self.assertEqual(len(index.allow.trees), 1)
+            self.assertEqual(index.deny.ids, set([child.pk]))
+
+            self.folder = Folder.objects.get(pk=self.folder.pk)
+            child = Folder.objects.get(pk=child.pk)
+            grandchild = Folder.objects.get(pk=grandchild.pk)
+            self.assertEqual(self.folder.has_read_permission(request1), True)
+            self.assertEqual(child.has_read_permission(request1), False)
+            self.assertEqual(grandchild.has_read_permission(request1), True)
+            self.assertEqual(self.folder_perm.has_read_permission(request1), False)
+
+            self.assertEqual(FolderPermission.objects.get_read_id_list(self.test_user1),
+                             set([self.folder.pk, grandchild.pk]))
+        finally:
+            filer_settings.FILER_ENABLE_PERMISSIONS = old_setting
+
+    def test_group_change_receiver_only_listens_to_the_user_groups(self):
+        self.assertTrue(m2m_changed.has_listeners(self.test_user1.groups.through))
+        self.assertFalse(m2m_changed.has_listeners(Clipboard.files.through))
+
+    def test_permission_index_is_cached_and_invalidated(self):
+        FolderPermission.objects.create(folder=self.folder, type=FolderPermission.CHILDREN, group=self.group1, can_read=FolderPermission.ALLOW)
+
+        old_setting = filer_settings.FILER_ENABLE_PERMISSIONS
+        try:
+            filer_settings.FILER_ENABLE_PERMISSIONS = True
+
+            index = FolderPermission.objects.get_permission_index(self.test_user2, 'read')
+            self.assertEqual(index.covers(self.folder), False)
+            with self.assertNumQueries(0):
+                FolderPermission.objects.get_permission_index(self.test_user2, 'read')
+
+            # group membership changes invalidate the index
+            self.test_user2.groups.add(self.group1)
+            index = FolderPermission.objects.get_permission_index(self.test_user2, 'read')
+            self.assertEqual(index.covers(self.folder), True)
+            self.group1.user_set.remove(self.test_user2)
+            index = FolderPermission.objects.get_permission_index(self.test_user2, 'read')
+            self.assertEqual(index.covers(self.folder), False)
+            self.test_user2.groups.add(self.group1)
+
+            # so do tree moves
+            self.folder_perm.move_to(self.folder, 'last-child')
+            self.folder_perm.save()
+            self.folder_perm = Folder.objects.get(pk=self.folder_perm.pk)
+            index = FolderPermission.objects.get_permission_index(self.test_user2, 'read')
+            self.assertEqual(index.covers(self.folder_perm), True)
+        finally:
+            filer_settings.FILER_ENABLE_PERMISSIONS = old_setting
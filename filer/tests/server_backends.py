@@ -1,20 +1,68 @@
 #-*- coding: utf-8 -*-
 import time
-import shutil
 import os
+from io import BytesIO
+try:
+    from unittest import skipIf
+except ImportError:
+    # Django<1.9
+    from django.utils.unittest import skipIf
+from django.core.files.storage import FileSystemStorage, Storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
 from django.http import HttpResponseNotModified, Http404
 from django.test import TestCase
-from django.utils.http import http_date
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date, int_to_base36
 from filer import settings as filer_settings
-from filer.models import File
-from filer.server.backends.default import DefaultServer
+from filer.models import File, Image
+from filer.server import signing
+from filer.server.backends.default import DefaultServer, FileResponse
 from filer.server.backends.nginx import NginxXAccelRedirectServer
+from filer.server.backends.presigned import PresignedRedirectServer
 from filer.server.backends.xsendfile import ApacheXSendfileServer
-from filer.tests.helpers import create_image
+from filer.tests.helpers import create_image, create_superuser, SettingsOverride
 from filer.tests.utils import Mock
 
 
+class NoPathStorage(Storage):
+    """
+    Behaves like a remote storage: files have no local path.
+    """
+    def __init__(self, location):
+        self.wrapped = FileSystemStorage(location=location)
+
+    def _open(self, name, mode='rb'):
+        return self.wrapped.open(name, mode)
+
+    def exists(self, name):
+        return self.wrapped.exists(name)
+
+    def size(self, name):
+        return self.wrapped.size(name)
+
+    def delete(self, name):
+        return self.wrapped.delete(name)
+
+
+class PresigningStorage(FileSystemStorage):
+    """
+    Behaves like an object storage issuing presigned URLs.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PresigningStorage, self).__init__(*args, **kwargs)
+        self.issued = []
+
+    def presigned_url(self, name, expires, content_disposition=None):
+        self.issued.append(name)
+        url = 'https://objects.example.com/%s?expires=%d' % (name, expires)
+        if content_disposition:
+            url += '&disposition=%s' % content_disposition
+        return url
+
+
 class BaseServerBackendTestCase(TestCase):
     def setUp(self):
         original_filename = 'testimage.jpg'
@@ -66,6 +114,118 @@ class DefaultServerTestCase(BaseServerBackendTestCase):
         os.remove(self.filer_file.file.path)
         self.assertRaises(Http404, server.serve, *(request, self.filer_file.file))
 
+    def get_content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_streaming(self):
+        server = DefaultServer(chunk_size=100)
+        request = Mock()
+        request.META = {}
+        response = server.serve(request, self.filer_file.file)
+        with open(self.filer_file.file.path, 'rb') as fh:
+            data = fh.read()
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(data))
+        self.assertEqual(response['ETag'], '"%s"' % self.filer_file.sha1)
+        self.assertEqual(self.get_content(response), data)
+
+    @skipIf(FileResponse is None, 'FileResponse requires Django >= 1.8')
+    def test_file_wrapper(self):
+        server = DefaultServer(chunk_size=100)
+        request = Mock()
+        request.META = {}
+        response = server.serve(request, self.filer_file.file)
+        # WSGI servers can pass the file to their wsgi.file_wrapper
+        self.assertEqual(response.file_to_stream.name, self.filer_file.file.path)
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks[0]), 100)
+        response.close()
+        self.assertTrue(response.file_to_stream.closed)
+
+    def test_if_none_match(self):
+        server = DefaultServer()
+        request = Mock()
+        request.META = {'HTTP_IF_NONE_MATCH': '"%s"' % self.filer_file.sha1}
+        response = server.serve(request, self.filer_file.file)
+        self.assertTrue(isinstance(response, HttpResponseNotModified))
+
+        request.META = {'HTTP_IF_NONE_MATCH': '"other"'}
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 200)
+
+    def test_range(self):
+        server = DefaultServer()
+        request = Mock()
+        with open(self.filer_file.file.path, 'rb') as fh:
+            data = fh.read()
+        size = len(data)
+
+        request.META = {'HTTP_RANGE': 'bytes=10-19'}
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % size)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.get_content(response), data[10:20])
+
+        request.META = {'HTTP_RANGE': 'bytes=-5'}
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_content(response), data[-5:])
+
+        request.META = {'HTTP_RANGE': 'bytes=%d-' % size}
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % size)
+
+        # malformed headers are ignored
+        request.META = {'HTTP_RANGE': 'bytes=5-1'}
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 200)
+
+    def test_multiple_ranges(self):
+        server = DefaultServer()
+        request = Mock()
+        request.META = {'HTTP_RANGE': 'bytes=0-4,10-14'}
+        with open(self.filer_file.file.path, 'rb') as fh:
+            data = fh.read()
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(
+            response['Content-Type'].startswith('multipart/byteranges'))
+        content = self.get_content(response)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertTrue(data[0:5] in content)
+        self.assertTrue(data[10:15] in content)
+
+    def test_if_range(self):
+        server = DefaultServer()
+        request = Mock()
+        request.META = {
+            'HTTP_RANGE': 'bytes=0-4',
+            'HTTP_IF_RANGE': '"%s"' % self.filer_file.sha1,
+        }
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 206)
+
+        request.META['HTTP_IF_RANGE'] = '"outdated"'
+        response = server.serve(request, self.filer_file.file)
+        self.assertEqual(response.status_code, 200)
+
+    def test_storage_without_path(self):
+        server = DefaultServer()
+        request = Mock()
+        request.META = {'HTTP_RANGE': 'bytes=0-9'}
+        with open(self.filer_file.file.path, 'rb') as fh:
+            data = fh.read()
+        file_obj = self.filer_file.file
+        file_obj.storage = NoPathStorage(
+            location=filer_settings.FILER_PRIVATEMEDIA_STORAGE.location)
+        response = server.serve(request, file_obj, save_as=True)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_content(response), data[:10])
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=testimage.jpg')
+
 
 class NginxServerTestCase(BaseServerBackendTestCase):
     def setUp(self):
@@ -132,3 +292,133 @@ class XSendfileServerTestCase(BaseServerBackendTestCase):
         # make sure the file object was never opened (otherwise the whole delegating to nginx would kinda
         # be useless)
         self.assertTrue(self.filer_file.file.closed)
+
+
+class PresignedRedirectServerTestCase(BaseServerBackendTestCase):
+    def setUp(self):
+        super(PresignedRedirectServerTestCase, self).setUp()
+        self.file_obj = self.filer_file.file
+        self.file_obj.storage = PresigningStorage(
+            location=self.file_obj.storage.location)
+
+    def test_redirect(self):
+        server = PresignedRedirectServer(max_age=60)
+        response = server.serve(Mock(), self.file_obj, save_as=False)
+        self.assertEqual(response.status_code, 302)
+        url, expires = response['Location'].split('?expires=')
+        self.assertEqual(url, 'https://objects.example.com/%s' % self.file_obj.name)
+        self.assertTrue(int(expires) >= time.time() + 60)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        # the file is not opened, not even by the storage
+        self.assertTrue(self.file_obj.closed)
+
+    def test_urls_are_cached(self):
+        server = PresignedRedirectServer()
+        locations = set(server.serve(Mock(), self.file_obj, save_as=False)['Location']
+                        for i in range(3))
+        self.assertEqual(len(locations), 1)
+        self.assertEqual(self.file_obj.storage.issued, [self.file_obj.name])
+
+    def test_save_as(self):
+        server = PresignedRedirectServer()
+        response = server.serve(Mock(), self.file_obj, save_as='report.pdf')
+        self.assertIn('&disposition=attachment;', response['Location'])
+        self.assertTrue(response['Location'].endswith('filename=report.pdf'))
+        self.assertFalse(response.has_header('Content-Disposition'))
+
+    def test_signer(self):
+        calls = []
+
+        def signer(storage, name, expires, **params):
+            calls.append((storage, name))
+            return '/signed/%s' % name
+        server = PresignedRedirectServer(signer=signer)
+        response = server.serve(Mock(), self.file_obj, save_as=False)
+        self.assertEqual(response['Location'], '/signed/%s' % self.file_obj.name)
+        self.assertEqual(calls, [(self.file_obj.storage, self.file_obj.name)])
+
+
+class SignedUrlsTestCase(BaseServerBackendTestCase):
+    def get_content(self, response):
+        return b''.join(response.streaming_content)
+
+    def get_unsigned_url(self):
+        return self.filer_file.url
+
+    def get_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def test_signed_url(self):
+        superuser = create_superuser()
+        with SettingsOverride(filer_settings, FILER_SIGNED_URLS=True):
+            # the plain URLs are not signed
+            self.assertNotIn('token=', self.filer_file.url)
+            self.assertEqual(self.filer_file.get_signed_url(
+                self.get_request(AnonymousUser())), None)
+            url = self.filer_file.get_signed_url(self.get_request(superuser))
+            self.assertIn('?token=', url)
+            # the token is only valid for the user it was signed for
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.client.login(username='admin', password='secret')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.get_content(response),
+                             open(self.filer_file.file.path, 'rb').read())
+            file_table = connection.ops.quote_name(File._meta.db_table)
+            self.assertFalse([q for q in queries if file_table in q['sql']])
+            self.client.logout()
+            # without the token the permissions are checked
+            self.assertEqual(
+                self.client.get(self.get_unsigned_url()).status_code, 404)
+        # tokens are ignored when signed URLs are disabled
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalid_tokens(self):
+        path = self.filer_file.file.name
+        expired = int(time.time()) - 1
+        with SettingsOverride(filer_settings, FILER_SIGNED_URLS=True):
+            for token in ['', 'garbage', '..', 'zzzzzzzzzzzzzzzzz..0',
+                          signing.sign('other/path'),
+                          signing.sign(path)[:-1],
+                          '%s..%s' % (int_to_base36(expired),
+                                      signing.get_signature(path, expired, None))]:
+                response = self.client.get(self.get_unsigned_url(),
+                                           {'token': token})
+                self.assertEqual(response.status_code, 404, token)
+
+    def test_token_for_a_user(self):
+        superuser = create_superuser()
+        token = signing.sign(self.filer_file.file.name, user=superuser)
+        with SettingsOverride(filer_settings, FILER_SIGNED_URLS=True):
+            response = self.client.get(self.get_unsigned_url(), {'token': token})
+            self.assertEqual(response.status_code, 404)
+            self.client.login(username='admin', password='secret')
+            response = self.client.get(self.get_unsigned_url(), {'token': token})
+            self.assertEqual(response.status_code, 200)
+
+    def test_signed_thumbnail_url(self):
+        image_data = BytesIO()
+        create_image().save(image_data, 'JPEG')
+        image = Image.objects.create(is_public=False, file=SimpleUploadedFile(
+            name='signed.jpg', content=image_data.getvalue(),
+            content_type='image/jpeg'))
+        try:
+            superuser = create_superuser()
+            self.client.login(username='admin', password='secret')
+            with SettingsOverride(filer_settings, FILER_SIGNED_URLS=True):
+                self.assertEqual(image.get_signed_thumbnail_url(
+                    self.get_request(AnonymousUser()), {'size': (32, 32)}), None)
+                url = image.get_signed_thumbnail_url(
+                    self.get_request(superuser), {'size': (32, 32)})
+                self.assertIn('?token=', url)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                file_table = connection.ops.quote_name(File._meta.db_table)
+                self.assertFalse([q for q in queries if file_table in q['sql']])
+        finally:
+            image.delete()
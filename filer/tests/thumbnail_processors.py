@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from io import BytesIO
+
+from django.test import TestCase
+from PIL import Image, ImageChops, ImageStat
+
+from filer.tests.helpers import create_image
+from filer.thumbnail_processors import (get_subject_crop_box, resize_and_crop,
+                                        scale_and_crop_with_subject_location)
+
+
+class ScaleAndCropWithSubjectLocationTestCase(TestCase):
+
+    def reference(self, im, size, subject_location):
+        """ Resizes the whole image first, like the processor used to """
+        source_x, source_y = [float(v) for v in im.size]
+        scale = max(size[0] / source_x, size[1] / source_y)
+        scaled_size = (int(source_x * scale), int(source_y * scale))
+        crop_box = get_subject_crop_box(
+            scaled_size, size, (scaled_size[0] * subject_location[0] / source_x,
+                                scaled_size[1] * subject_location[1] / source_y))
+        return resize_and_crop(im, scaled_size, crop_box)
+
+    def assertSimilar(self, image, expected):
+        self.assertEqual(image.size, expected.size)
+        difference = ImageStat.Stat(ImageChops.difference(
+            image.convert('RGB'), expected.convert('RGB')))
+        self.assertTrue(max(difference.mean) < 1, difference.mean)
+
+    def test_only_the_cropped_part_is_resized(self):
+        for source_size, size, subject_location in [
+                ((4000, 500), (200, 200), (3500, 100)),
+                ((500, 4000), (100, 150), (20, 3900)),
+                ((1600, 1200), (300, 100), (800, 600)),
+                ((1600, 1200), (48, 48), (0, 0))]:
+            im = create_image(size=source_size)
+            result = scale_and_crop_with_subject_location(
+                im, size, subject_location='%d,%d' % subject_location,
+                crop=True)
+            self.assertSimilar(result, self.reference(im, size, subject_location))
+
+    def test_jpegs_are_decoded_reduced(self):
+        data = BytesIO()
+        create_image(size=(3200, 800)).save(data, 'JPEG')
+        im = Image.open(BytesIO(data.getvalue()))
+        result = scale_and_crop_with_subject_location(
+            im, (100, 100), subject_location='3000,400', crop=True)
+        self.assertEqual(result.size, (100, 100))
+        self.assertTrue(im.size[0] < 3200)
+        data.seek(0)
+        expected = self.reference(Image.open(data), (100, 100), (3000, 400))
+        self.assertSimilar(result, expected)
+
+    def test_no_crop_needed(self):
+        im = create_image(size=(400, 300))
+        result = scale_and_crop_with_subject_location(
+            im, (800, 600), subject_location='100,100', crop=True)
+        self.assertEqual(result.size, (400, 300))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+from tempfile import mkdtemp
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.test import TestCase
+
+from filer.utils.transfer import transfer_file
+
+
+class MemoryStorage(Storage):
+    """ A storage without local paths, like most remote storages """
+    def __init__(self):
+        self.files = {}
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.files[name], name=name)
+
+    def _save(self, name, content):
+        self.files[name] = b''.join(content.chunks())
+        return name
+
+    def exists(self, name):
+        return name in self.files
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+
+class CopyingStorage(FileSystemStorage):
+    def __init__(self, *args, **kwargs):
+        super(CopyingStorage, self).__init__(*args, **kwargs)
+        self.copied = []
+
+    def server_side_copy(self, src_storage, src_name, dst_name):
+        if not isinstance(src_storage, CopyingStorage):
+            raise NotImplementedError
+        self.copied.append(src_name)
+        return self.save(dst_name, ContentFile(src_storage.open(src_name).read()))
+
+
+class TransferFileTestCase(TestCase):
+
+    def setUp(self):
+        self.src = FileSystemStorage(location=mkdtemp(dir=settings.FILE_UPLOAD_TEMP_DIR))
+        self.dst = FileSystemStorage(location=mkdtemp(dir=settings.FILE_UPLOAD_TEMP_DIR))
+        self.name = self.src.save('a/file.txt', ContentFile(b'content'))
+
+    def tearDown(self):
+        shutil.rmtree(self.src.location)
+        shutil.rmtree(self.dst.location)
+
+    def test_move_links_local_files(self):
+        inode = os.stat(self.src.path(self.name)).st_ino
+        name = transfer_file(self.src, self.name, self.dst, 'b/file.txt', move=True)
+        self.assertEqual(name, 'b/file.txt')
+        self.assertEqual(os.stat(self.dst.path(name)).st_ino, inode)
+        self.assertFalse(self.src.exists(self.name))
+
+    def test_move_to_taken_name(self):
+        self.dst.save('b/file.txt', ContentFile(b'other'))
+        name = transfer_file(self.src, self.name, self.dst, 'b/file.txt', move=True)
+        self.assertNotEqual(name, 'b/file.txt')
+        self.assertEqual(self.dst.open(name).read(), b'content')
+        self.assertEqual(self.dst.open('b/file.txt').read(), b'other')
+
+    def test_copy_keeps_source(self):
+        name = transfer_file(self.src, self.name, self.dst, 'b/file.txt')
+        self.assertNotEqual(os.stat(self.dst.path(name)).st_ino,
+                            os.stat(self.src.path(self.name)).st_ino)
+        self.assertEqual(self.dst.open(name).read(), b'content')
+        self.assertTrue(self.src.exists(self.name))
+
+    def test_move_streams_without_local_path(self):
+        dst = MemoryStorage()
+        name = transfer_file(self.src, self.name, dst, 'b/file.txt', move=True)
+        self.assertEqual(dst.files, {name: b'content'})
+        self.assertFalse(self.src.exists(self.name))
+        name = transfer_file(dst, name, self.dst, 'c/file.txt', move=True)
+        self.assertEqual(self.dst.open(name).read(), b'content')
+        self.assertEqual(dst.files, {})
+
+    def test_server_side_copy(self):
+        src = CopyingStorage(location=self.src.location)
+        dst = CopyingStorage(location=self.dst.location)
+        name = transfer_file(src, self.name, dst, 'b/file.txt', move=True)
+        self.assertEqual(dst.copied, [self.name])
+        self.assertEqual(self.dst.open(name).read(), b'content')
+        self.assertFalse(self.src.exists(self.name))
@@ -33,6 +33,82 @@ def normalize_subject_location(subject_location):
     return False
 
 
+def get_subject_crop_box(size, target_size, subject):
+    """
+    Returns the box of ``target_size`` (at most ``size``) in an image of
+    ``size`` that has ``subject`` in its center, or as close to the center as
+    the image allows.
+    """
+    res_x, res_y = size
+    subj_x, subj_y = subject
+    target_x, target_y = target_size
+    ex = (res_x - min(res_x, target_x)) / 2
+    ey = (res_y - min(res_y, target_y)) / 2
+    fx, fy = res_x - ex, res_y - ey
+
+    # box_width, box_height: dimensions of the target image
+    box_width, box_height = fx - ex, fy - ey
+
+    # try putting the box in the center around the subject point
+    # (this will be partially outside of the image in most cases)
+    tex, tey = subj_x - (box_width / 2), subj_y - (box_height / 2)
+    tfx, tfy = subj_x + (box_width / 2), subj_y + (box_height / 2)
+    if tex < 0:
+        # its out of the img to the left, move both to the right until tex is 0
+        tfx = tfx - tex  # tex is negative!
+        tex = 0
+    elif tfx > res_x:
+        # its out of the img to the right
+        tex = tex - (tfx - res_x)
+        tfx = res_x
+
+    if tey < 0:
+        # its out of the img to the top, move both to the bottom until tey is 0
+        tfy = tfy - tey  # tey is negative!)
+        tey = 0
+    elif tfy > res_y:
+        # its out of the img to the bottom
+        tey = tey - (tfy - res_y)
+        tfy = res_y
+    return int(tex), int(tey), int(tfx), int(tfy)
+
+
+def resize_and_crop(im, scaled_size, crop_box):
+    """
+    Resizes the whole image to ``scaled_size`` and crops ``crop_box`` (in
+    the coordinates of the resized image) out of it.
+    """
+    im = im.resize(scaled_size, resample=Image.ANTIALIAS)
+    return im.crop(crop_box)
+
+
+def crop_and_resize(im, scaled_size, crop_box):
+    """
+    Like ``resize_and_crop``, but only resizes the part of the image that
+    ends up in ``crop_box``. Needs Pillow 4.2+ (``resize(box=...)``).
+    """
+    scale_x = float(im.size[0]) / scaled_size[0]
+    scale_y = float(im.size[1]) / scaled_size[1]
+    source_box = (crop_box[0] * scale_x, crop_box[1] * scale_y,
+                  crop_box[2] * scale_x, crop_box[3] * scale_y)
+    return im.resize((crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]),
+                     resample=Image.ANTIALIAS, box=source_box)
+
+
+def _draft(im, scaled_size):
+    """
+    Lets JPEGs that were not decoded yet be decoded at 1/2, 1/4 or 1/8 of
+    their resolution, as long as that is at least ``scaled_size``.
+    """
+    if getattr(im, 'format', None) != 'JPEG' or not getattr(im, 'tile', None):
+        return im
+    try:
+        im.draft(im.mode, scaled_size)
+    except Exception:
+        pass
+    return im
+
+
 def scale_and_crop_with_subject_location(im, size, subject_location=False,
                                          zoom=None, crop=False, upscale=False,
                                          **kwargs):
@@ -45,6 +121,10 @@ def scale_and_crop_with_subject_location(im, size, subject_location=False,
 
     ``crop`` needs to be set for this to work, but any special cropping
     parameters will be ignored.
+
+    The crop box is computed first and only the part of the image inside it
+    is resized, so cropping a small part out of a panorama doesn't resize
+    all of it.
     """
     subject_location = normalize_subject_location(subject_location)
     if not (subject_location and crop):
@@ -76,57 +156,46 @@ def scale_and_crop_with_subject_location(im, size, subject_location=False,
             target_y = round(source_y * scale)
         scale *= (100 + int(zoom)) / 100.0
 
-    if scale < 1.0 or (scale > 1.0 and upscale):
-        im = im.resize((int(source_x * scale), int(source_y * scale)),
-                       resample=Image.ANTIALIAS)
+    resize = scale < 1.0 or (scale > 1.0 and upscale)
     # --endsnip-- begin real code
 
     # ===============================
     # subject location aware cropping
     # ===============================
-    # res_x, res_y: the resolution of the possibly already resized image
-    res_x, res_y = [float(v) for v in im.size]
+    if resize:
+        scaled_size = (int(source_x * scale), int(source_y * scale))
+        im = _draft(im, scaled_size)
+    else:
+        scaled_size = im.size
+    # res_x, res_y: the resolution of the possibly resized image
+    res_x, res_y = [float(v) for v in scaled_size]
 
-    # subj_x, subj_y: the position of the subject (maybe already re-scaled)
+    # subj_x, subj_y: the position of the subject (maybe re-scaled)
     subj_x = res_x * float(subject_location[0]) / source_x
     subj_y = res_y * float(subject_location[1]) / source_y
-    ex = (res_x - min(res_x, target_x)) / 2
-    ey = (res_y - min(res_y, target_y)) / 2
-    fx, fy = res_x - ex, res_y - ey
-
-    # box_width, box_height: dimensions of the target image
-    box_width, box_height = fx - ex, fy - ey
-
-    # try putting the box in the center around the subject point
-    # (this will be partially outside of the image in most cases)
-    tex, tey = subj_x - (box_width / 2), subj_y - (box_height / 2)
-    tfx, tfy = subj_x + (box_width / 2), subj_y + (box_height / 2)
-    if tex < 0:
-        # its out of the img to the left, move both to the right until tex is 0
-        tfx = tfx - tex  # tex is negative!
-        tex = 0
-    elif tfx > res_x:
-        # its out of the img to the right
-        tex = tex - (tfx - res_x)
-        tfx = res_x
-
-    if tey < 0:
-        # its out of the img to the top, move both to the bottom until tey is 0
-        tfy = tfy - tey  # tey is negative!)
-        tey = 0
-    elif tfy > res_y:
-        # its out of the img to the bottom
-        tey = tey - (tfy - res_y)
-        tfy = res_y
-    if ex or ey:
-        crop_box = ((int(tex), int(tey), int(tfx), int(tfy)))
-        if FILER_SUBJECT_LOCATION_IMAGE_DEBUG:
-            # draw elipse on focal point for Debugging
-            draw = ImageDraw.Draw(im)
-            esize = 10
-            draw.ellipse(((subj_x - esize, subj_y - esize),
-                          (subj_x + esize, subj_y + esize)), outline="#FF0000")
+    if res_x <= target_x and res_y <= target_y:
+        # nothing to crop
+        if resize:
+            im = im.resize(scaled_size, resample=Image.ANTIALIAS)
+        return im
+
+    crop_box = get_subject_crop_box((res_x, res_y), (target_x, target_y),
+                                    (subj_x, subj_y))
+    if not resize:
         im = im.crop(crop_box)
+    else:
+        try:
+            im = crop_and_resize(im, scaled_size, crop_box)
+        except TypeError:
+            # Pillow < 4.2 can't resize a part of an image
+            im = resize_and_crop(im, scaled_size, crop_box)
+    if FILER_SUBJECT_LOCATION_IMAGE_DEBUG:
+        # draw elipse on focal point for Debugging
+        draw = ImageDraw.Draw(im)
+        esize = 10
+        subj_x, subj_y = subj_x - crop_box[0], subj_y - crop_box[1]
+        draw.ellipse(((subj_x - esize, subj_y - esize),
+                      (subj_x + esize, subj_y + esize)), outline="#FF0000")
     return im
 
 
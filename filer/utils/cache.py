@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import time
+
+from django.core.cache import cache
+
+from filer import settings as filer_settings
+
+
+def get_cache_key(*parts):
+    """
+    Builds a cache key in the filer namespace from the given parts.
+    """
+    return ':'.join(
+        [filer_settings.FILER_CACHE_PREFIX] + ['%s' % part for part in parts])
+
+
+def get_version(name):
+    """
+    Returns the current value of the version counter ``name``.
+
+    Version counters are used to invalidate whole families of cache entries
+    at once: the version is part of the cache keys, so bumping it makes all
+    the old entries unreachable.
+    """
+    key = get_cache_key('version', name)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time instead of 1, so that a counter which
+        # got evicted never goes back to a value that was handed out before.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(name):
+    """
+    Increments the version counter ``name`` and returns the new value.
+    """
+    key = get_cache_key('version', name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter does not exist (yet or anymore)
+        return get_version(name)
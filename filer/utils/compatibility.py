@@ -22,6 +22,24 @@ LTE_DJANGO_1_7 = django.VERSION < (1, 8)
 LTE_DJANGO_1_8 = django.VERSION < (1, 9)
 LTE_DJANGO_1_9 = django.VERSION < (1, 10)
 
+try:
+    from django.db.transaction import atomic  # flake8: noqa
+except ImportError:
+    # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic  # flake8: noqa
+
+
+def on_commit(func):
+    """
+    Calls ``func`` once the current transaction is committed (Django >= 1.9),
+    or right away.
+    """
+    from django.db import transaction
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        func()
+
 
 if not six.PY3:
     fs_encoding = sys.getfilesystemencoding() or sys.getdefaultencoding()
@@ -2,10 +2,25 @@
 
 from __future__ import unicode_literals
 
-from easy_thumbnails.files import Thumbnailer
+from django.core.files.base import ContentFile
+from django.utils.six import BytesIO
+from easy_thumbnails import engine, exceptions, utils
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.files import Thumbnailer, ThumbnailFile
+from easy_thumbnails.source_generators import pil_image
+from filer.thumbnail_processors import normalize_subject_location
+import math
 import os
 import re
 
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        raise ImportError("The Python Imaging Library was not found.")
+
 # match the source filename using `__` as the seperator. ``opts_and_ext`` is non
 # greedy so it should match the last occurence of `__`.
 # in ``ThumbnailerNameMixin.get_thumbnail_name`` we ensure that there is no `__`
@@ -20,6 +35,29 @@ def thumbnail_to_original_filename(thumbnail_name):
     return None
 
 
+def get_source_scale(source_size, thumbnail_options):
+    """
+    Returns the factor by which the processors will scale a source image of
+    ``source_size`` to render a thumbnail with ``thumbnail_options``, that is
+    the fraction of the source resolution the thumbnail needs (at most 1).
+    """
+    if thumbnail_options.get('autocrop'):
+        # the image is cropped before it is scaled
+        return 1.0
+    source_x, source_y = [float(v) for v in source_size]
+    target_x, target_y = [float(v or 0) for v in thumbnail_options['size']]
+    if not source_x or not source_y:
+        return 1.0
+    if thumbnail_options.get('crop') or not target_x or not target_y:
+        scale = max(target_x / source_x, target_y / source_y)
+    else:
+        scale = min(target_x / source_x, target_y / source_y)
+    zoom = thumbnail_options.get('zoom')
+    if zoom:
+        scale *= (100 + int(zoom)) / 100.0
+    return min(scale, 1.0)
+
+
 class ThumbnailerNameMixin(object):
     thumbnail_basedir = ''
     thumbnail_subdir = ''
@@ -70,6 +108,126 @@ class ThumbnailerNameMixin(object):
 
         return os.path.join(basedir, path, subdir, filename)
 
+    def get_multiple_thumbnails(self, thumbnails_options, save=True):
+        """
+        Returns a thumbnail for each of ``thumbnails_options``, like calling
+        ``get_thumbnail`` for each of them.
+
+        The missing thumbnails are rendered from one decoded source image:
+        JPEGs are decoded at a reduced resolution (``draft()``) and the source
+        is reduced to the largest resolution needed by any of the sizes, then
+        the thumbnails are rendered from that intermediate image, largest to
+        smallest.
+        """
+        if (not hasattr(self, 'get_options') or
+                self.thumbnail_high_resolution or
+                any(o.get('HIGH_RESOLUTION') for o in thumbnails_options)):
+            # easy-thumbnails < 2.0 or high resolution thumbnails
+            return [self.get_thumbnail(o, save=save) for o in thumbnails_options]
+        thumbnails_options = [self.get_options(o) for o in thumbnails_options]
+        thumbnails = [self.get_existing_thumbnail(o) for o in thumbnails_options]
+        missing = [i for i, thumbnail in enumerate(thumbnails) if not thumbnail]
+        if not missing:
+            return thumbnails
+        source = self.generate_reduced_source_image(
+            [thumbnails_options[i] for i in missing])
+        if source is None:
+            raise exceptions.InvalidImageFormatError(
+                "The source file does not appear to be an image")
+        source_image, source_size = source
+        missing.sort(key=lambda i: get_source_scale(
+            source_size, thumbnails_options[i]), reverse=True)
+        for i in missing:
+            thumbnails[i] = self.generate_thumbnail_from_image(
+                source_image, source_size, thumbnails_options[i])
+            if save:
+                self.save_thumbnail(thumbnails[i])
+        return thumbnails
+
+    def generate_reduced_source_image(self, thumbnails_options):
+        """
+        Decodes the source image once, reduced to the largest resolution
+        needed to render all of ``thumbnails_options``. Returns the image and
+        the size of the full resolution source, or None.
+        """
+        generators = self.source_generators or [
+            utils.dynamic_import(name)
+            for name in thumbnail_settings.THUMBNAIL_SOURCE_GENERATORS]
+        if list(generators) != [pil_image]:
+            # custom source generators, they can't decode a reduced image
+            image = engine.generate_source_image(self, {}, generators)
+            return image and (image, image.size)
+        was_closed = getattr(self, 'closed', False)
+        try:
+            self.open()
+        except Exception:
+            self.seek(0)
+        try:
+            image = Image.open(BytesIO(self.read()))
+        except Exception:
+            return None
+        finally:
+            if was_closed:
+                self.close()
+        # the size of the source image the processors work on, after the
+        # EXIF orientation is applied
+        try:
+            orientation = image._getexif().get(0x0112)
+        except Exception:
+            orientation = None
+        rotated = orientation in (5, 6, 7, 8)
+        size = tuple(reversed(image.size)) if rotated else image.size
+        scale = max(get_source_scale(size, o) for o in thumbnails_options)
+        needed = [max(int(math.ceil(v * scale)), 1) for v in size]
+        if scale < 1.0:
+            # JPEGs are decoded at 1/2, 1/4 or 1/8 of their resolution, as
+            # long as that is at least the needed size
+            image.draft(image.mode,
+                        tuple(reversed(needed)) if rotated else tuple(needed))
+        try:
+            # swallow "Image file truncated" errors, like easy-thumbnails
+            image.load()
+        except IOError:
+            pass
+        image.load()
+        image = utils.exif_orientation(image)
+        factor = min(image.size[0] // needed[0], image.size[1] // needed[1])
+        if factor >= 2 and hasattr(image, 'reduce'):
+            image = image.reduce(factor)
+        return image, size
+
+    def generate_thumbnail_from_image(self, source_image, source_size,
+                                      thumbnail_options):
+        """
+        Like ``generate_thumbnail``, but renders the thumbnail from
+        ``source_image``, a possibly reduced version of the source image of
+        ``source_size``.
+        """
+        processor_options = thumbnail_options.copy()
+        subject_location = normalize_subject_location(
+            processor_options.get('subject_location'))
+        if subject_location:
+            # the subject location is given in pixels of the source image
+            processor_options['subject_location'] = (
+                int(subject_location[0] * float(source_image.size[0]) / source_size[0]),
+                int(subject_location[1] * float(source_image.size[1]) / source_size[1]))
+        thumbnail_image = engine.process_image(
+            source_image.copy(), processor_options, self.thumbnail_processors)
+        filename = self.get_thumbnail_name(
+            thumbnail_options,
+            transparent=utils.is_transparent(thumbnail_image))
+        img = engine.save_image(
+            thumbnail_image, filename=filename,
+            quality=thumbnail_options['quality'],
+            subsampling=thumbnail_options['subsampling'])
+        thumbnail = ThumbnailFile(
+            filename, file=ContentFile(img.read()),
+            storage=self.thumbnail_storage,
+            thumbnail_options=thumbnail_options)
+        thumbnail.image = thumbnail_image
+        thumbnail._committed = False
+        return thumbnail
+
 
 class ActionThumbnailerMixin(object):
     thumbnail_basedir = ''
@@ -2,8 +2,10 @@
 
 from __future__ import unicode_literals
 
+import hashlib
 import os
 
+from django.core.files.uploadhandler import FileUploadHandler
 from django.utils.encoding import force_text
 from django.utils.text import get_valid_filename as get_valid_filename_django
 from django.template.defaultfilters import slugify as slugify_django
@@ -16,6 +18,56 @@ class UploadException(Exception):
     pass
 
 
+class Sha1UploadHandler(FileUploadHandler):
+    """
+    Computes the sha1 checksum of uploaded files while their chunks are
+    received, so that the file does not have to be read again to compute it.
+
+    This handler does not store the data itself and passes every chunk on to
+    the next handler. Use ``add_sha1_upload_handler`` to install it in front of
+    the other upload handlers.
+    """
+    def __init__(self, request=None):
+        super(Sha1UploadHandler, self).__init__(request)
+        self.checksums = {}
+        self.sha = None
+
+    def new_file(self, *args, **kwargs):
+        super(Sha1UploadHandler, self).new_file(*args, **kwargs)
+        self.sha = hashlib.sha1()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.checksums[self.field_name] = self.sha.hexdigest()
+        # let the next handler return the file object
+        return None
+
+
+def add_sha1_upload_handler(request):
+    """
+    Installs a ``Sha1UploadHandler`` as first upload handler of the request.
+    Does nothing if the upload has already been processed.
+    """
+    if hasattr(request, '_files'):
+        return
+    request.upload_handlers.insert(0, Sha1UploadHandler(request))
+
+
+def set_upload_sha1(request, upload, field_name):
+    """
+    Sets the ``sha1`` attribute of ``upload`` if its checksum was computed
+    by a ``Sha1UploadHandler`` while it was received.
+    """
+    for handler in request.upload_handlers:
+        if (isinstance(handler, Sha1UploadHandler) and
+                field_name in handler.checksums):
+            upload.sha1 = handler.checksums[field_name]
+            return
+
+
 def handle_upload(request):
     if not request.method == "POST":
         raise UploadException("AJAX request not valid: must be POST")
@@ -89,6 +141,7 @@ def handle_upload(request):
             if file_obj:
                 upload = file_obj
                 break
+        set_upload_sha1(request, upload, None)
     else:
         if len(request.FILES) == 1:
             upload, filename, is_raw = handle_request_files_upload(request)
@@ -109,7 +162,8 @@ def handle_request_files_upload(request):
     # have one entry.
     # Thus, we can just grab the first (and only) value in the dict.
     is_raw = False
-    upload = list(request.FILES.values())[0]
+    field_name, upload = list(request.FILES.items())[0]
+    set_upload_sha1(request, upload, field_name)
     filename = upload.name
     return upload, filename, is_raw
 
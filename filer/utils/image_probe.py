@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Reading the dimensions, format and EXIF data of images from the first
+bytes of their files, without downloading whole files from remote storages.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from filer.utils.pil_exif import get_exif, serialize_exif
+
+try:
+    from PIL import ImageFile
+except ImportError:
+    try:
+        import ImageFile
+    except ImportError:
+        raise ImportError("The Python Imaging Library was not found.")
+
+
+# Size of the first read, most headers fit into it
+PROBE_CHUNK_SIZE = 16 * 1024
+# The reads double in size up to this size while the header is incomplete
+PROBE_MAX_CHUNK_SIZE = 1024 * 1024
+
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'format', 'orientation',
+                                     'exif'])
+
+
+def probe(read):
+    """
+    Returns the ``ImageInfo`` of an image, or None if it is not an image.
+
+    ``read(offset, size)`` returns ``size`` bytes of the file from
+    ``offset``, it is called with consecutive ranges until the header of the
+    image is complete.
+    """
+    parser = ImageFile.Parser()
+    offset = 0
+    size = PROBE_CHUNK_SIZE
+    while parser.image is None:
+        data = read(offset, size)
+        if not data:
+            return None
+        try:
+            parser.feed(data)
+        except Exception:
+            # decoding the data following a complete header may fail
+            if parser.image is None:
+                return None
+        offset += len(data)
+        size = min(size * 2, PROBE_MAX_CHUNK_SIZE)
+    image = parser.image
+    # see ``serialize_exif``
+    exif = serialize_exif(get_exif(image))
+    return ImageInfo(image.size[0], image.size[1], image.format,
+                     exif.get('Orientation'), exif)
+
+
+def probe_file(file_obj):
+    """
+    Returns the ``ImageInfo`` of the image in the file-like ``file_obj``,
+    read from its current position.
+    """
+    return probe(lambda offset, size: file_obj.read(size))
+
+
+def probe_stored_file(storage, name):
+    """
+    Returns the ``ImageInfo`` of the image stored at ``name`` in ``storage``.
+
+    Storages of remote files often download the whole file when it is read.
+    If ``storage`` has a ``read_range(name, offset, size)`` method returning
+    the bytes of a range of the file (e.g. an HTTP range request), only the
+    ranges holding the header are requested.
+    """
+    read_range = getattr(storage, 'read_range', None)
+    if read_range is not None:
+        return probe(lambda offset, size: read_range(name, offset, size))
+    file_obj = storage.open(name, 'rb')
+    try:
+        return probe_file(file_obj)
+    finally:
+        file_obj.close()
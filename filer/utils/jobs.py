@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Running the ``FilerJob`` instances. The ``FILER_JOB_EXECUTOR`` setting is
+the dotted path of the executor class, its ``submit(job)`` is called once the
+job is enqueued.
+"""
+from __future__ import unicode_literals
+
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from filer import settings as filer_settings
+from filer.models.jobmodels import FilerJob
+from filer.utils.compatibility import on_commit, LTE_DJANGO_1_8  # flake8: noqa
+from filer.utils.loader import load_object
+
+
+def close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def run_job(pk):
+    """
+    Runs the job ``pk`` until it is done or failed
+    ``FILER_JOB_MAX_ATTEMPTS`` times, in a thread or process of an executor.
+    """
+    try:
+        job = FilerJob.objects.run_job(pk)
+        while job is not None and job.status == FilerJob.PENDING:
+            job = FilerJob.objects.run_job(pk)
+    finally:
+        # the connections of the thread would stay open otherwise
+        close_connections()
+
+
+class ImmediateExecutor(object):
+    """
+    Runs the jobs in the request, the errors are raised as usual.
+    """
+    def submit(self, job):
+        FilerJob.objects.run_job(job.pk, max_attempts=1, raise_errors=True)
+
+
+class ThreadPoolExecutor(object):
+    """
+    Runs the jobs in a pool of ``FILER_JOB_WORKERS`` threads of the web
+    server process. The jobs pending when the process exits are resumed by
+    the ``run_filer_jobs`` management command only.
+
+    Requires Django >= 1.9: the jobs are submitted once the transaction of
+    the request is committed, the workers wouldn't see them before.
+    """
+    def __init__(self, workers=None):
+        if LTE_DJANGO_1_8:
+            raise ImproperlyConfigured(
+                '%s requires Django >= 1.9, use the WorkerExecutor'
+                % self.__class__.__name__)
+        self.workers = workers or filer_settings.FILER_JOB_WORKERS
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def create_pool(self):
+        return ThreadPool(self.workers)
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = self.create_pool()
+        return self.pool
+
+    def submit(self, job):
+        # the job must be visible to the other connections
+        on_commit(lambda: self.get_pool().apply_async(run_job, (job.pk,)))
+
+
+class ProcessPoolExecutor(ThreadPoolExecutor):
+    """
+    Runs the jobs in a pool of ``FILER_JOB_WORKERS`` processes forked from
+    the web server process.
+    """
+    def create_pool(self):
+        # The worker processes must not share the database connections.
+        # Called once the transaction of the request is committed, the
+        # connections are reopened by the next query of the request.
+        close_connections()
+        return multiprocessing.Pool(self.workers)
+
+
+class WorkerExecutor(object):
+    """
+    Leaves the jobs to the ``run_filer_jobs`` management command.
+    """
+    def submit(self, job):
+        pass
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    path = filer_settings.FILER_JOB_EXECUTOR
+    if _executor is None or _executor[0] != path:
+        _executor = (path, load_object(path)())
+    return _executor[1]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Finding the stored files and thumbnails no ``File`` refers to.
+
+The storages are listed one directory at a time and the names are checked
+against a sorted array of 64 bit hashes of the known names, so that millions
+of files can be scanned with little memory.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import hashlib
+import posixpath
+import struct
+from array import array
+
+from easy_thumbnails.conf import settings as thumbnail_settings
+
+from filer.utils.filer_easy_thumbnails import thumbnail_to_original_filename
+
+
+try:
+    array(str('q'))
+    HASH_TYPECODE = str('q')
+except ValueError:
+    # python 2 has no long long arrays
+    HASH_TYPECODE = str('l')
+HASH_SIZE = array(HASH_TYPECODE).itemsize
+HASH_FORMAT = str('<q' if HASH_SIZE == 8 else '<i')
+
+
+def get_name_hash(name):
+    return struct.unpack(
+        HASH_FORMAT, hashlib.sha1(name.encode('utf-8')).digest()[:HASH_SIZE])[0]
+
+
+class KnownNames(object):
+    """
+    A set of names, stored as a sorted array of hashes. Hash collisions can
+    only make unknown names look known, never the other way round.
+    """
+    def __init__(self, names):
+        hashes = array(HASH_TYPECODE, (get_name_hash(name) for name in names if name))
+        self.hashes = array(HASH_TYPECODE, sorted(hashes))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, name):
+        value = get_name_hash(name)
+        i = bisect.bisect_left(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+
+def walk_storage(storage, path='', exclude=()):
+    """
+    Yields the names of all the files below ``path`` in ``storage``, except
+    the ones below the directories in ``exclude``.
+    """
+    dirs, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for name in dirs:
+        subdir = posixpath.join(path, name)
+        if subdir not in exclude:
+            for name in walk_storage(storage, subdir, exclude):
+                yield name
+
+
+def get_source_name(thumbnail_name, base_dir=''):
+    """
+    Returns the name of the source file of a thumbnail generated by filer
+    (see ``ThumbnailerNameMixin.get_thumbnail_name``) or None.
+    """
+    if base_dir:
+        base_dir = base_dir.rstrip('/') + '/'
+        if not thumbnail_name.startswith(base_dir):
+            return None
+        thumbnail_name = thumbnail_name[len(base_dir):]
+    source_name = thumbnail_to_original_filename(thumbnail_name)
+    subdir = thumbnail_settings.THUMBNAIL_SUBDIR
+    if source_name and subdir:
+        path, filename = posixpath.split(source_name)
+        if posixpath.basename(path) != subdir:
+            return None
+        source_name = posixpath.join(posixpath.dirname(path), filename)
+    return source_name
+
+
+def is_older_than(storage, name, max_time):
+    """
+    ``max_time`` is a naive datetime in local time, like the modification
+    times of the storages.
+    """
+    try:
+        return storage.modified_time(name) < max_time
+    except (NotImplementedError, OSError):
+        return True
+
+
+def find_orphans(storage, known, root='', exclude=(), source_base_dir=None,
+                 max_time=None):
+    """
+    Yields the names of the files below ``root`` in ``storage`` that are not
+    in ``known``, a ``KnownNames``. If ``source_base_dir`` is given the files
+    are thumbnails: they are orphaned if their source is not in ``known``.
+
+    Files modified after ``max_time`` (a datetime) are skipped, they may
+    belong to uploads in progress.
+    """
+    for name in walk_storage(storage, root, exclude):
+        if source_base_dir is None:
+            orphaned = name not in known
+        else:
+            source_name = get_source_name(name, source_base_dir)
+            orphaned = not source_name or source_name not in known
+        if orphaned and (max_time is None or
+                         is_older_than(storage, name, max_time)):
+            yield name
+
+
+def get_storage_key(storage):
+    # storages of different classes may share a location
+    key = (getattr(storage, 'location', None),
+           getattr(storage, 'bucket_name', None))
+    return key if key != (None, None) else id(storage)
+
+
+def get_excluded_dirs(root, storage, scans):
+    """
+    Returns the roots of the other ``(storage, root)`` scans nested in
+    ``root`` of the same ``storage``, they must not be scanned twice.
+    """
+    key = get_storage_key(storage)
+    prefix = root.rstrip('/') + '/' if root else ''
+    return set(other_root.rstrip('/') for other_storage, other_root in scans
+               if get_storage_key(other_storage) == key and
+               other_root and other_root != root and
+               other_root.startswith(prefix))
+
+
+def normalize_root(root):
+    return posixpath.normpath(root).lstrip('/') if root else ''
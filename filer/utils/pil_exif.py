@@ -10,7 +10,12 @@ except ImportError:
     except ImportError:
         raise ImportError("The Python Imaging Library was not found.")
 
-from django.core.files.storage import default_storage as storage
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import six
+from django.utils.timezone import make_aware, get_current_timezone
 
 
 def get_exif(im):
@@ -26,13 +31,74 @@ def get_exif(im):
 
 
 def get_exif_for_file(file_obj):
+    storage = getattr(file_obj, 'storage', None) or default_storage
     im = Image.open(storage.open(file_obj.name), 'r')
     return get_exif(im)
 
 
+def _serialize_exif_value(value):
+    if isinstance(value, bool) or isinstance(value, six.integer_types + (float,)):
+        return value
+    if isinstance(value, six.binary_type):
+        try:
+            value = value.decode('ascii')
+        except UnicodeDecodeError:
+            return None
+    if isinstance(value, six.text_type):
+        value = value.rstrip('\x00')
+        if any(c < ' ' and c not in '\t\n\r' for c in value):
+            # binary data
+            return None
+        return value
+    if hasattr(value, 'numerator') and hasattr(value, 'denominator'):
+        # a rational of Pillow, old versions return tuples
+        return [value.numerator, value.denominator]
+    if isinstance(value, (tuple, list)):
+        values = [_serialize_exif_value(v) for v in value]
+        return None if None in values else values
+    return None
+
+
+def serialize_exif(exif_data):
+    """
+    Returns the EXIF data returned by ``get_exif`` in a form that can be
+    stored as JSON: rationals become ``[numerator, denominator]`` lists, the
+    GPS tags are decoded and binary values (maker notes, thumbnails...) are
+    left out.
+    """
+    ret = {}
+    for tag, value in exif_data.items():
+        if tag == 'GPSInfo' and isinstance(value, dict):
+            value = serialize_exif(dict(
+                (ExifTags.GPSTAGS.get(key, key), v) for key, v in value.items()))
+        else:
+            value = _serialize_exif_value(value)
+        if value is not None:
+            ret['%s' % tag] = value
+    return ret
+
+
 def get_subject_location(exif_data):
     try:
         r = (int(exif_data['SubjectLocation'][0]), int(exif_data['SubjectLocation'][1]),)
     except:
         r = None
     return r
+
+
+def get_exif_datetime(exif_data):
+    """
+    Returns the date the picture was taken (``DateTimeOriginal``) as a
+    datetime, or None.
+    """
+    try:
+        d, t = exif_data['DateTimeOriginal'].split(" ")
+        year, month, day = d.split(':')
+        hour, minute, second = t.split(':')
+        r = datetime(int(year), int(month), int(day),
+                     int(hour), int(minute), int(second))
+    except:
+        return None
+    if getattr(settings, "USE_TZ", False):
+        r = make_aware(r, get_current_timezone())
+    return r
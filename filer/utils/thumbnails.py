@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from filer import settings as filer_settings
+
+# The preview shown in the clipboard after an upload
+CLIPBOARD_PREVIEW_THUMBNAIL_OPTIONS = {
+    'size': (180, 180),
+    'crop': True,
+    'upscale': True,
+}
+
+
+def get_icon_thumbnail_options(subject_location=None):
+    """
+    Returns the thumbnail options of the admin icons, keyed by size.
+    """
+    return dict(
+        (size, {'size': (int(size), int(size)),
+                'crop': True,
+                'upscale': True,
+                'subject_location': subject_location})
+        for size in filer_settings.FILER_ADMIN_ICON_SIZES)
+
+
+def get_required_thumbnail_options(image, thumbnail_options=None):
+    """
+    Returns the options of all the thumbnails filer may render for
+    ``image``: ``DEFAULT_THUMBNAILS``, the admin icons, the clipboard preview
+    and the sizes defined as ``ThumbnailOption`` (``thumbnail_options`` is
+    the list of their ``as_dict``, it is queried if not given).
+    """
+    if thumbnail_options is None:
+        from filer.models.thumbnailoptionmodels import ThumbnailOption
+        thumbnail_options = [o.as_dict for o in ThumbnailOption.objects.all()]
+    options = []
+    for opts in image.DEFAULT_THUMBNAILS.values():
+        opts = dict(opts)
+        opts['subject_location'] = image.subject_location
+        options.append(opts)
+    options.extend(get_icon_thumbnail_options(image.subject_location).values())
+    options.append(dict(CLIPBOARD_PREVIEW_THUMBNAIL_OPTIONS))
+    options.extend(dict(opts) for opts in thumbnail_options)
+    return options
+
+
+def pregenerate_thumbnails(image, thumbnail_options=None):
+    """
+    Generates the thumbnails of ``image`` that don't exist yet (see
+    ``get_required_thumbnail_options``), so they don't have to be generated
+    while rendering a page, and records them all in the thumbnail manifest of
+    the image. Returns the number of generated and of already
+    existing thumbnails.
+    """
+    thumbnailer = image.file
+    missing = []
+    existing = []
+    seen = set()
+    for options in get_required_thumbnail_options(image, thumbnail_options):
+        name = thumbnailer.get_thumbnail_name(options)
+        if name in seen:
+            continue
+        seen.add(name)
+        thumbnail = thumbnailer.get_existing_thumbnail(options)
+        if thumbnail:
+            existing.append((options, thumbnail))
+        else:
+            missing.append(options)
+    if missing:
+        # decode the source image only once for all sizes
+        existing.extend(zip(missing, thumbnailer.get_multiple_thumbnails(missing)))
+    image.update_thumbnail_manifest(existing)
+    return len(missing), len(seen) - len(missing)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Moving and copying stored files between storages without loading them into
+memory.
+"""
+from __future__ import unicode_literals
+
+import errno
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
+
+from filer.utils.compatibility import atomic
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+# Errors of os.link() meaning the file has to be copied instead
+LINK_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           getattr(errno, 'ENOTSUP', errno.EPERM),
+                           getattr(errno, 'EOPNOTSUPP', errno.EPERM))
+
+# Errors of the FICLONE ioctl and of os.copy_file_range() meaning the file
+# system can't copy the data by itself
+CLONE_UNSUPPORTED_ERRNOS = LINK_UNSUPPORTED_ERRNOS + (
+    errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EBADF)
+
+# linux ioctl sharing the data blocks of two files (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_local_path(storage, name):
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def link_file(src_path, dst_storage, dst_name):
+    """
+    Hard links ``src_path`` to an available name based on ``dst_name`` in
+    ``dst_storage`` and returns that name. Raises OSError if the file can't
+    be linked there.
+    """
+    _makedirs(os.path.dirname(dst_storage.path(dst_name)))
+    while True:
+        name = dst_storage.get_available_name(dst_name)
+        try:
+            os.link(src_path, dst_storage.path(name))
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # the name was taken in the meantime, try the next one
+                continue
+            raise
+        return name
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def _clone_data(src_fd, dst_fd):
+    """
+    Lets the file system copy the data of ``src_fd`` to ``dst_fd``, as a
+    copy-on-write clone (reflink) or with ``copy_file_range()`` which copies
+    in the kernel. Returns False if the file system can't.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return True
+        except (IOError, OSError) as e:
+            if e.errno not in CLONE_UNSUPPORTED_ERRNOS:
+                raise
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        return False
+    copied = 0
+    while True:
+        try:
+            n = copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE * 64)
+        except OSError as e:
+            if copied or e.errno not in CLONE_UNSUPPORTED_ERRNOS:
+                raise
+            return False
+        if not n:
+            return True
+        copied += n
+
+
+def copy_local_file(src_path, dst_storage, dst_name):
+    """
+    Copies ``src_path`` to an available name based on ``dst_name`` in
+    ``dst_storage`` and returns that name. The data is cloned or copied by
+    the file system where it supports it and copied in chunks otherwise.
+    """
+    _makedirs(os.path.dirname(dst_storage.path(dst_name)))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        name = dst_storage.get_available_name(dst_name)
+        dst_path = dst_storage.path(name)
+        try:
+            dst_fd = os.open(dst_path, flags, 0o666)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # the name was taken in the meantime, try the next one
+                continue
+            raise
+        break
+    try:
+        with os.fdopen(dst_fd, 'wb') as dst, open(src_path, 'rb') as src:
+            if not _clone_data(src.fileno(), dst.fileno()):
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    except Exception:
+        os.remove(dst_path)
+        raise
+    permissions_mode = getattr(dst_storage, 'file_permissions_mode', None)
+    if permissions_mode is not None:
+        os.chmod(dst_path, permissions_mode)
+    return name
+
+
+def stream_file(src_storage, src_name, dst_storage, dst_name):
+    """
+    Copies the file in chunks through ``dst_storage.save()`` and returns the
+    name it was saved with.
+    """
+    src_file = src_storage.open(src_name, 'rb')
+    try:
+        # This is needed because most of the remote File Storage backend do
+        # not open the file.
+        src_file.open()
+        return dst_storage.save(dst_name, src_file)
+    finally:
+        src_file.close()
+
+
+def transfer_file(src_storage, src_name, dst_storage, dst_name, move=False):
+    """
+    Copies the file ``src_name`` of ``src_storage`` to ``dst_storage`` (and
+    deletes the source if ``move`` is True). Returns the name the file got
+    in ``dst_storage``, ``dst_name`` or an available name derived from it.
+
+    The cheapest way available is used:
+
+    * if ``dst_storage`` has a ``server_side_copy(src_storage, src_name,
+      dst_name)`` method (e.g. to copy within an object store), it is used.
+      It returns the name of the copy or raises ``NotImplementedError`` for
+      the storages it can't copy from.
+    * files moved between local storages on the same filesystem are hard
+      linked to their new name and unlinked from the old one.
+    * files copied between local storages are cloned (reflink) or copied by
+      the file system where it supports it. Copies are never hard linked,
+      they must stay independent of the original.
+    * otherwise the file is streamed in chunks, memory use doesn't depend on
+      its size.
+    """
+    name = None
+    server_side_copy = getattr(dst_storage, 'server_side_copy', None)
+    if server_side_copy is not None:
+        try:
+            name = server_side_copy(src_storage, src_name, dst_name)
+        except NotImplementedError:
+            pass
+    src_path = get_local_path(src_storage, src_name)
+    if (name is None and src_path is not None and
+            get_local_path(dst_storage, dst_name) is not None):
+        if move:
+            try:
+                name = link_file(src_path, dst_storage, dst_name)
+            except OSError as e:
+                if e.errno not in LINK_UNSUPPORTED_ERRNOS:
+                    raise
+        if name is None:
+            name = copy_local_file(src_path, dst_storage, dst_name)
+    if name is None:
+        name = stream_file(src_storage, src_name, dst_storage, dst_name)
+    if move:
+        src_storage.delete(src_name)
+    return name
+
+
+def set_files_public(files, is_public, workers=1, progress=None):
+    """
+    Sets ``is_public`` on ``files``, moving their stored files to the public
+    or the private storage. Returns the number of files changed.
+
+    The stored files are copied by ``workers`` threads, which only touch the
+    storages. The database is only touched in the calling thread: every
+    file is saved along with the references of its blob, and its source is
+    deleted once the transaction is committed. If a file fails, the others
+    are still saved before the first error is raised, a file that is not
+    saved keeps its source and its copy is deleted. ``progress`` is called
+    as ``progress(done, total)`` after every file.
+    """
+    tasks = []
+    for f in files:
+        if f.is_public == is_public:
+            continue
+        f.is_public = is_public
+        transfer = None
+        if f.pk and f.file:
+            f._delete_thumbnails_before_move()
+            transfer = f._plan_transfer()
+        tasks.append((f, transfer))
+
+    def copy(task):
+        f, transfer = task
+        try:
+            name = f._copy_stored_file(transfer) if transfer else None
+        except Exception as e:
+            return f, transfer, None, e
+        return f, transfer, name, None
+
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = ThreadPool(workers)
+        results = pool.imap_unordered(copy, tasks)
+    else:
+        results = (copy(task) for task in tasks)
+    errors = []
+    try:
+        for done, (f, transfer, name, error) in enumerate(results, 1):
+            if error is None:
+                try:
+                    with atomic():
+                        if transfer is not None:
+                            f._finish_transfer(transfer, name)
+                        # the file is in place already, don't move it again
+                        f._old_is_public = f.is_public
+                        f.save()
+                except Exception as e:
+                    if transfer is not None:
+                        f._discard_transfer(transfer, name)
+                    error = e
+            if error is not None:
+                errors.append(error)
+            if progress is not None:
+                progress(done, len(tasks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if errors:
+        raise errors[0]
+    return len(tasks)
@@ -5,8 +5,10 @@ from django import forms
 from django.contrib.admin import widgets
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponseRedirect, Http404
-from django.shortcuts import render, redirect, get_object_or_404
+from django.http import (HttpResponsePermanentRedirect, HttpResponseRedirect,
+                         Http404)
+from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 from django.utils.translation import ugettext_lazy as _
 
 from .models import Folder, File, Image, Clipboard, tools, FolderRoot
@@ -61,11 +63,18 @@ def canonical(request, uploaded_at, file_id):
     """
     Redirect to the current url of a public file
     """
-    filer_file = get_object_or_404(File, pk=file_id, is_public=True)
-    if (uploaded_at != filer_file.uploaded_at.strftime('%s') or
-            not filer_file.file):
+    target = File.objects.get_canonical_targets([file_id]).get(int(file_id))
+    if target is None or target[0] != uploaded_at:
         raise Http404('No %s matches the given query.' % File._meta.object_name)
-    return redirect(filer_file.url)
+    if filer_settings.FILER_CANONICAL_REDIRECT_PERMANENT:
+        response = HttpResponsePermanentRedirect(target[1])
+    else:
+        response = HttpResponseRedirect(target[1])
+    if filer_settings.FILER_CANONICAL_REDIRECT_MAX_AGE:
+        patch_cache_control(
+            response, public=True,
+            max_age=filer_settings.FILER_CANONICAL_REDIRECT_MAX_AGE)
+    return response
 
 
 @login_required